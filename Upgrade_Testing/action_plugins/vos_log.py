@@ -0,0 +1,62 @@
+# Action plugin for status lines in the upgrade event log
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = '''
+    name: vos_log
+    short_description: Record a status line in the upgrade event log
+    description:
+      - Builds one JSON record (time, level, host, ip, message and any extra
+        fields) on the control node without running a module or touching the
+        DUT, and returns it as C(vos_log).
+      - The vos_upgrade_log callback collects these records and appends them to
+        the event log in batches; nothing is read back from the log.
+    options:
+      level:
+        description: Status such as INFO, FAIL, SUCCESS or VALIDATION_FAILED.
+        required: true
+      message:
+        description: Text of the status line.
+        required: true
+      fields:
+        description: Extra keys stored with the record, for example build or differences.
+        type: dict
+'''
+
+from datetime import datetime
+
+from ansible.errors import AnsibleActionFail
+from ansible.module_utils.common.text.converters import to_text
+from ansible.plugins.action import ActionBase
+
+
+class ActionModule(ActionBase):
+
+    TRANSFERS_FILES = False
+    _VALID_ARGS = frozenset(('level', 'message', 'fields'))
+
+    def run(self, tmp=None, task_vars=None):
+        result = super(ActionModule, self).run(tmp, task_vars)
+        task_vars = task_vars or {}
+
+        level = to_text(self._task.args.get('level', '')).strip().upper()
+        message = to_text(self._task.args.get('message', '')).strip()
+        fields = self._task.args.get('fields') or {}
+        if not level or not message:
+            raise AnsibleActionFail("vos_log needs both level and message")
+        if not isinstance(fields, dict):
+            raise AnsibleActionFail("vos_log fields must be a dict")
+
+        now = datetime.now()
+        record = dict(fields)
+        record.update(
+            time=now.isoformat(timespec='seconds'),
+            level=level,
+            host=task_vars.get('inventory_hostname'),
+            ip=task_vars.get('ansible_host'),
+            message=message,
+            line='[{0}] [{1}]: {2}'.format(now.strftime('%Y-%m-%d %H:%M:%S'), level, message),
+        )
+        result.update(changed=False, vos_log=record, msg=record['line'])
+        return result
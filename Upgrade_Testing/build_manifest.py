@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Build manifest for vos_release_build/
+
+Records the image filename, architecture, size and SHA-256 of every release
+in vos_release_build/<ver>/{snb,wsm} in vos_release_build/manifest.json, so
+the vos_rollback role looks a version up in a dict instead of scanning
+directories on every host. The manifest is only rewritten when the tree
+changed, and files whose size and mtime are unchanged keep their checksum
+without being read again.
+
+Each version and architecture gets the newest build in its directory, by the
+timestamp in the filename, unless --pins names a file for it. Pins may point
+outside vos_release_build; they are stored in the manifest, so a refresh
+without --pins (download_latest_image.py) keeps them.
+"""
+
+import os
+import re
+import sys
+import json
+import argparse
+import logging
+from datetime import datetime
+
+from download_latest_image import BASE_DIR, ARCHITECTURES, BuildIndex, sha256_file
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='[%(asctime)s] %(levelname)s: %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+
+# Release directories are named like 23_1_1
+VERSION_DIR_RE = re.compile(r'^\d+(_\d+)+$')
+
+
+def manifest_path(base_dir=BASE_DIR):
+    return os.path.join(base_dir, MANIFEST_NAME)
+
+
+def load_manifest(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def scan_release_dir(base_dir=BASE_DIR, previous=None, pins=None):
+    """Return (versions, files, hashed) for the images under base_dir.
+
+    versions maps version -> arch -> newest image entry, or the image pins
+    maps version -> arch to; files maps every image path relative to
+    base_dir (absolute for pins outside it) to its size, mtime and checksum.
+    Checksums are reused from previous['files'] when size and mtime match.
+    """
+    known = (previous or {}).get('files', {})
+    versions = {}
+    files = {}
+    hashed = 0
+
+    def file_entry(path, key):
+        nonlocal hashed
+        stat = os.stat(path)
+        entry = known.get(key)
+        if not entry or entry['size'] != stat.st_size or entry['mtime_ns'] != stat.st_mtime_ns:
+            logger.info(f"Checksumming {key}")
+            entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha256_file(path)}
+            hashed += 1
+        files[key] = entry
+        return entry
+
+    for version_dir in sorted(os.listdir(base_dir)):
+        if not VERSION_DIR_RE.match(version_dir):
+            continue
+        version = version_dir.replace('_', '.')
+        for arch, arch_name, subdir, pattern in ARCHITECTURES:
+            directory = os.path.join(base_dir, version_dir, arch)
+            if not os.path.isdir(directory):
+                continue
+            images = []
+            for filename in os.listdir(directory):
+                # Older releases do not follow the J.bin naming, so only the suffix decides the architecture
+                if not filename.endswith('.bin') or filename.endswith('-wsm.bin') != (arch == 'wsm'):
+                    continue
+                path = os.path.join(directory, filename)
+                file_entry(path, os.path.relpath(path, base_dir))
+                images.append(filename)
+            if not images:
+                continue
+            # Newest build by the timestamp in its name, like the downloader
+            filename = sorted(images, key=BuildIndex._sort_key, reverse=True)[0]
+            relative = os.path.relpath(os.path.join(directory, filename), base_dir)
+            versions.setdefault(version, {})[arch] = {
+                'filename': filename,
+                'arch': arch,
+                'path': os.path.join(directory, filename),
+                'size': files[relative]['size'],
+                'sha256': files[relative]['sha256']
+            }
+
+    for version, arches in sorted((pins or {}).items()):
+        for arch, path in sorted(arches.items()):
+            if not os.path.isfile(path):
+                # No silent fallback to the newest build: vos_rollback fails for it instead
+                logger.warning(f"Pinned {arch} image for {version} not found: {path}")
+                versions.get(version, {}).pop(arch, None)
+                continue
+            relative = os.path.relpath(path, base_dir)
+            entry = file_entry(path, path if relative.startswith(os.pardir) else relative)
+            versions.setdefault(version, {})[arch] = {
+                'filename': os.path.basename(path),
+                'arch': arch,
+                'path': path,
+                'size': entry['size'],
+                'sha256': entry['sha256'],
+                'pinned': True
+            }
+    versions = dict((version, arches) for version, arches in versions.items() if arches)
+    return versions, files, hashed
+
+
+def update_manifest(base_dir=BASE_DIR, force=False, pins=None):
+    """Rescan base_dir and rewrite the manifest if anything changed. Returns (manifest, written).
+    pins replaces the stored pins; None keeps them."""
+    path = manifest_path(base_dir)
+    stored = load_manifest(path)
+    previous = {} if force else stored
+    if pins is None:
+        pins = stored.get('pins', {})
+    versions, files, hashed = scan_release_dir(base_dir, previous, pins)
+
+    if (not force and previous.get('versions') == versions and previous.get('files') == files
+            and previous.get('pins', {}) == pins):
+        return previous, False
+
+    manifest = {
+        'generated_at': datetime.now().isoformat(),
+        'base_dir': base_dir,
+        'versions': versions,
+        'files': files,
+        'pins': pins
+    }
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+    logger.info(f"Manifest written to {path}: {len(versions)} version(s), {hashed} file(s) checksummed")
+    return manifest, True
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Generate the vos_release_build manifest (filename, arch, size, SHA-256 per version)'
+    )
+    parser.add_argument(
+        '--base-dir',
+        default=BASE_DIR,
+        help='Release build directory (default: %(default)s)'
+    )
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='Re-checksum every image and rewrite the manifest'
+    )
+    parser.add_argument(
+        '--pins',
+        type=json.loads,
+        help='JSON {version: {snb|wsm: image path}} installed instead of the newest build; '
+             'replaces the pins stored in the manifest'
+    )
+    parser.add_argument(
+        '--print',
+        action='store_true',
+        help='Print the manifest as JSON'
+    )
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.base_dir):
+        logger.error(f"Release build directory {args.base_dir} does not exist")
+        return 1
+    try:
+        manifest, written = update_manifest(args.base_dir, args.force, args.pins)
+    except OSError as e:
+        logger.error(f"Could not build manifest: {e}")
+        return 1
+    if not written:
+        logger.info(f"Manifest {manifest_path(args.base_dir)} is up to date")
+    if args.print:
+        print(json.dumps(manifest, indent=2, sort_keys=True))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,134 @@
+# Callback plugin that streams task events to run_ansible.py as JSON lines
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = '''
+    name: vos_events
+    type: aggregate
+    short_description: Write task events as newline-delimited JSON
+    description:
+      - Emits one JSON object per line for playbook, task start/end and stats events.
+      - Task end events carry the status, duration and a shortened message, not the
+        whole module result, which can be megabytes of stdout.
+      - Events are written to a Unix socket, FIFO or file so run_ansible.py can follow
+        task state without parsing the default callback's text output.
+    options:
+      events_path:
+        description: Unix socket, FIFO or file that receives the events.
+        env:
+          - name: VOS_EVENTS_SOCKET
+'''
+
+import json
+import os
+import socket
+import stat
+import time
+
+from ansible.parsing.ajson import AnsibleJSONEncoder
+from ansible.plugins.callback import CallbackBase
+
+# run_ansible.py keeps at most this much of a task's details
+DETAILS_LIMIT = 4096
+
+
+class CallbackModule(CallbackBase):
+
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = 'aggregate'
+    CALLBACK_NAME = 'vos_events'
+    CALLBACK_NEEDS_ENABLED = True
+
+    def __init__(self, display=None):
+        super(CallbackModule, self).__init__(display=display)
+        self._stream = None
+        self._task_started = {}
+
+    def set_options(self, task_keys=None, var_options=None, direct=None):
+        super(CallbackModule, self).set_options(task_keys=task_keys, var_options=var_options, direct=direct)
+        path = self.get_option('events_path')
+        if path:
+            self._stream = self._open(path)
+
+    def _open(self, path):
+        """Connect to a Unix socket, or open a FIFO/file for appending."""
+        try:
+            if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.connect(path)
+                return sock.makefile('w', encoding='utf-8')
+            return open(path, 'a', encoding='utf-8')
+        except (OSError, IOError) as e:
+            self._display.warning("vos_events: cannot open {0}: {1}".format(path, e))
+            return None
+
+    def _emit(self, event_type, **fields):
+        if self._stream is None:
+            return
+        fields['event'] = event_type
+        fields['time'] = time.time()
+        try:
+            self._stream.write(json.dumps(fields, cls=AnsibleJSONEncoder) + '\n')
+            self._stream.flush()
+        except (OSError, IOError, ValueError) as e:
+            self._display.warning("vos_events: stopped writing events: {0}".format(e))
+            self._stream = None
+
+    def _details(self, result):
+        """Short human readable message for a task result."""
+        res = result._result
+        for key in ('msg', 'stderr', 'stdout', 'reason'):
+            value = res.get(key)
+            if value:
+                if not isinstance(value, str):
+                    value = json.dumps(value, cls=AnsibleJSONEncoder)
+                return value[:DETAILS_LIMIT] + '...' if len(value) > DETAILS_LIMIT else value
+        return ''
+
+    def _task_end(self, result, status):
+        host = result._host.get_name()
+        task = result._task
+        started = self._task_started.pop((host, task._uuid), None)
+        self._emit(
+            'task_end',
+            host=host,
+            task=task.get_name(),
+            task_uuid=task._uuid,
+            status=status,
+            duration=round(time.time() - started, 3) if started else None,
+            details=self._details(result),
+            ignore_errors=bool(task.ignore_errors),
+        )
+
+    def v2_playbook_on_start(self, playbook):
+        self._emit('playbook_start', playbook=playbook._file_name)
+
+    def v2_playbook_on_play_start(self, play):
+        self._emit('play_start', play=play.get_name(), hosts=play.hosts)
+
+    def v2_runner_on_start(self, host, task):
+        name = host.get_name()
+        self._task_started[(name, task._uuid)] = time.time()
+        self._emit('task_start', host=name, task=task.get_name(), task_uuid=task._uuid)
+
+    def v2_runner_on_ok(self, result):
+        self._task_end(result, 'changed' if result._result.get('changed', False) else 'ok')
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        self._task_end(result, 'failed')
+
+    def v2_runner_on_skipped(self, result):
+        self._task_end(result, 'skipped')
+
+    def v2_runner_on_unreachable(self, result):
+        self._task_end(result, 'unreachable')
+
+    def v2_playbook_on_stats(self, stats):
+        hosts = {}
+        for host in sorted(stats.processed.keys()):
+            hosts[host] = stats.summarize(host)
+        self._emit('stats', hosts=hosts)
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
@@ -0,0 +1,120 @@
+# Callback plugin that appends vos_log records to the upgrade event log
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = '''
+    name: vos_upgrade_log
+    type: aggregate
+    short_description: Append vos_log records to a JSON lines event log in batches
+    description:
+      - Buffers the records returned by vos_log tasks and appends them when the
+        next task starts, when the buffer is full and at the end of the
+        playbook, so all hosts of a task share one write.
+      - Appends are made under an exclusive lock on a .lock file next to the log,
+        so concurrent playbook runs can share it, and the log is rotated to
+        .1 .. .N once it reaches max_bytes.
+      - run_ansible.py serves the records at /api/upgrade-log.
+    options:
+      events_log:
+        description: JSON lines file the records are appended to.
+        default: /var/log/ansible/upgrade_events.jsonl
+        env:
+          - name: VOS_UPGRADE_EVENTS
+      max_bytes:
+        description: Size at which the log is rotated.
+        type: int
+        default: 10485760
+        env:
+          - name: VOS_UPGRADE_EVENTS_MAX_BYTES
+      backups:
+        description: Number of rotated logs kept.
+        type: int
+        default: 5
+        env:
+          - name: VOS_UPGRADE_EVENTS_BACKUPS
+'''
+
+import fcntl
+import json
+import os
+
+from ansible.parsing.ajson import AnsibleJSONEncoder
+from ansible.plugins.callback import CallbackBase
+
+# Flush early once this many records are waiting
+BATCH_SIZE = 100
+
+
+def rotate(path, backups):
+    """Shift path.1 .. path.(backups-1) up by one and move path to path.1."""
+    for index in range(backups - 1, 0, -1):
+        older = '{0}.{1}'.format(path, index)
+        if os.path.exists(older):
+            os.replace(older, '{0}.{1}'.format(path, index + 1))
+    if backups > 0:
+        os.replace(path, path + '.1')
+    else:
+        os.remove(path)
+
+
+def append_records(path, records, max_bytes, backups):
+    """Append records as JSON lines in one write, rotating first if path would pass max_bytes."""
+    data = ''.join(json.dumps(record, cls=AnsibleJSONEncoder, sort_keys=True) + '\n' for record in records).encode('utf-8')
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if max_bytes > 0 and os.path.exists(path) and os.path.getsize(path) + len(data) > max_bytes:
+                rotate(path, backups)
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+class CallbackModule(CallbackBase):
+
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = 'aggregate'
+    CALLBACK_NAME = 'vos_upgrade_log'
+    # Always on when the playbooks run, so vos_log records are never dropped
+    CALLBACK_NEEDS_ENABLED = False
+
+    def __init__(self, display=None):
+        super(CallbackModule, self).__init__(display=display)
+        self._pending = []
+
+    def _flush(self):
+        if not self._pending:
+            return
+        records, self._pending = self._pending, []
+        path = self.get_option('events_log')
+        try:
+            append_records(path, records, self.get_option('max_bytes'), self.get_option('backups'))
+        except (OSError, IOError) as e:
+            self._display.warning("vos_upgrade_log: could not write {0} record(s) to {1}: {2}".format(len(records), path, e))
+
+    def _collect(self, result):
+        record = result._result.get('vos_log')
+        if isinstance(record, dict):
+            self._pending.append(record)
+            if len(self._pending) >= BATCH_SIZE:
+                self._flush()
+
+    def v2_runner_on_ok(self, result):
+        self._collect(result)
+
+    def v2_playbook_on_task_start(self, task, is_conditional):
+        self._flush()
+
+    def v2_playbook_on_handler_task_start(self, task):
+        self._flush()
+
+    def v2_playbook_on_stats(self, stats):
+        self._flush()
@@ -2,14 +2,30 @@
 """
 Download latest Versa FlexVNF images from builds.versa-networks.com
 Downloads BOTH Sandybridge and Westmere versions
+
+Images are kept in a content-addressed cache (by filename, size and SHA-256)
+and published into vos_release_build/<ver>/{snb,wsm} as hard links, so an
+image that is already cached is never downloaded again. Build directory listings
+are cached and the newest build is chosen from the timestamp in its name.
+Missing images are fetched for both architectures at once, each over parallel HTTP range
+requests that resume after failures and are hashed while they stream.
 """
 
 import os
 import sys
-import subprocess
 import re
 import argparse
 import logging
+import fcntl
+import hashlib
+import json
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
 from datetime import datetime
 from html.parser import HTMLParser
@@ -22,6 +38,312 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+BASE_DIR = "/home/versa/git/ansible_automation/Upgrade_Testing/vos_release_build"
+
+# Cache lives next to the published images so hard links stay on one filesystem
+DEFAULT_CACHE_DIR = os.environ.get('VOS_IMAGE_CACHE_DIR', os.path.join(BASE_DIR, ".image_cache"))
+DEFAULT_CACHE_BUDGET_GB = float(os.environ.get('VOS_IMAGE_CACHE_BUDGET_GB', '40'))
+
+BUILDS_URL = "https://builds.versa-networks.com/versa-flexvnf"
+
+HASH_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Segmented downloads
+DEFAULT_SEGMENTS = int(os.environ.get('VOS_DOWNLOAD_SEGMENTS', '4'))
+MIN_SEGMENT_SIZE = 8 * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+HTTP_TIMEOUT = 60
+DEFAULT_PROGRESS_FILE = os.environ.get('VOS_DOWNLOAD_PROGRESS', '/var/log/ansible/image_download_progress.json')
+
+# Parsed build server listings are reused for this many seconds before revalidating
+DEFAULT_INDEX_DIR = os.path.join(DEFAULT_CACHE_DIR, "listings")
+DEFAULT_INDEX_TTL = int(os.environ.get('VOS_BUILD_INDEX_TTL', '300'))
+
+
+def sha256_file(path):
+    """SHA-256 hex digest of a file"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DownloadProgress:
+    """Per-image, per-segment download progress shared with the dashboard.
+    
+    Written as JSON to a file that run_ansible.py serves at
+    /api/download-progress; writes are throttled and atomic.
+    """
+    
+    def __init__(self, path=DEFAULT_PROGRESS_FILE, interval=0.5):
+        self.path = path
+        self.interval = interval
+        self.images = {}
+        self._last_write = 0.0
+        self._lock = threading.Lock()
+    
+    def update(self, arch, force=False, **fields):
+        with self._lock:
+            self.images.setdefault(arch, {}).update(fields)
+            now = time.time()
+            if not force and now - self._last_write < self.interval:
+                return
+            self._last_write = now
+            snapshot = {'updated': now, 'images': self.images}
+            try:
+                Path(os.path.dirname(self.path)).mkdir(parents=True, exist_ok=True)
+                tmp_path = f"{self.path}.tmp"
+                with open(tmp_path, 'w') as f:
+                    json.dump(snapshot, f)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                logger.debug(f"Could not write download progress: {e}")
+
+
+class OrderedHasher:
+    """SHA-256 over a file whose segments are written out of order.
+    
+    Bytes written at the hash frontier are hashed straight from memory. When
+    the frontier reaches a segment that has already been written further, the
+    hasher catches up by reading that range back, which is still in the page
+    cache, so the image never needs a separate hashing pass. One thread at a
+    time catches up, without holding the lock, so the other segments keep
+    writing meanwhile; whatever they write behind it is read back too.
+    """
+    
+    def __init__(self, path, segments):
+        self.path = path
+        self.segments = segments
+        self.frontier = 0
+        self.digest = hashlib.sha256()
+        self._lock = threading.Lock()
+        self._reading = False
+    
+    def reset(self):
+        with self._lock:
+            self.frontier = 0
+            self.digest = hashlib.sha256()
+    
+    def feed(self, offset, data):
+        with self._lock:
+            if self._reading:
+                return
+            if offset == self.frontier:
+                self.digest.update(data)
+                self.frontier += len(data)
+            self._reading = True
+        self._catch_up()
+    
+    def _catch_up(self):
+        """Hash the written ranges at the frontier. Only the thread that set _reading calls this."""
+        while True:
+            with self._lock:
+                written_end = next((segment['start'] + segment['done'] for segment in self.segments
+                                    if segment['start'] <= self.frontier < segment['start'] + segment['done']), None)
+                if written_end is None:
+                    self._reading = False
+                    return
+                start = self.frontier
+            hashed = 0
+            with open(self.path, 'rb') as f:
+                f.seek(start)
+                while start + hashed < written_end:
+                    chunk = f.read(min(HASH_CHUNK_SIZE, written_end - start - hashed))
+                    if not chunk:
+                        break
+                    self.digest.update(chunk)
+                    hashed += len(chunk)
+            with self._lock:
+                self.frontier = start + hashed
+                if not hashed:
+                    self._reading = False
+                    return
+    
+    def hexdigest(self, size):
+        with self._lock:
+            self._reading = True
+        self._catch_up()
+        with self._lock:
+            if self.frontier != size:
+                raise IOError(f"hashed {self.frontier} of {size} bytes")
+            return self.digest.hexdigest()
+
+
+class SegmentedDownload:
+    """Download one file over parallel HTTP range requests, resumably.
+    
+    Data goes to <output>.part and segment offsets to <output>.part.json, so a
+    failed or interrupted download continues where it stopped as long as the
+    server still reports the same size and validator (ETag/Last-Modified).
+    Servers without range support get a single streamed request.
+    """
+    
+    def __init__(self, url, output_path, arch, segments=DEFAULT_SEGMENTS, progress=None, retries=3):
+        self.url = url
+        self.output_path = output_path
+        self.part_path = f"{output_path}.part"
+        self.state_path = f"{output_path}.part.json"
+        self.arch = arch
+        self.segment_count = max(1, segments)
+        self.progress = progress
+        self.retries = retries
+        self.size = None
+        self.validator = None
+        self.segments = []
+        self._state_lock = threading.Lock()
+        self._last_state_save = 0.0
+        self._started = None
+        self._resumed_bytes = 0
+    
+    @staticmethod
+    def probe(url):
+        """HEAD the url; return (size, accepts_ranges, validator)"""
+        request = urllib.request.Request(url, method='HEAD')
+        with urllib.request.urlopen(request, timeout=HTTP_TIMEOUT) as response:
+            length = response.headers.get('Content-Length')
+            accepts_ranges = response.headers.get('Accept-Ranges', '').lower() == 'bytes'
+            validator = response.headers.get('ETag') or response.headers.get('Last-Modified')
+            return (int(length) if length is not None else None), accepts_ranges, validator
+    
+    def _plan(self, accepts_ranges):
+        """Resume the saved segment plan if it still matches the server, else start over"""
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+            if (accepts_ranges and state['url'] == self.url and state['size'] == self.size and state['validator'] == self.validator
+                    and os.path.getsize(self.part_path) == self.size):
+                self._resumed_bytes = sum(segment['done'] for segment in state['segments'])
+                logger.info(f"  Resuming {self.arch.upper()} download at "
+                            f"{self._resumed_bytes / (1024 * 1024):.2f} MB")
+                return state['segments']
+        except (OSError, ValueError, KeyError):
+            pass
+        
+        count = self.segment_count if accepts_ranges else 1
+        count = max(1, min(count, self.size // MIN_SEGMENT_SIZE or 1))
+        bounds = [self.size * i // count for i in range(count + 1)]
+        with open(self.part_path, 'wb') as f:
+            f.truncate(self.size)
+        return [{'start': bounds[i], 'end': bounds[i + 1], 'done': 0} for i in range(count)]
+    
+    def _save_state(self, force=False):
+        with self._state_lock:
+            now = time.time()
+            if not force and now - self._last_state_save < 1.0:
+                return
+            self._last_state_save = now
+            tmp_path = f"{self.state_path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({'url': self.url, 'size': self.size, 'validator': self.validator,
+                           'segments': self.segments}, f)
+            os.replace(tmp_path, self.state_path)
+    
+    def _report(self, state='downloading', force=False):
+        if self.progress is None:
+            return
+        done = sum(segment['done'] for segment in self.segments)
+        elapsed = time.time() - self._started if self._started else 0
+        self.progress.update(
+            self.arch,
+            force=force,
+            filename=os.path.basename(self.output_path),
+            state=state,
+            size=self.size,
+            downloaded=done,
+            bytes_per_sec=int((done - self._resumed_bytes) / elapsed) if elapsed > 0 else 0,
+            segments=[dict(segment) for segment in self.segments]
+        )
+    
+    def _fetch_segment(self, index, hasher, ranged):
+        segment = self.segments[index]
+        attempt = 0
+        while segment['start'] + segment['done'] < segment['end']:
+            if not ranged and segment['done']:
+                # Without range support a retry starts the whole file over
+                segment['done'] = 0
+                hasher.reset()
+            offset = segment['start'] + segment['done']
+            resumed_at = offset
+            request = urllib.request.Request(self.url)
+            if ranged:
+                request.add_header('Range', f"bytes={offset}-{segment['end'] - 1}")
+            try:
+                with urllib.request.urlopen(request, timeout=HTTP_TIMEOUT) as response, \
+                        open(self.part_path, 'r+b') as f:
+                    if ranged and response.status != 206:
+                        raise IOError(f"server ignored range request (HTTP {response.status})")
+                    f.seek(offset)
+                    while offset < segment['end']:
+                        chunk = response.read(min(DOWNLOAD_CHUNK_SIZE, segment['end'] - offset))
+                        if not chunk:
+                            raise IOError("connection closed early")
+                        f.write(chunk)
+                        f.flush()
+                        segment['done'] += len(chunk)
+                        hasher.feed(offset, chunk)
+                        offset += len(chunk)
+                        self._save_state()
+                        self._report()
+            except (urllib.error.URLError, socket.timeout, IOError, OSError) as e:
+                # Only failures in a row without progress use up the retries
+                if offset > resumed_at:
+                    attempt = 0
+                attempt += 1
+                self._save_state(force=True)
+                if attempt > self.retries:
+                    raise
+                logger.warning(f"  {self.arch.upper()} segment {index} failed at byte {offset} ({e}), "
+                               f"retry {attempt}/{self.retries}")
+                time.sleep(min(2 ** attempt, 30))
+    
+    def run(self):
+        """Download the file and return its SHA-256; raises on failure"""
+        self.size, accepts_ranges, self.validator = self.probe(self.url)
+        if self.size is None:
+            raise IOError("server did not report the image size")
+        
+        self.segments = self._plan(accepts_ranges)
+        self._save_state(force=True)
+        self._started = time.time()
+        logger.info(f"  {len(self.segments)} segment(s), {self.size / (1024 * 1024):.2f} MB")
+        
+        hasher = OrderedHasher(self.part_path, self.segments)
+        threads = []
+        errors = []
+        
+        def worker(index):
+            try:
+                self._fetch_segment(index, hasher, accepts_ranges)
+            except Exception as e:
+                errors.append(e)
+        
+        for index in range(len(self.segments)):
+            thread = threading.Thread(target=worker, args=(index,))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        
+        self._save_state(force=True)
+        if errors:
+            self._report('failed', force=True)
+            raise errors[0]
+        
+        digest = hasher.hexdigest(self.size)
+        os.replace(self.part_path, self.output_path)
+        os.remove(self.state_path)
+        self._report('complete', force=True)
+        return digest
+
+
+# (arch, label, build server directory, filename pattern)
+ARCHITECTURES = [
+    ('snb', 'SNB', 'Sandybridge', r'^versa-flexvnf-.*J\.bin$'),  # Ends with J.bin (NOT J-wsm.bin)
+    ('wsm', 'WSM', 'Westmere', r'^versa-flexvnf-.*J-wsm\.bin$'),  # Ends with J-wsm.bin
+]
+
 
 class DirectoryParser(HTMLParser):
     """Parse HTML directory listing to extract file links."""
@@ -39,13 +361,307 @@ class DirectoryParser(HTMLParser):
                         self.files.append(value)
 
 
+BUILD_NAME_RE = re.compile(
+    r'^versa-flexvnf-(?P<date>\d{8})-(?P<time>\d{6})-(?P<commit>[0-9a-fA-F]+)-'
+    r'(?P<version>\d+(?:\.\d+)+)(?P<flavor>[-\w]*?)(?P<wsm>-wsm)?\.bin$'
+)
+
+
+def parse_build_name(filename):
+    """Split versa-flexvnf-YYYYMMDD-HHMMSS-<sha>-<ver>[-flavor][-wsm].bin into fields, or None"""
+    match = BUILD_NAME_RE.match(filename)
+    if not match:
+        return None
+    return {
+        'filename': filename,
+        'timestamp': datetime.strptime(match.group('date') + match.group('time'), '%Y%m%d%H%M%S').isoformat(),
+        'commit': match.group('commit'),
+        'version': match.group('version'),
+        'flavor': match.group('flavor').lstrip('-'),
+        'arch': 'wsm' if match.group('wsm') else 'snb'
+    }
+
+
+class BuildIndex:
+    """Cached, parsed build server directory listings.
+    
+    Listings are stored on disk per URL and reused for ttl seconds; after
+    that they are revalidated with If-None-Match/If-Modified-Since, and a
+    stale copy is used if the build server cannot be reached. Files are kept
+    newest build first (by the timestamp embedded in the name, then name),
+    and the newest match for each pattern is remembered with the listing.
+    """
+    
+    def __init__(self, cache_dir=DEFAULT_INDEX_DIR, ttl=DEFAULT_INDEX_TTL):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        os.makedirs(cache_dir, exist_ok=True)
+    
+    def _path(self, url):
+        return os.path.join(self.cache_dir, hashlib.sha1(url.encode()).hexdigest() + '.json')
+    
+    def _load(self, url):
+        try:
+            with open(self._path(url)) as f:
+                listing = json.load(f)
+            return listing if listing.get('url') == url else None
+        except (OSError, ValueError):
+            return None
+    
+    def _save(self, listing):
+        path = self._path(listing['url'])
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(dict((key, value) for key, value in listing.items() if key != 'from_cache'), f, indent=2)
+        os.replace(tmp_path, path)
+    
+    @staticmethod
+    def _sort_key(filename):
+        build = parse_build_name(filename)
+        # Parsed builds first, newest first; anything else after, by name
+        return (build is not None, build['timestamp'] if build else '', filename)
+    
+    def listing(self, url, refresh=False):
+        """Return the cached listing for url, revalidating it once the TTL has passed"""
+        listing = self._load(url)
+        if listing and not refresh and time.time() - listing['fetched_at'] < self.ttl:
+            listing['from_cache'] = True
+            return listing
+        
+        request = urllib.request.Request(url)
+        if listing:
+            if listing.get('etag'):
+                request.add_header('If-None-Match', listing['etag'])
+            if listing.get('last_modified'):
+                request.add_header('If-Modified-Since', listing['last_modified'])
+        
+        try:
+            logger.info(f"Fetching directory listing from: {url}")
+            with urllib.request.urlopen(request, timeout=30) as response:
+                body = response.read().decode('utf-8', 'replace')
+                headers = response.headers
+        except urllib.error.HTTPError as e:
+            if e.code == 304 and listing:
+                logger.info("  Listing not modified since last fetch")
+                listing['fetched_at'] = time.time()
+                self._save(listing)
+                listing['from_cache'] = True
+                return listing
+            if listing:
+                logger.warning(f"  Listing request failed ({e}), using cached copy")
+                listing['from_cache'] = True
+                return listing
+            raise
+        except (urllib.error.URLError, socket.timeout, OSError) as e:
+            if listing:
+                logger.warning(f"  Build server unreachable ({e}), using cached copy")
+                listing['from_cache'] = True
+                return listing
+            raise
+        
+        parser = DirectoryParser()
+        parser.feed(body)
+        files = sorted(set(parser.files), key=self._sort_key, reverse=True)
+        listing = {
+            'url': url,
+            'fetched_at': time.time(),
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'files': files,
+            'builds': [build for build in map(parse_build_name, files) if build],
+            'latest': {}
+        }
+        self._save(listing)
+        listing['from_cache'] = False
+        return listing
+    
+    def newest(self, url, pattern):
+        """Newest file in the listing at url matching pattern, or None"""
+        listing = self.listing(url)
+        if pattern in listing['latest']:
+            return listing['latest'][pattern]
+        
+        compiled = re.compile(pattern)
+        filename = next((name for name in listing['files'] if compiled.match(name)), None)
+        listing['latest'][pattern] = filename
+        self._save(listing)
+        return filename
+
+
+class ImageCache:
+    """Content-addressed image store with an LRU disk budget.
+    
+    Images are stored once as objects/<sha256> and described in index.json
+    (filename, size, sha256, arch, last use). Builds are published by linking
+    the object into the release directories, and the least recently used
+    objects are evicted when the cache grows past its budget.
+    """
+    
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, budget_bytes=int(DEFAULT_CACHE_BUDGET_GB * 1024 ** 3)):
+        self.cache_dir = cache_dir
+        self.budget_bytes = budget_bytes
+        self.objects_dir = os.path.join(cache_dir, "objects")
+        self.tmp_dir = os.path.join(cache_dir, "tmp")
+        self.index_path = os.path.join(cache_dir, "index.json")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+    
+    def object_path(self, sha256):
+        return os.path.join(self.objects_dir, sha256)
+    
+    @contextmanager
+    def lock(self, name="index"):
+        """Exclusive lock shared with other downloader processes"""
+        with open(os.path.join(self.cache_dir, f".{name}.lock"), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    
+    def _load_index(self):
+        try:
+            with open(self.index_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'entries': {}}
+    
+    def _save_index(self, index):
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.index_path)
+    
+    def lookup(self, filename, size=None, verify=False):
+        """Return the cache entry for filename, or None.
+        
+        The object must still have the recorded size (and the remote size when
+        known); with verify=True its SHA-256 is recomputed as well.
+        """
+        with self.lock():
+            index = self._load_index()
+            for entry in index['entries'].values():
+                if entry['filename'] != filename:
+                    continue
+                if size is not None and entry['size'] != size:
+                    logger.info(f"  Cached {filename} has size {entry['size']}, server has {size}")
+                    continue
+                path = self.object_path(entry['sha256'])
+                try:
+                    if os.path.getsize(path) != entry['size']:
+                        continue
+                except OSError:
+                    continue
+                if verify and sha256_file(path) != entry['sha256']:
+                    logger.warning(f"  Cached {filename} failed checksum verification, discarding")
+                    os.remove(path)
+                    continue
+                entry['last_used'] = time.time()
+                self._save_index(index)
+                return entry
+        return None
+    
+    def temp_path(self, filename):
+        """Download target inside the cache; fixed per filename so interrupted downloads resume"""
+        return os.path.join(self.tmp_dir, filename)
+    
+    def add(self, path, filename, arch, sha256=None):
+        """Move a downloaded file into the cache and return its entry"""
+        sha256 = sha256 or sha256_file(path)
+        size = os.path.getsize(path)
+        with self.lock():
+            index = self._load_index()
+            object_path = self.object_path(sha256)
+            if os.path.exists(object_path):
+                os.remove(path)
+            else:
+                os.replace(path, object_path)
+            now = time.time()
+            entry = index['entries'].get(sha256) or {'added': now}
+            entry.update({
+                'filename': filename,
+                'size': size,
+                'sha256': sha256,
+                'arch': arch,
+                'last_used': now
+            })
+            index['entries'][sha256] = entry
+            self._save_index(index)
+        logger.info(f"  Cached {filename} as {sha256}")
+        return entry
+    
+    def publish(self, entry, directory):
+        """Link a cached image into a release directory, replacing older .bin files there"""
+        os.makedirs(directory, exist_ok=True)
+        source = self.object_path(entry['sha256'])
+        target = os.path.join(directory, entry['filename'])
+        
+        for filename in os.listdir(directory):
+            file_path = os.path.join(directory, filename)
+            if filename.endswith('.bin') and (os.path.isfile(file_path) or os.path.islink(file_path)):
+                if filename == entry['filename'] and not os.path.islink(file_path) and os.path.samefile(file_path, source):
+                    continue
+                os.remove(file_path)
+                logger.info(f"  Unpublished: {filename}")
+        
+        if os.path.exists(target):
+            logger.info(f"  Already published: {target}")
+            return target
+        try:
+            os.link(source, target)
+            logger.info(f"  Hard linked {entry['filename']} into {directory}")
+        except OSError:
+            os.symlink(source, target)
+            logger.info(f"  Symlinked {entry['filename']} into {directory}")
+        return target
+    
+    def evict(self, keep=()):
+        """Remove least recently used objects until the cache fits its budget.
+        
+        Objects in keep, and objects still hard linked into a release
+        directory (removing them would not free any space), are skipped.
+        """
+        with self.lock():
+            index = self._load_index()
+            entries = sorted(index['entries'].values(), key=lambda entry: entry['last_used'])
+            total = sum(entry['size'] for entry in entries)
+            for entry in entries:
+                if total <= self.budget_bytes:
+                    break
+                path = self.object_path(entry['sha256'])
+                if entry['sha256'] in keep:
+                    continue
+                try:
+                    if os.stat(path).st_nlink > 1:
+                        continue
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                del index['entries'][entry['sha256']]
+                total -= entry['size']
+                logger.info(f"  Evicted {entry['filename']} ({entry['size'] / (1024 * 1024):.2f} MB) from image cache")
+            self._save_index(index)
+        if total > self.budget_bytes:
+            logger.warning(f"  Image cache is {total / 1024 ** 3:.2f} GB, over its budget; remaining images are in use")
+        return total
+
+
 class ImageDownloader:
     """Download and manage Versa FlexVNF images for both architectures"""
     
-    def __init__(self, build_version, manual_filename_snb=None, manual_filename_wsm=None):
+    def __init__(self, build_version, manual_filename_snb=None, manual_filename_wsm=None, cache=None,
+                 use_cache=True, verify_cache=False, builds_url=BUILDS_URL, segments=DEFAULT_SEGMENTS,
+                 progress=None, build_index=None):
         self.build_version = build_version
         self.manual_filename_snb = manual_filename_snb
         self.manual_filename_wsm = manual_filename_wsm
+        self.cache = cache or ImageCache()
+        self.use_cache = use_cache
+        self.verify_cache = verify_cache
+        self.builds_url = builds_url.rstrip('/')
+        self.segments = segments
+        self.progress = progress or DownloadProgress()
+        self.build_index = build_index or BuildIndex()
         self.version_path = None
         self.base_url = None
         self.snb_dir = None
@@ -60,13 +676,12 @@ class ImageDownloader:
     
     def set_directories(self):
         """Set download URLs and destination directories"""
-        self.base_url = f"https://builds.versa-networks.com/versa-flexvnf/{self.version_path}/latest/jammy"
+        self.base_url = f"{self.builds_url}/{self.version_path}/latest/jammy"
         
-        base_dir = "/home/versa/git/ansible_automation/Upgrade_Testing/vos_release_build"
         version_dir = self.build_version.replace('.', '_')
         
-        self.snb_dir = f"{base_dir}/{version_dir}/snb/"
-        self.wsm_dir = f"{base_dir}/{version_dir}/wsm/"
+        self.snb_dir = f"{BASE_DIR}/{version_dir}/snb/"
+        self.wsm_dir = f"{BASE_DIR}/{version_dir}/wsm/"
         
         logger.info(f"Base URL: {self.base_url}")
         logger.info(f"SNB directory: {self.snb_dir}")
@@ -78,114 +693,139 @@ class ImageDownloader:
         os.makedirs(self.wsm_dir, exist_ok=True)
         logger.info("Directories prepared")
     
-    def cleanup_old_files(self, directory, arch_name):
-        """Remove old .bin files from directory"""
-        logger.info(f"Cleaning up old files in {arch_name} directory...")
-        deleted_count = 0
-        try:
-            for filename in os.listdir(directory):
-                file_path = os.path.join(directory, filename)
-                if os.path.isfile(file_path) and filename.endswith('.bin'):
-                    os.remove(file_path)
-                    logger.info(f"  Deleted: {filename}")
-                    deleted_count += 1
-            
-            if deleted_count == 0:
-                logger.info(f"  No old files to delete")
-            else:
-                logger.info(f"  Deleted {deleted_count} file(s)")
-        except Exception as e:
-            logger.warning(f"  Error cleaning {arch_name} directory: {e}")
-    
     def get_matching_filename(self, url, pattern, arch_name):
-        """Get the filename that matches the specified pattern from directory listing"""
+        """Get the newest build matching the pattern from the (cached) directory listing"""
         try:
-            logger.info(f"Fetching directory listing from: {url}")
-            
-            # Fetch directory listing
-            result = subprocess.run(
-                ['wget', '--quiet', '-O', '-', url],
-                capture_output=True,
-                text=True,
-                check=True,
-                timeout=30
-            )
-            
-            # Parse HTML to extract file links
-            parser = DirectoryParser()
-            parser.feed(result.stdout)
-            
-            logger.info(f"Found {len(parser.files)} items in directory")
-            
-            # Filter files by the specified pattern
-            matching_files = []
-            for filename in parser.files:
-                if re.match(pattern, filename):
-                    matching_files.append(filename)
-                    logger.info(f"  ✓ Match: {filename}")
-            
-            if matching_files:
-                filename = matching_files[0]
+            filename = self.build_index.newest(url, pattern)
+            if filename:
                 logger.info(f"✓ Selected {arch_name} file: {filename}")
                 return filename
             else:
                 logger.error(f"✗ No file matching pattern '{pattern}' found for {arch_name}")
                 return None
-                
-        except subprocess.TimeoutExpired:
-            logger.error(f"Timeout fetching directory listing from {url}")
-            return None
-        except subprocess.CalledProcessError as e:
+        except (urllib.error.URLError, socket.timeout, OSError) as e:
             logger.error(f"Error fetching directory listing from {url}: {e}")
             return None
         except Exception as e:
             logger.error(f"Error parsing directory listing: {e}")
             return None
     
+    def list_builds(self, refresh=False):
+        """Builds available for this version per architecture, newest first, plus the latest of each"""
+        self.set_version_path()
+        self.set_directories()
+        builds = {}
+        latest = {}
+        fetched_at = {}
+        from_cache = True
+        for arch, arch_name, subdir, pattern in ARCHITECTURES:
+            url = f"{self.base_url}/{subdir}/"
+            listing = self.build_index.listing(url, refresh)
+            compiled = re.compile(pattern)
+            builds[arch] = [build for build in listing['builds'] if compiled.match(build['filename'])]
+            latest[arch] = builds[arch][0]['filename'] if builds[arch] else None
+            fetched_at[arch] = datetime.fromtimestamp(listing['fetched_at']).isoformat()
+            from_cache = from_cache and listing['from_cache']
+        return {
+            'version': self.build_version,
+            'base_url': self.base_url,
+            'builds': builds,
+            'latest': latest,
+            'fetched_at': fetched_at,
+            'from_cache': from_cache
+        }
+    
     def download_file(self, url, output_path, arch_name):
-        """Download a file using wget with progress indicator"""
+        """Download a file over parallel range requests; return its SHA-256, or None on failure
+        
+        A failed download keeps its partial data and resumes on the next run.
+        """
         logger.info(f"Downloading {arch_name} image...")
         logger.info(f"  From: {url}")
         logger.info(f"  To: {output_path}")
         
+        download = SegmentedDownload(url, output_path, arch_name.lower(), self.segments, self.progress)
         try:
-            # Use wget with progress bar
-            result = subprocess.run(
-                ['wget', '--progress=bar:force', '--timeout=300', '--tries=3', '-O', output_path, url],
-                check=True,
-                timeout=1800  # 30 minute timeout
-            )
-            
-            # Check if file was created and has content
-            if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
-                file_size = os.path.getsize(output_path)
-                file_size_mb = file_size / (1024 * 1024)
-                logger.info(f"✓ Download successful: {output_path}")
-                logger.info(f"  File size: {file_size_mb:.2f} MB")
-                return True
-            else:
-                logger.error(f"✗ Download failed: File not created or empty")
-                if os.path.exists(output_path):
-                    os.remove(output_path)
-                return False
-                
-        except subprocess.TimeoutExpired:
-            logger.error(f"✗ Download timeout after 30 minutes")
-            if os.path.exists(output_path):
-                os.remove(output_path)
-            return False
-        except subprocess.CalledProcessError as e:
-            logger.error(f"✗ Download failed with error code {e.returncode}")
-            if os.path.exists(output_path):
-                os.remove(output_path)
-            return False
+            sha256 = download.run()
         except Exception as e:
-            logger.error(f"✗ Download failed: {e}")
-            if os.path.exists(output_path):
-                os.remove(output_path)
-            return False
+            logger.error(f"✗ {arch_name} download failed: {e}")
+            logger.error(f"  Partial data kept in {download.part_path} for the next attempt")
+            return None
+        
+        file_size_mb = os.path.getsize(output_path) / (1024 * 1024)
+        logger.info(f"✓ Download successful: {output_path}")
+        logger.info(f"  File size: {file_size_mb:.2f} MB")
+        logger.info(f"  SHA-256: {sha256}")
+        return sha256
+    
+    def get_remote_size(self, url):
+        """Content-Length of a remote file, or None if the server does not say"""
+        try:
+            return SegmentedDownload.probe(url)[0]
+        except (urllib.error.URLError, socket.timeout, OSError, ValueError) as e:
+            logger.warning(f"  Could not get size of {url}: {e}")
+            return None
+    
+    def fetch_image(self, url, filename, directory, arch, arch_name):
+        """Publish filename into directory from the cache, downloading it only on a miss.
+        
+        Returns a (entry, source) tuple where source is 'cache' or 'download',
+        or (None, None) on failure.
+        """
+        remote_size = self.get_remote_size(url)
+        
+        # Per-image lock: a concurrent run fetching the same image waits and then hits the cache
+        with self.cache.lock(filename):
+            entry = self.cache.lookup(filename, remote_size, self.verify_cache) if self.use_cache else None
+            source = 'cache'
+            if entry:
+                logger.info(f"✓ {arch_name} image found in cache: {filename}")
+            else:
+                tmp_path = self.cache.temp_path(filename)
+                sha256 = self.download_file(url, tmp_path, arch_name)
+                if not sha256:
+                    return None, None
+                if remote_size is not None and os.path.getsize(tmp_path) != remote_size:
+                    logger.error(f"✗ {arch_name} download is {os.path.getsize(tmp_path)} bytes, expected {remote_size}")
+                    os.remove(tmp_path)
+                    return None, None
+                entry = self.cache.add(tmp_path, filename, arch, sha256)
+                source = 'download'
+            
+            self.cache.publish(entry, directory)
+        return entry, source
     
-    def log_download(self, arch, filename, path):
+    def fetch_architecture(self, arch, arch_name, subdir, pattern):
+        """Find, fetch and publish the image for one architecture.
+        
+        Returns (arch, filename, cache entry, source); entry is None on failure.
+        """
+        logger.info(f"Fetching {subdir} ({arch_name}) version...")
+        
+        url = f"{self.base_url}/{subdir}/"
+        directory = self.snb_dir if arch == 'snb' else self.wsm_dir
+        manual_filename = self.manual_filename_snb if arch == 'snb' else self.manual_filename_wsm
+        
+        filename = manual_filename if manual_filename else self.get_matching_filename(url, pattern, arch_name)
+        if not filename:
+            logger.error(f"✗ Failed to find {arch_name} file")
+            return arch, None, None, None
+        
+        entry, source = self.fetch_image(f"{url}{filename}", filename, directory, arch, arch_name)
+        if entry:
+            self.log_download(arch, filename, os.path.join(directory, filename), source)
+        return arch, filename, entry, source
+    
+    def update_manifest(self):
+        """Refresh vos_release_build/manifest.json after publishing images"""
+        # Imported here: build_manifest imports this module
+        from build_manifest import update_manifest
+        try:
+            update_manifest(BASE_DIR)
+        except OSError as e:
+            logger.warning(f"Could not update build manifest: {e}")
+    
+    def log_download(self, arch, filename, path, source='download'):
         """Log download to file"""
         log_file = "/var/log/ansible/image_downloads.log"
         log_dir = os.path.dirname(log_file)
@@ -193,7 +833,8 @@ class ImageDownloader:
         try:
             Path(log_dir).mkdir(parents=True, exist_ok=True)
             timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            log_entry = f"[{timestamp}] Downloaded {filename} ({arch}) to {path}\n"
+            action = "Published cached" if source == 'cache' else "Downloaded"
+            log_entry = f"[{timestamp}] {action} {filename} ({arch}) to {path}\n"
             
             with open(log_file, 'a') as f:
                 f.write(log_entry)
@@ -213,57 +854,32 @@ class ImageDownloader:
             self.set_version_path()
             self.set_directories()
             
-            # Prepare directories
+            # Prepare directories; older .bin files are unpublished once the new image is in place
             self.create_directories()
-            self.cleanup_old_files(self.snb_dir, "SNB")
-            self.cleanup_old_files(self.wsm_dir, "WSM")
             
             success_count = 0
             downloaded_files = {}
+            cached_files = []
+            published = set()
             
-            # Download Sandybridge version
-            logger.info("")
-            logger.info("=" * 70)
-            logger.info("Downloading Sandybridge (SNB) version...")
-            logger.info("=" * 70)
-            
-            snb_url = f"{self.base_url}/Sandybridge/"
-            snb_pattern = r'^versa-flexvnf-.*J\.bin$'  # Ends with J.bin (NOT J-wsm.bin)
-            
-            snb_filename = self.manual_filename_snb if self.manual_filename_snb else self.get_matching_filename(snb_url, snb_pattern, "SNB")
+            # Both architectures download at the same time
+            with ThreadPoolExecutor(max_workers=len(ARCHITECTURES)) as executor:
+                results = list(executor.map(lambda spec: self.fetch_architecture(*spec), ARCHITECTURES))
             
-            if snb_filename:
-                snb_full_url = f"{snb_url}{snb_filename}"
-                snb_output_path = os.path.join(self.snb_dir, snb_filename)
-                
-                if self.download_file(snb_full_url, snb_output_path, "SNB"):
+            for arch, filename, entry, source in results:
+                if entry:
                     success_count += 1
-                    downloaded_files['snb'] = snb_filename
-                    self.log_download('snb', snb_filename, snb_output_path)
-            else:
-                logger.error("✗ Failed to find SNB file")
+                    downloaded_files[arch] = filename
+                    published.add(entry['sha256'])
+                    if source == 'cache':
+                        cached_files.append(arch)
             
-            # Download Westmere version
-            logger.info("")
-            logger.info("=" * 70)
-            logger.info("Downloading Westmere (WSM) version...")
-            logger.info("=" * 70)
-            
-            wsm_url = f"{self.base_url}/Westmere/"
-            wsm_pattern = r'^versa-flexvnf-.*J-wsm\.bin$'  # Ends with J-wsm.bin
-            
-            wsm_filename = self.manual_filename_wsm if self.manual_filename_wsm else self.get_matching_filename(wsm_url, wsm_pattern, "WSM")
+            # Keep older builds for rollbacks, within the cache budget
+            self.cache.evict(keep=published)
             
-            if wsm_filename:
-                wsm_full_url = f"{wsm_url}{wsm_filename}"
-                wsm_output_path = os.path.join(self.wsm_dir, wsm_filename)
-                
-                if self.download_file(wsm_full_url, wsm_output_path, "WSM"):
-                    success_count += 1
-                    downloaded_files['wsm'] = wsm_filename
-                    self.log_download('wsm', wsm_filename, wsm_output_path)
-            else:
-                logger.error("✗ Failed to find WSM file")
+            # vos_rollback looks images up in the manifest instead of scanning directories
+            if success_count:
+                self.update_manifest()
             
             # Summary
             logger.info("")
@@ -271,6 +887,7 @@ class ImageDownloader:
             logger.info("Download Summary")
             logger.info("=" * 70)
             logger.info(f"Successfully downloaded: {success_count}/2 files")
+            logger.info(f"Served from cache: {len(cached_files)}/{success_count} files")
             
             if success_count == 2:
                 logger.info("")
@@ -286,7 +903,8 @@ class ImageDownloader:
                 return {
                     'status': 'success',
                     'downloaded': success_count,
-                    'files': downloaded_files
+                    'files': downloaded_files,
+                    'cached': cached_files
                 }
             elif success_count == 1:
                 logger.warning("")
@@ -295,7 +913,8 @@ class ImageDownloader:
                 return {
                     'status': 'partial',
                     'downloaded': success_count,
-                    'files': downloaded_files
+                    'files': downloaded_files,
+                    'cached': cached_files
                 }
             else:
                 logger.error("")
@@ -329,6 +948,15 @@ Examples:
 
   Download with manual filenames:
     %(prog)s 23.1.1 --snb-filename versa-flexvnf-...-J.bin --wsm-filename versa-flexvnf-...-J-wsm.bin
+
+  Re-download even if the image is cached:
+    %(prog)s 23.1.1 --no-cache
+
+  List available 23.1.1 builds as JSON (served from the listing cache when fresh):
+    %(prog)s 23.1.1 --list
+
+  Download from a local stand-in for the build server:
+    %(prog)s 23.1.1 --builds-url http://127.0.0.1:8000/versa-flexvnf
         """
     )
     parser.add_argument(
@@ -344,9 +972,81 @@ Examples:
         help='Manual WSM filename if auto-detection fails'
     )
     
+    parser.add_argument(
+        '--cache-dir',
+        default=DEFAULT_CACHE_DIR,
+        help='Image cache directory (default: %(default)s)'
+    )
+    parser.add_argument(
+        '--cache-budget-gb',
+        type=float,
+        default=DEFAULT_CACHE_BUDGET_GB,
+        help='Disk budget for cached images in GB (default: %(default)s)'
+    )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Download even if the image is already cached'
+    )
+    parser.add_argument(
+        '--verify-cache',
+        action='store_true',
+        help='Re-check the SHA-256 of cached images before using them'
+    )
+    
+    parser.add_argument(
+        '--builds-url',
+        default=BUILDS_URL,
+        help='Root of the build server (default: %(default)s)'
+    )
+    parser.add_argument(
+        '--segments',
+        type=int,
+        default=DEFAULT_SEGMENTS,
+        help='Parallel range requests per image (default: %(default)s)'
+    )
+    parser.add_argument(
+        '--progress-file',
+        default=DEFAULT_PROGRESS_FILE,
+        help='JSON file receiving per-segment progress (default: %(default)s)'
+    )
+    
+    parser.add_argument(
+        '--list',
+        action='store_true',
+        help='Print the available builds as JSON instead of downloading'
+    )
+    parser.add_argument(
+        '--refresh',
+        action='store_true',
+        help='Revalidate cached directory listings even if they are fresh'
+    )
+    parser.add_argument(
+        '--index-ttl',
+        type=int,
+        default=DEFAULT_INDEX_TTL,
+        help='Seconds a cached directory listing stays fresh (default: %(default)s)'
+    )
+    
     args = parser.parse_args()
     
-    downloader = ImageDownloader(args.build_version, args.snb_filename, args.wsm_filename)
+    cache = ImageCache(args.cache_dir, int(args.cache_budget_gb * 1024 ** 3))
+    downloader = ImageDownloader(args.build_version, args.snb_filename, args.wsm_filename, cache,
+                                 use_cache=not args.no_cache, verify_cache=args.verify_cache,
+                                 builds_url=args.builds_url, segments=args.segments,
+                                 progress=DownloadProgress(args.progress_file),
+                                 build_index=BuildIndex(os.path.join(args.cache_dir, "listings"), args.index_ttl))
+    
+    if args.list:
+        try:
+            print(json.dumps(downloader.list_builds(args.refresh), indent=2))
+        except Exception as e:
+            logger.error(f"Could not list builds: {e}")
+            sys.exit(1)
+        sys.exit(0)
+    
+    if args.refresh:
+        downloader.build_index.ttl = 0
     result = downloader.run()
     
     if result['status'] == 'failed':
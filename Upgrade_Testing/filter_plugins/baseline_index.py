@@ -0,0 +1,163 @@
+# Compare lspci and interface output with the per-model baselines in
+# var/post_install_check/<vendor>/<model>/
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import json
+import os
+import sys
+
+from ansible.errors import AnsibleFilterError
+
+BASELINE_FILES = {
+    'lspci': 'lspci_interfaces_check',
+    'interfaces': 'cli_interfaces_check',
+}
+
+# Parsed baselines are kept next to them so every host and task reuses them
+INDEX_NAME = '.baseline_index.json'
+
+# show interface brief | tab starts with a header and a dashed line
+INTERFACE_HEADER_LINES = 2
+
+_memo = {}
+
+
+def normalize_lspci(lines):
+    """Lowercased, stripped lspci lines without blanks, sorted and unique."""
+    return sorted(set(line.strip().lower() for line in lines if line.strip()))
+
+
+def normalize_interfaces(lines):
+    """Interface names (first column) after the table header, sorted and unique."""
+    names = set()
+    for line in list(lines)[INTERFACE_HEADER_LINES:]:
+        fields = line.split()
+        if fields:
+            names.add(fields[0])
+    return sorted(names)
+
+
+NORMALIZERS = {
+    'lspci': normalize_lspci,
+    'interfaces': normalize_interfaces,
+}
+
+
+def _check_kind(kind):
+    if kind not in BASELINE_FILES:
+        raise AnsibleFilterError("Unknown baseline kind '{}', expected one of {}".format(
+            kind, ', '.join(sorted(BASELINE_FILES))))
+
+
+def _stamp(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def compile_baselines(model_dir):
+    """Return {kind: normalized list} for model_dir, reparsing only changed files.
+
+    The parsed baselines are stored in model_dir/.baseline_index.json with the
+    size and mtime of each file; the index is rewritten only when one of them
+    changed, and an unwritable directory just means parsing every time.
+    """
+    model_dir = os.path.normpath(model_dir)
+    index_path = os.path.join(model_dir, INDEX_NAME)
+    stamps = {}
+    for kind, filename in BASELINE_FILES.items():
+        try:
+            stamps[kind] = _stamp(os.path.join(model_dir, filename))
+        except OSError:
+            stamps[kind] = None
+
+    cached = _memo.get(model_dir)
+    if cached is None:
+        try:
+            with open(index_path) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            cached = {}
+
+    index = {}
+    changed = False
+    for kind, filename in BASELINE_FILES.items():
+        entry = cached.get(kind)
+        if entry and entry.get('stamp') == stamps[kind]:
+            index[kind] = entry
+            continue
+        changed = True
+        if stamps[kind] is None:
+            index[kind] = {'stamp': None, 'items': None}
+            continue
+        with open(os.path.join(model_dir, filename)) as f:
+            lines = f.read().splitlines()
+        index[kind] = {'stamp': stamps[kind], 'items': NORMALIZERS[kind](lines)}
+
+    if changed:
+        tmp_path = '{}.{}.tmp'.format(index_path, os.getpid())
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(index, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, index_path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    _memo[model_dir] = index
+    return index
+
+
+def vos_baseline(model_dir, kind):
+    """Normalized baseline of kind ('lspci' or 'interfaces') for model_dir."""
+    _check_kind(kind)
+    items = compile_baselines(model_dir)[kind]['items']
+    if items is None:
+        raise AnsibleFilterError("No {} baseline {} for this model".format(
+            kind, os.path.join(model_dir, BASELINE_FILES[kind])))
+    return items
+
+
+def vos_baseline_diff(actual_lines, model_dir, kind):
+    """Compare command output lines with the model baseline.
+
+    Returns {'actual', 'expected', 'missing', 'unexpected', 'match'}: missing
+    is in the baseline but not on the device, unexpected on the device only.
+    """
+    _check_kind(kind)
+    if isinstance(actual_lines, str):
+        actual_lines = actual_lines.splitlines()
+    actual = NORMALIZERS[kind](actual_lines or [])
+    expected = vos_baseline(model_dir, kind)
+    actual_set = set(actual)
+    expected_set = set(expected)
+    missing = sorted(expected_set - actual_set)
+    unexpected = sorted(actual_set - expected_set)
+    return {
+        'actual': actual,
+        'expected': expected,
+        'missing': missing,
+        'unexpected': unexpected,
+        'match': not missing and not unexpected,
+    }
+
+
+class FilterModule(object):
+
+    def filters(self):
+        return {
+            'vos_baseline': vos_baseline,
+            'vos_baseline_diff': vos_baseline_diff,
+        }
+
+
+if __name__ == '__main__':
+    # Precompile every model: python3 filter_plugins/baseline_index.py var/post_install_check
+    root = sys.argv[1] if len(sys.argv) > 1 else 'var/post_install_check'
+    for vendor in sorted(os.listdir(root)):
+        for model in sorted(os.listdir(os.path.join(root, vendor))):
+            model_dir = os.path.join(root, vendor, model)
+            if os.path.isdir(model_dir):
+                index = compile_baselines(model_dir)
+                print('{}/{}: {}'.format(vendor, model, ', '.join(
+                    '{} {}'.format(len(index[kind]['items'] or []), kind) for kind in sorted(index))))
@@ -0,0 +1,35 @@
+# Adaptive timeout for vos_wait_ready from recorded time-to-ready
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import json
+
+
+def vos_ready_timeout(history, key, default=600, floor=120, ceiling=900, samples=20):
+    """Return the readiness timeout in seconds for key (manufacturer/model).
+
+    history is the text of the readiness JSONL log. Without a successful
+    record for key the default is used; otherwise twice the slowest of the
+    last `samples` times plus a minute, kept between floor and ceiling.
+    """
+    elapsed = []
+    for line in (history or '').splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(record, dict) and record.get('key') == key and record.get('ready'):
+            elapsed.append(float(record.get('elapsed', 0)))
+    if not elapsed:
+        return int(default)
+    slowest = max(elapsed[-int(samples):])
+    return int(min(max(slowest * 2 + 60, float(floor)), float(ceiling)))
+
+
+class FilterModule(object):
+
+    def filters(self):
+        return {
+            'vos_ready_timeout': vos_ready_timeout,
+        }
@@ -1,5 +1,13 @@
 #!/bin/bash
 
+# Usage:
+#   foldering.sh VERSION DUT_IP VENDOR MODEL DOWNLOAD_LATEST [USERNAME] [PASSWORD] [HOSTNAME]
+#   foldering.sh --batch DEVICES_FILE VERSION DOWNLOAD_LATEST [FORKS] [SERIAL]
+#
+# In batch mode DEVICES_FILE has one tab-separated line per device:
+#   HOSTNAME  DUT_IP  VENDOR  MODEL  USERNAME  PASSWORD
+# and all devices run in a single ansible-playbook invocation.
+
 # Base log directory
 LOG_BASE="/var/log/ansible"
 
@@ -7,76 +15,166 @@ LOG_BASE="/var/log/ansible"
 TODAY=$(date +%Y-%m-%d)
 NOW=$(date +%H-%M-%S)
 LOG_DIR="$LOG_BASE/$TODAY/$NOW"
-VERSION=$1 
-DUT_IP=$2
-VENDOR=$3
-MODEL=$4
-DOWNLOAD_LATEST=$5
-USERNAME=${6:-admin}
-PASSWORD=${7:-versa123}
+
+BATCH_MODE=false
+if [ "$1" = "--batch" ]; then
+    BATCH_MODE=true
+    DEVICES_FILE=$2
+    VERSION=$3
+    DOWNLOAD_LATEST=$4
+    FORKS=${5:-10}
+    SERIAL=${6:-100%}
+else
+    VERSION=$1
+    DUT_IP=$2
+    VENDOR=$3
+    MODEL=$4
+    DOWNLOAD_LATEST=$5
+    USERNAME=${6:-admin}
+    PASSWORD=${7:-versa123}
+    HOSTNAME=$8
+fi
 
 mkdir -p "$LOG_DIR"
 
 # Log file name
 LOG_FILE="$LOG_DIR/upgrade_run.log"
 
-# Create hostname from model (lowercase, replace spaces with dashes)
-HOSTNAME=$(echo "$MODEL" | tr '[:upper:]' '[:lower:]' | tr ' ' '-')
+# Dynamic inventory file with the DUT IPs
+INVENTORY_FILE="$LOG_DIR/dynamic_inventory.yml"
 
-# Create hostname-specific directory
-mkdir -p "$LOG_DIR/$HOSTNAME"
-echo "Created directory for host: $HOSTNAME at $LOG_DIR/$HOSTNAME"
+# [connection pooling]
+# The pre-flight login opens one ControlMaster socket per DUT and
+# ansible-playbook reuses it through the same ControlPath, so tasks run over
+# that connection instead of each doing its own TCP/SSH handshake. Unix socket
+# paths are limited to about 100 characters, so the sockets live in a short
+# private directory rather than under $LOG_DIR.
+SSH_CONTROL_DIR=$(mktemp -d "${TMPDIR:-/tmp}/vos_cm.XXXXXX")
+SSH_CONTROL_PERSIST=${SSH_CONTROL_PERSIST:-30m}
+SSH_CONTROL_OPTS="-o ControlMaster=auto -o ControlPath=$SSH_CONTROL_DIR/%C -o ControlPersist=$SSH_CONTROL_PERSIST"
 
-# Log the execution parameters
-echo "=================================================="
-echo "Ansible Execution Parameters:"
-echo "Version: $VERSION"
-echo "DUT IP: $DUT_IP"
-echo "Vendor: $VENDOR"
-echo "Model: $MODEL"
-echo "Hostname: $HOSTNAME"
-echo "Username: $USERNAME"
-echo "Download Latest: $DOWNLOAD_LATEST"
-echo "Log Directory: $LOG_DIR"
-echo "=================================================="
+# Per-DUT pre-flight results: hostname, IP, ok/failed, seconds to connect
+CONNECTION_TIMINGS="$LOG_DIR/connection_timings.tsv"
 
-# SSH Setup - Remove old host key and establish new connection
-echo "=================================================="
-echo "Setting up SSH connection to $DUT_IP..."
-echo "=================================================="
+# Per-DUT variables the pre-flight finds, read by ansible next to the inventory
+HOST_VARS_DIR="$LOG_DIR/host_vars"
 
-# Remove old host key if it exists
-if [ -f "$HOME/.ssh/known_hosts" ]; then
-    echo "Removing old host key for $DUT_IP from known_hosts..."
-    ssh-keygen -f "$HOME/.ssh/known_hosts" -R "$DUT_IP" 2>/dev/null || true
-fi
+export ANSIBLE_SSH_ARGS="-C $SSH_CONTROL_OPTS"
 
-# Test SSH connection and add new host key
-echo "Testing SSH connection to $DUT_IP..."
-sshpass -p "$PASSWORD" ssh -o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null \
-    -o ConnectTimeout=10 ${USERNAME}@${DUT_IP} "echo 'SSH connection successful'" 2>&1
-
-if [ $? -eq 0 ]; then
-    echo "✓ SSH connection to $DUT_IP established successfully"
-    
-    # Now add the host key properly to known_hosts
-    echo "Adding host key to known_hosts..."
-    ssh-keyscan -H $DUT_IP >> $HOME/.ssh/known_hosts 2>/dev/null
-    
-    echo "✓ Host key added to known_hosts"
-else
-    echo "✗ Failed to establish SSH connection to $DUT_IP"
+# [pipelining]
+# Pipelining feeds modules to the DUT's python over stdin instead of copying
+# them over first, saving a round trip per task. Pipelined tasks have no tty,
+# so sudo refuses them where the DUT's sudoers sets requiretty; the pre-flight
+# checks for that and turns pipelining off for those DUTs only. Set
+# VOS_ANSIBLE_PIPELINING=False to turn it off for every DUT.
+export ANSIBLE_PIPELINING=${VOS_ANSIBLE_PIPELINING:-True}
+
+# Close every master connection when the script exits
+close_ssh_masters() {
+    local socket
+    for socket in "$SSH_CONTROL_DIR"/*; do
+        [ -S "$socket" ] && ssh -o ControlPath="$socket" -O exit vos-dut >/dev/null 2>&1
+    done
+    rm -rf "$SSH_CONTROL_DIR"
+}
+trap close_ssh_masters EXIT
+
+# Remove old host key if it exists; the pre-flight login records the new one.
+# Done before the logins start so parallel logins never rewrite known_hosts together.
+forget_host_key() {
+    local dut_ip="$1"
+
+    if [ -f "$HOME/.ssh/known_hosts" ]; then
+        echo "Removing old host key for $dut_ip from known_hosts..."
+        ssh-keygen -f "$HOME/.ssh/known_hosts" -R "$dut_ip" >/dev/null 2>&1 || true
+    fi
+}
+
+# SSH Setup - Log in once, record the host key and leave the master connection open
+ssh_precheck() {
+    local dut_ip="$1"
+    local username="$2"
+    local password="$3"
+    local hostname="$4"
+
+    echo "=================================================="
+    echo "Setting up SSH connection to $dut_ip..."
+    echo "=================================================="
+
+    # Test SSH connection; StrictHostKeyChecking=no adds the new host key to known_hosts
+    echo "Testing SSH connection to $dut_ip..."
+    mkdir -p -m 700 "$HOME/.ssh"
+    local start end rc seconds
+    start=$(date +%s.%N)
+    sshpass -p "$password" ssh $SSH_CONTROL_OPTS -o StrictHostKeyChecking=no \
+        -o UserKnownHostsFile="$HOME/.ssh/known_hosts" -o HashKnownHosts=yes \
+        -o ConnectTimeout=10 ${username}@${dut_ip} "echo 'SSH connection successful'" < /dev/null 2>&1
+    rc=$?
+    end=$(date +%s.%N)
+    seconds=$(awk -v s="$start" -v e="$end" 'BEGIN { printf "%.2f", e - s }')
+
+    if [ $rc -eq 0 ]; then
+        printf '%s\t%s\tok\t%s\n' "$hostname" "$dut_ip" "$seconds" >> "$CONNECTION_TIMINGS"
+        echo "✓ SSH connection to $dut_ip established successfully in ${seconds}s (kept open for the playbook)"
+        echo "✓ Host key added to known_hosts"
+        check_sudo_tty "$dut_ip" "$username" "$password" "$hostname"
+        return 0
+    fi
+
+    printf '%s\t%s\tfailed\t%s\n' "$hostname" "$dut_ip" "$seconds" >> "$CONNECTION_TIMINGS"
+    echo "✗ Failed to establish SSH connection to $dut_ip"
     echo "Please check:"
-    echo "  - IP address is reachable: ping $DUT_IP"
+    echo "  - IP address is reachable: ping $dut_ip"
     echo "  - SSH service is running on the device"
     echo "  - Username and password are correct"
-    exit 1
-fi
+    return 1
+}
 
-echo "=================================================="
+# Turn pipelining off for a DUT whose sudo needs a tty (Defaults requiretty)
+check_sudo_tty() {
+    local dut_ip="$1"
+    local username="$2"
+    local password="$3"
+    local hostname="$4"
 
-# Create dynamic inventory file with the DUT IP
-INVENTORY_FILE="$LOG_DIR/dynamic_inventory.yml"
+    # Like a pipelined task: no tty, over the master connection
+    if printf '%s\n' "$password" | sshpass -p "$password" ssh $SSH_CONTROL_OPTS -o ConnectTimeout=10 \
+            ${username}@${dut_ip} "sudo -S -p '' true" 2>&1 | grep -qi "tty"; then
+        mkdir -p "$HOST_VARS_DIR"
+        echo "ansible_pipelining: false" > "$HOST_VARS_DIR/$hostname.yml"
+        echo "! sudo on $dut_ip requires a tty; running $hostname without pipelining"
+    fi
+}
+
+# Print the pre-flight timings collected in $CONNECTION_TIMINGS since PRECHECK_START
+report_connection_timings() {
+    [ -f "$CONNECTION_TIMINGS" ] || return 0
+    echo "=================================================="
+    echo "SSH pre-flight connection setup:"
+    awk -F'\t' '{ printf "  %-24s %-16s %-7s %6.2fs\n", $1, $2, $3, $4 }' "$CONNECTION_TIMINGS"
+    awk -F'\t' '{ n++; total += $4; if ($3 == "ok") ok++; if ($4 > max) max = $4 }
+        END { if (n) printf "  %d/%d connected, average %.2fs, slowest %.2fs (wall %ss)\n", ok, n, total / n, max, wall }' \
+        wall="$((SECONDS - PRECHECK_START))" "$CONNECTION_TIMINGS"
+    echo "=================================================="
+}
+
+# Append one host entry to the inventory's vos group
+write_inventory_host() {
+    local hostname="$1"
+    local dut_ip="$2"
+    local username="$3"
+    local password="$4"
+
+    cat >> "$INVENTORY_FILE" << EOF
+        ${hostname}:
+          ansible_host: ${dut_ip}
+          ansible_ssh_user: ${username}
+          ansible_ssh_pass: ${password}
+          ansible_become: yes
+          ansible_become_pass: ${password}
+          ansible_ssh_common_args: '-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null'
+EOF
+}
 
 echo "Creating dynamic inventory file at: $INVENTORY_FILE"
 
@@ -85,15 +183,100 @@ all:
   children:
     vos:
       hosts:
-        ${HOSTNAME}:
-          ansible_host: ${DUT_IP}
-          ansible_ssh_user: ${USERNAME}
-          ansible_ssh_pass: ${PASSWORD}
-          ansible_become: yes
-          ansible_become_pass: ${PASSWORD}
-          ansible_ssh_common_args: '-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null'
 EOF
 
+if [ "$BATCH_MODE" = true ]; then
+    HOSTNAMES=()
+    DEVICE_IPS=()
+    DEVICE_VENDORS=()
+    DEVICE_MODELS=()
+
+    echo "=================================================="
+    echo "Ansible Batch Execution Parameters:"
+    echo "Version: $VERSION"
+    echo "Devices File: $DEVICES_FILE"
+    echo "Forks: $FORKS"
+    echo "Serial: $SERIAL"
+    echo "Download Latest: $DOWNLOAD_LATEST"
+    echo "Log Directory: $LOG_DIR"
+    echo "=================================================="
+
+    PRECHECK_START=$SECONDS
+    while IFS=$'\t' read -r HOSTNAME DUT_IP VENDOR MODEL USERNAME PASSWORD; do
+        [ -z "$HOSTNAME" ] && continue
+
+        mkdir -p "$LOG_DIR/$HOSTNAME"
+        echo "Created directory for host: $HOSTNAME at $LOG_DIR/$HOSTNAME"
+        echo "Device: $VENDOR $MODEL at $DUT_IP (user $USERNAME)"
+
+        # Logins run in parallel (at most FORKS at a time); unreachable devices stay in
+        # the inventory and the playbook reports them per host
+        forget_host_key "$DUT_IP"
+        while [ "$(jobs -rp | wc -l)" -ge "$FORKS" ]; do
+            wait -n
+        done
+        ( ssh_precheck "$DUT_IP" "$USERNAME" "$PASSWORD" "$HOSTNAME" \
+            || echo "Continuing batch without a verified connection to $HOSTNAME" ) \
+            > "$LOG_DIR/$HOSTNAME/ssh_precheck.log" 2>&1 &
+
+        write_inventory_host "$HOSTNAME" "$DUT_IP" "$USERNAME" "$PASSWORD"
+        HOSTNAMES+=("$HOSTNAME")
+        DEVICE_IPS+=("$DUT_IP")
+        DEVICE_VENDORS+=("$VENDOR")
+        DEVICE_MODELS+=("$MODEL")
+    done < "$DEVICES_FILE"
+
+    wait
+    for host in "${HOSTNAMES[@]}"; do
+        cat "$LOG_DIR/$host/ssh_precheck.log"
+    done
+    report_connection_timings
+
+    # The devices file holds credentials; the inventory now carries them
+    rm -f "$DEVICES_FILE"
+
+    if [ ${#HOSTNAMES[@]} -eq 0 ]; then
+        echo "No devices found in $DEVICES_FILE"
+        exit 1
+    fi
+else
+    # Create hostname from model (lowercase, replace spaces with dashes) unless
+    # run_ansible.py already picked one that is unique among concurrent jobs
+    if [ -z "$HOSTNAME" ]; then
+        HOSTNAME=$(echo "$MODEL" | tr '[:upper:]' '[:lower:]' | tr ' ' '-')
+    fi
+
+    # Create hostname-specific directory
+    mkdir -p "$LOG_DIR/$HOSTNAME"
+    echo "Created directory for host: $HOSTNAME at $LOG_DIR/$HOSTNAME"
+
+    # Log the execution parameters
+    echo "=================================================="
+    echo "Ansible Execution Parameters:"
+    echo "Version: $VERSION"
+    echo "DUT IP: $DUT_IP"
+    echo "Vendor: $VENDOR"
+    echo "Model: $MODEL"
+    echo "Hostname: $HOSTNAME"
+    echo "Username: $USERNAME"
+    echo "Download Latest: $DOWNLOAD_LATEST"
+    echo "Log Directory: $LOG_DIR"
+    echo "=================================================="
+
+    PRECHECK_START=$SECONDS
+    forget_host_key "$DUT_IP"
+    ssh_precheck "$DUT_IP" "$USERNAME" "$PASSWORD" "$HOSTNAME" || exit 1
+    report_connection_timings
+
+    write_inventory_host "$HOSTNAME" "$DUT_IP" "$USERNAME" "$PASSWORD"
+    HOSTNAMES=("$HOSTNAME")
+    DEVICE_IPS=("$DUT_IP")
+    DEVICE_VENDORS=("$VENDOR")
+    DEVICE_MODELS=("$MODEL")
+fi
+
+echo "=================================================="
+
 # Prepare ansible-playbook command
 EXTRA_VARS="build_version=$VERSION"
 
@@ -103,70 +286,41 @@ if [ "$DOWNLOAD_LATEST" = "true" ]; then
     echo "Will download latest image from builds.versa-networks.com for version $VERSION"
 fi
 
+ANSIBLE_OPTS=""
+if [ "$BATCH_MODE" = true ]; then
+    EXTRA_VARS="$EXTRA_VARS upgrade_serial=$SERIAL"
+    ANSIBLE_OPTS="--forks $FORKS"
+fi
+
 # Build the ansible command
-ANSIBLE_CMD="ansible-playbook /home/versa/git/ansible_automation/Upgrade_Testing/run_upgrade.yml -i $INVENTORY_FILE -e \"$EXTRA_VARS\""
+ANSIBLE_CMD="ansible-playbook /home/versa/git/ansible_automation/Upgrade_Testing/run_upgrade.yml -i $INVENTORY_FILE $ANSIBLE_OPTS -e \"$EXTRA_VARS\""
 
 echo "Running command: $ANSIBLE_CMD"
 
-# Execute the ansible command
-eval "$ANSIBLE_CMD" | tee "$LOG_FILE"
+# Per-host logs and summaries are split out while the playbook runs
+SPLIT_ARGS=(--log-dir "$LOG_DIR" --version "$VERSION")
+for i in "${!HOSTNAMES[@]}"; do
+    SPLIT_ARGS+=(--host "${HOSTNAMES[$i]}" "${DEVICE_IPS[$i]}" "${DEVICE_VENDORS[$i]}" "${DEVICE_MODELS[$i]}")
+done
+
+# Execute the ansible command; split_run_log.py echoes every line and writes
+# upgrade_run.log, <host>/<host>_upgrade.log and the summaries, then gzips the logs
+eval "$ANSIBLE_CMD" | python3 "$(dirname "$0")/split_run_log.py" "${SPLIT_ARGS[@]}"
 
 # Get the exit code from ansible-playbook
 ANSIBLE_EXIT_CODE=${PIPESTATUS[0]}
 
-# Function to organize logs by hostname
-organize_ansible_logs() {
-    local main_log="$1"
-    local log_dir="$2"
-    local hostname="$3"
-    
-    if [ ! -f "$main_log" ]; then
-        echo "Main log file not found: $main_log"
-        return 1
-    fi
-    
-    echo "Organizing logs for hostname: $hostname"
-    
-    if [ -d "$log_dir/$hostname" ]; then
-        hostname_log="$log_dir/$hostname/${hostname}_upgrade.log"
-        hostname_summary="$log_dir/$hostname/${hostname}_summary.txt"
-        
-        # Extract logs for this hostname
-        grep -E "(TASK \[|$hostname|PLAY \[|PLAY RECAP|ERROR|FAILED)" "$main_log" > "$hostname_log"
-        
-        # Create summary file
-        echo "=== Upgrade Summary for $hostname ===" > "$hostname_summary"
-        echo "Timestamp: $(date)" >> "$hostname_summary"
-        echo "Version: $VERSION" >> "$hostname_summary"
-        echo "DUT IP: $DUT_IP" >> "$hostname_summary"
-        echo "Vendor: $VENDOR" >> "$hostname_summary"
-        echo "Model: $MODEL" >> "$hostname_summary"
-        echo "" >> "$hostname_summary"
-        
-        # Extract statistics
-        task_count=$(grep -c "TASK \[" "$hostname_log" || echo "0")
-        ok_count=$(grep -c "ok: \[$hostname\]" "$main_log" || echo "0")
-        changed_count=$(grep -c "changed: \[$hostname\]" "$main_log" || echo "0")
-        failed_count=$(grep -c "failed: \[$hostname\]" "$main_log" || echo "0")
-        
-        echo "Tasks executed: $task_count" >> "$hostname_summary"
-        echo "Successful tasks: $ok_count" >> "$hostname_summary"
-        echo "Changed tasks: $changed_count" >> "$hostname_summary"
-        echo "Failed tasks: $failed_count" >> "$hostname_summary"
-        
-        echo "Created log and summary for $hostname"
-    fi
-}
-
-# Organize logs after ansible completes
-organize_ansible_logs "$LOG_FILE" "$LOG_DIR" "$HOSTNAME"
-
 echo ""
 echo "=================================================="
 echo "Ansible playbook execution completed!"
 echo "Exit code: $ANSIBLE_EXIT_CODE"
-echo "Log file: $LOG_FILE"
-echo "Hostname-specific logs created in: $LOG_DIR/$HOSTNAME"
+echo "Log file: $LOG_FILE.gz"
+echo "Run summary: $LOG_DIR/run_summary.json"
+if [ "$BATCH_MODE" = true ]; then
+    echo "Hostname-specific logs created in: $LOG_DIR/{$(IFS=,; echo "${HOSTNAMES[*]}")}"
+else
+    echo "Hostname-specific logs created in: $LOG_DIR/$HOSTNAME"
+fi
 echo "=================================================="
 
-exit $ANSIBLE_EXIT_CODE
\ No newline at end of file
+exit $ANSIBLE_EXIT_CODE
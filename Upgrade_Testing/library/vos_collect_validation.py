@@ -0,0 +1,157 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = r'''
+---
+module: vos_collect_validation
+short_description: Collect everything the post-install checks need from a DUT in one pass
+description:
+  - Runs C(dmidecode -t 1), C(lspci | grep Ethernet), the confd commands
+    C(show system package-info), C(show interface brief | tab) and
+    C(show system status), and C(vsh status) on the DUT and returns their
+    output as one snapshot, so the checks run on the controller against it
+    instead of each opening its own connection.
+  - With I(restart), first stops the Versa services, removes I(remove_files)
+    (the CDB files), starts the services and waits until they and confd are
+    ready, so the interfaces and status are read from a fresh start.
+  - Each entry in C(snapshot.commands) has the keys a registered shell
+    result has (cmd, rc, stdout, stdout_lines, stderr, stderr_lines, failed).
+options:
+  restart:
+    description: Restart the Versa services before collecting.
+    type: bool
+    default: false
+  remove_files:
+    description: Files removed while the services are stopped. Only used with I(restart).
+    type: list
+    elements: path
+    default: []
+  ready_timeout:
+    description: Seconds to wait for the services after the restart.
+    type: float
+    default: 600
+'''
+
+EXAMPLES = r'''
+- name: Restart versa services and collect the post-install snapshot
+  vos_collect_validation:
+    restart: true
+    remove_files:
+      - /opt/versa/confd/var/confd/cdb/A.cdb
+      - /opt/versa/confd/var/confd/cdb/C.cdb
+      - /opt/versa/confd/var/confd/cdb/O.cdb
+    ready_timeout: 600
+  become: true
+  register: validation_collect
+'''
+
+RETURN = r'''
+snapshot:
+  description: Collected output.
+  type: dict
+  contains:
+    collected_at:
+      description: Time the collection finished, ISO 8601.
+      type: str
+    elapsed:
+      description: Seconds the whole collection took.
+      type: float
+    commands:
+      description: Command name (dmidecode, package_info, lspci, interfaces, system_status, vsh_status) to its result.
+      type: dict
+    restart:
+      description: >-
+        Only with I(restart). The vos_wait_ready result (ready, elapsed, attempts,
+        timeout, services, not_running, confd_ready, stdout_lines, reason) plus
+        stopped, still_running, stop_lines and removed.
+      type: dict
+'''
+
+import os
+import time
+from datetime import datetime
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.vos_status import STOP_EXEMPT, VSH_STATUS, confd_command, parse_services, wait_ready
+
+COMMANDS = (
+    ('dmidecode', 'dmidecode -t 1'),
+    ('package_info', confd_command('show system package-info')),
+    ('lspci', 'lspci | grep Ethernet'),
+    ('interfaces', confd_command('show interface brief | tab')),
+    ('system_status', confd_command('show system status')),
+    ('vsh_status', VSH_STATUS),
+)
+
+
+def run(module, cmd):
+    rc, stdout, stderr = module.run_command(cmd, use_unsafe_shell=True)
+    return dict(
+        cmd=cmd,
+        rc=rc,
+        failed=rc != 0,
+        stdout=stdout.rstrip('\n'),
+        stdout_lines=stdout.splitlines(),
+        stderr=stderr.rstrip('\n'),
+        stderr_lines=stderr.splitlines(),
+    )
+
+
+def restart_services(module, remove_files, ready_timeout):
+    """Stop the services, remove remove_files, start them again and wait until ready."""
+    run(module, 'bash -lc "vsh stop"')
+    status = run(module, VSH_STATUS)
+    still_running = sorted(name for name, state in parse_services(status['stdout']).items()
+                           if state == 'Running' and name not in STOP_EXEMPT)
+
+    removed = []
+    for path in remove_files:
+        if os.path.lexists(path):
+            os.remove(path)
+            removed.append(path)
+
+    start = run(module, 'bash -lc "vsh start"')
+    if start['rc'] == 0:
+        result = wait_ready(module, timeout=ready_timeout)
+    else:
+        result = dict(ready=False, elapsed=0, attempts=0, timeout=ready_timeout, services={},
+                      not_running=[], confd_ready=False, stdout_lines=start['stdout_lines'],
+                      reason='vsh start failed with rc {}'.format(start['rc']))
+    result.update(
+        stopped=status['rc'] == 0 and not still_running,
+        still_running=still_running,
+        stop_lines=status['stdout_lines'],
+        removed=removed,
+    )
+    return result
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            restart=dict(type='bool', default=False),
+            remove_files=dict(type='list', elements='path', default=[]),
+            ready_timeout=dict(type='float', default=600),
+        ),
+        supports_check_mode=True,
+    )
+    params = module.params
+
+    start = time.time()
+    snapshot = dict(commands={})
+    restart = params['restart'] and not module.check_mode
+    if restart:
+        snapshot['restart'] = restart_services(module, params['remove_files'], params['ready_timeout'])
+    for name, cmd in COMMANDS:
+        snapshot['commands'][name] = run(module, cmd)
+    snapshot['elapsed'] = round(time.time() - start, 1)
+    snapshot['collected_at'] = datetime.now().isoformat()
+
+    module.exit_json(changed=restart, snapshot=snapshot)
+
+
+if __name__ == '__main__':
+    main()
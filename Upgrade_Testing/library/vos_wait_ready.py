@@ -0,0 +1,106 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = r'''
+---
+module: vos_wait_ready
+short_description: Wait until all Versa services are running and confd answers
+description:
+  - Polls C(vsh status) until every C(versa-*) service is Running, then polls
+    the confd CLI until it accepts commands.
+  - Polls back off exponentially from I(initial_delay) up to I(max_delay) and
+    give up after I(timeout) seconds.
+  - Returns the measured time-to-ready so callers can adapt their timeouts.
+options:
+  timeout:
+    description: Seconds to wait in total before failing.
+    type: float
+    default: 600
+  initial_delay:
+    description: Seconds before the second poll.
+    type: float
+    default: 3
+  max_delay:
+    description: Longest pause between polls, in seconds.
+    type: float
+    default: 15
+  backoff:
+    description: Factor the pause grows by after each poll.
+    type: float
+    default: 1.5
+  vsh_command:
+    description: Command printing the service states.
+    type: str
+    default: bash -lc "vsh status"
+  confd_command:
+    description: Command that must succeed once confd is up. Empty to skip the confd check.
+    type: str
+    default: echo 'show system status' | /opt/versa/confd/bin/confd_cli -u admin -g admin -N
+'''
+
+EXAMPLES = r'''
+- name: Wait for versa services after vsh start
+  vos_wait_ready:
+    timeout: 600
+  register: vsh_ready
+'''
+
+RETURN = r'''
+ready:
+  description: Whether all services were running and confd answered in time.
+  type: bool
+elapsed:
+  description: Seconds from the first poll until ready (or until giving up).
+  type: float
+attempts:
+  description: Number of polls.
+  type: int
+services:
+  description: Service name to state from the last C(vsh status).
+  type: dict
+not_running:
+  description: Services that were not Running at the last poll.
+  type: list
+confd_ready:
+  description: Whether the confd CLI answered.
+  type: bool
+stdout_lines:
+  description: Output of the last C(vsh status).
+  type: list
+timeout:
+  description: The timeout that was used, in seconds.
+  type: float
+'''
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.vos_status import VSH_STATUS, confd_command, wait_ready
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            timeout=dict(type='float', default=600),
+            initial_delay=dict(type='float', default=3),
+            max_delay=dict(type='float', default=15),
+            backoff=dict(type='float', default=1.5),
+            vsh_command=dict(type='str', default=VSH_STATUS),
+            confd_command=dict(type='str', default=confd_command('show system status')),
+        ),
+        supports_check_mode=True,
+    )
+    params = module.params
+
+    result = wait_ready(module, params['timeout'], params['initial_delay'], params['max_delay'],
+                        params['backoff'], params['vsh_command'], params['confd_command'])
+    reason = result.pop('reason', None)
+    if reason:
+        module.fail_json(msg='Not ready after {}s ({} polls): {}'.format(result['elapsed'], result['attempts'], reason),
+                         changed=False, **result)
+    module.exit_json(changed=False, **result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# Shared by vos_wait_ready and vos_collect_validation: reading vsh status and
+# waiting for the Versa services and confd to come up on the DUT
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import re
+import time
+
+SERVICE_RE = re.compile(r'^(versa-\S+)\s+is\s+(\w+)')
+
+# Services vsh stop leaves alone
+STOP_EXEMPT = ('versa-tpmrm', 'versa-tcsd')
+
+CONFD_CLI = '/opt/versa/confd/bin/confd_cli -u admin -g admin -N'
+VSH_STATUS = 'bash -lc "vsh status"'
+
+# confd_cli exits 0 on some connection errors, so the output is checked too
+CONFD_DOWN_MARKERS = ('Failed to connect', 'Connection refused', 'not running')
+
+
+def confd_command(command):
+    """Shell command running one confd CLI command, as the roles do."""
+    return "echo '{}' | {}".format(command, CONFD_CLI)
+
+
+def parse_services(output):
+    services = {}
+    for line in output.splitlines():
+        match = SERVICE_RE.match(line.strip())
+        if match:
+            services[match.group(1)] = match.group(2)
+    return services
+
+
+def wait_ready(module, timeout=600, initial_delay=3, max_delay=15, backoff=1.5,
+               vsh_command=VSH_STATUS, confd_check=confd_command('show system status')):
+    """Poll vsh status, then confd, with backoff until ready or timeout.
+
+    Returns a dict with ready, elapsed, attempts, timeout, services,
+    not_running, confd_ready, stdout_lines and, when not ready, reason.
+    """
+    start = time.time()
+    deadline = start + timeout
+    delay = initial_delay
+    attempts = 0
+    services = {}
+    not_running = []
+    stdout = ''
+    confd_ready = False
+
+    while True:
+        attempts += 1
+        rc, stdout, stderr = module.run_command(vsh_command, use_unsafe_shell=True)
+        services = parse_services(stdout)
+        not_running = sorted(name for name, state in services.items() if state != 'Running')
+
+        if rc == 0 and services and not not_running:
+            if not confd_check:
+                confd_ready = True
+                break
+            rc, out, err = module.run_command(confd_check, use_unsafe_shell=True)
+            confd_ready = rc == 0 and not any(marker in out + err for marker in CONFD_DOWN_MARKERS)
+            if confd_ready:
+                break
+
+        now = time.time()
+        if now >= deadline:
+            break
+        time.sleep(min(delay, deadline - now))
+        delay = min(delay * backoff, max_delay)
+
+    result = dict(
+        ready=bool(services) and not not_running and confd_ready,
+        elapsed=round(time.time() - start, 1),
+        attempts=attempts,
+        timeout=timeout,
+        services=services,
+        not_running=not_running,
+        confd_ready=confd_ready,
+        stdout_lines=stdout.splitlines(),
+    )
+    if not result['ready']:
+        if not services:
+            result['reason'] = 'vsh status listed no versa services'
+        elif not_running:
+            result['reason'] = 'services not running: {}'.format(', '.join(not_running))
+        else:
+            result['reason'] = 'confd CLI is not answering'
+    return result
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+Block-delta transfer of VOS images, rsync style.
+
+  signature BASIS SIG         (DUT) weak and strong checksum of every block of BASIS
+  delta SIG TARGET DELTA      (controller) blocks of TARGET found in BASIS with a
+                              rolling checksum become copy ops, the rest literals
+  patch BASIS DELTA OUTPUT    (DUT) rebuild TARGET from BASIS and DELTA, check its
+                              SHA-256 and move it into place
+
+Only the standard library is used so the same file runs on the controller
+and on the DUT. delta and patch print their statistics as JSON.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import struct
+import sys
+import zlib
+
+SIGNATURE_MAGIC = b'VOSSIG1\n'
+DELTA_MAGIC = b'VOSDLT1\n'
+
+DEFAULT_BLOCK_SIZE = 64 * 1024
+READ_SIZE = 4 * 1024 * 1024
+STRONG_DIGEST_SIZE = 16
+
+# Adler-32 modulus; the weak checksum is Adler-32 so whole blocks are summed in C
+ADLER_MOD = 65521
+
+# Pending literal bytes are written out once they reach this size
+MAX_LITERAL = 1024 * 1024
+
+OP_COPY = b'C'
+OP_LITERAL = b'L'
+OP_END = b'E'
+
+
+class DeltaError(Exception):
+    pass
+
+
+def weak_checksum(block):
+    """Adler-32 of a block as (a, b); it can be rolled one byte at a time like rsync's."""
+    value = zlib.adler32(block)
+    return value & 0xffff, value >> 16
+
+
+def strong_checksum(block):
+    return hashlib.blake2b(block, digest_size=STRONG_DIGEST_SIZE).digest()
+
+
+def _read_exact(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise DeltaError("unexpected end of file in {}".format(f.name))
+    return data
+
+
+def _read_header(f, magic):
+    if f.read(len(magic)) != magic:
+        raise DeltaError("{} is not a {} file".format(f.name, magic.strip().decode()))
+    length, = struct.unpack('>I', _read_exact(f, 4))
+    return json.loads(_read_exact(f, length).decode())
+
+
+def _write_header(f, magic, header):
+    data = json.dumps(header).encode()
+    f.write(magic)
+    f.write(struct.pack('>I', len(data)))
+    f.write(data)
+
+
+def write_signature(basis_path, sig_path, block_size=DEFAULT_BLOCK_SIZE):
+    """Write the checksums of every full block of basis_path to sig_path."""
+    size = os.path.getsize(basis_path)
+    tmp_path = sig_path + '.part'
+    with open(basis_path, 'rb') as basis, open(tmp_path, 'wb') as out:
+        _write_header(out, SIGNATURE_MAGIC, {'block_size': block_size, 'size': size,
+                                             'basis': os.path.basename(basis_path)})
+        while True:
+            block = basis.read(block_size)
+            # A short last block can only match at the very end; send it as a literal
+            if len(block) < block_size:
+                break
+            out.write(struct.pack('>I', zlib.adler32(block)))
+            out.write(strong_checksum(block))
+    os.replace(tmp_path, sig_path)
+    return {'basis': basis_path, 'basis_size': size, 'block_size': block_size,
+            'blocks': size // block_size, 'signature_size': os.path.getsize(sig_path)}
+
+
+def read_signature(sig_path):
+    """Return (header, {weak: {strong: block index}})."""
+    index = {}
+    entry_size = 4 + STRONG_DIGEST_SIZE
+    with open(sig_path, 'rb') as f:
+        header = _read_header(f, SIGNATURE_MAGIC)
+        block = 0
+        while True:
+            entry = f.read(entry_size)
+            if len(entry) < entry_size:
+                break
+            weak, = struct.unpack('>I', entry[:4])
+            index.setdefault(weak, {}).setdefault(entry[4:], block)
+            block += 1
+    return header, index
+
+
+class DeltaWriter(object):
+    """Writes delta ops, merging copies of consecutive basis blocks into one op."""
+
+    def __init__(self, f):
+        self.f = f
+        self.run_start = None
+        self.run_length = 0
+        self.copied_blocks = 0
+        self.literal_bytes = 0
+
+    def copy(self, block):
+        if self.run_start is not None and block == self.run_start + self.run_length:
+            self.run_length += 1
+        else:
+            self._flush_copy()
+            self.run_start, self.run_length = block, 1
+        self.copied_blocks += 1
+
+    def literal(self, data):
+        if not data:
+            return
+        self._flush_copy()
+        self.f.write(OP_LITERAL + struct.pack('>I', len(data)))
+        self.f.write(data)
+        self.literal_bytes += len(data)
+
+    def end(self, trailer):
+        self._flush_copy()
+        data = json.dumps(trailer).encode()
+        self.f.write(OP_END + struct.pack('>I', len(data)))
+        self.f.write(data)
+
+    def _flush_copy(self):
+        if self.run_start is not None:
+            self.f.write(OP_COPY + struct.pack('>QI', self.run_start, self.run_length))
+            self.run_start = None
+
+
+def make_delta(sig_path, target_path, delta_path):
+    """Write the ops that rebuild target_path from the signed basis to delta_path."""
+    header, index = read_signature(sig_path)
+    n = header['block_size']
+    digest = hashlib.sha256()
+    tmp_path = delta_path + '.part'
+
+    with open(target_path, 'rb') as target, open(tmp_path, 'wb') as out:
+        out.write(DELTA_MAGIC + struct.pack('>I', n))
+        writer = DeltaWriter(out)
+        # buf[:pos] is pending literal data, buf[pos:pos + n] the current window
+        buf = b''
+        pos = 0
+        eof = False
+        a = b = None
+        lookup = index.get
+        while True:
+            if len(buf) - pos <= n and not eof:
+                data = target.read(READ_SIZE)
+                eof = not data
+                buf += data
+                continue
+            if len(buf) - pos < n:
+                break
+            if a is None:
+                a, b = weak_checksum(buf[pos:pos + n])
+
+            # Roll through the buffered data until a block matches or the
+            # pending literal is large enough to write out
+            end = min(len(buf) - n, MAX_LITERAL)
+            block = None
+            while True:
+                candidates = lookup(b << 16 | a)
+                if candidates is not None:
+                    block = candidates.get(strong_checksum(buf[pos:pos + n]))
+                    if block is not None:
+                        break
+                if pos >= end:
+                    break
+                out_byte = buf[pos]
+                a = (a - out_byte + buf[pos + n]) % ADLER_MOD
+                b = (b - n * out_byte + a - 1) % ADLER_MOD
+                pos += 1
+
+            if block is not None:
+                writer.literal(buf[:pos])
+                writer.copy(block)
+                digest.update(buf[:pos + n])
+                buf = buf[pos + n:]
+                pos = 0
+                a = None
+            elif pos >= MAX_LITERAL:
+                writer.literal(buf[:pos])
+                digest.update(buf[:pos])
+                buf = buf[pos:]
+                pos = 0
+            elif eof:
+                break
+
+        writer.literal(buf)
+        digest.update(buf)
+        size = target.tell()
+        writer.end({'size': size, 'sha256': digest.hexdigest()})
+    os.replace(tmp_path, delta_path)
+
+    delta_size = os.path.getsize(delta_path)
+    return {
+        'target': target_path,
+        'target_size': size,
+        'sha256': digest.hexdigest(),
+        'basis_size': header['size'],
+        'block_size': n,
+        'copied_bytes': writer.copied_blocks * n,
+        'literal_bytes': writer.literal_bytes,
+        'delta_size': delta_size,
+        'bytes_saved': size - delta_size
+    }
+
+
+def apply_delta(basis_path, delta_path, output_path, expected_sha256=None):
+    """Rebuild the target from basis_path and delta_path into output_path.
+
+    The result is written next to output_path and only moved into place once
+    its size and SHA-256 match the delta (and expected_sha256, if given), so
+    basis_path may be output_path itself.
+    """
+    digest = hashlib.sha256()
+    tmp_path = output_path + '.part'
+    try:
+        with open(basis_path, 'rb') as basis, open(delta_path, 'rb') as delta, open(tmp_path, 'wb') as out:
+            if delta.read(len(DELTA_MAGIC)) != DELTA_MAGIC:
+                raise DeltaError("{} is not a delta file".format(delta_path))
+            n, = struct.unpack('>I', _read_exact(delta, 4))
+            while True:
+                op = _read_exact(delta, 1)
+                if op == OP_COPY:
+                    block, count = struct.unpack('>QI', _read_exact(delta, 12))
+                    basis.seek(block * n)
+                    remaining = count * n
+                    while remaining:
+                        data = _read_exact(basis, min(remaining, READ_SIZE))
+                        out.write(data)
+                        digest.update(data)
+                        remaining -= len(data)
+                elif op == OP_LITERAL:
+                    length, = struct.unpack('>I', _read_exact(delta, 4))
+                    data = _read_exact(delta, length)
+                    out.write(data)
+                    digest.update(data)
+                elif op == OP_END:
+                    length, = struct.unpack('>I', _read_exact(delta, 4))
+                    trailer = json.loads(_read_exact(delta, length).decode())
+                    break
+                else:
+                    raise DeltaError("corrupt delta {}: unknown op {!r}".format(delta_path, op))
+            size = out.tell()
+
+        sha256 = digest.hexdigest()
+        if size != trailer['size'] or sha256 != trailer['sha256']:
+            raise DeltaError("rebuilt file does not match the delta (sha256 {}, expected {})".format(
+                sha256, trailer['sha256']))
+        if expected_sha256 and sha256 != expected_sha256.lower():
+            raise DeltaError("rebuilt file sha256 {} does not match expected {}".format(sha256, expected_sha256))
+        os.replace(tmp_path, output_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return {'output': output_path, 'size': size, 'sha256': sha256}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='rsync-style block-delta transfer of VOS images')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    signature = subparsers.add_parser('signature', help='Write block checksums of a basis file')
+    signature.add_argument('basis')
+    signature.add_argument('signature')
+    signature.add_argument('--block-size', type=int, default=DEFAULT_BLOCK_SIZE)
+
+    delta = subparsers.add_parser('delta', help='Write the delta from a signature to a target file')
+    delta.add_argument('signature')
+    delta.add_argument('target')
+    delta.add_argument('delta')
+
+    patch = subparsers.add_parser('patch', help='Rebuild a target file from a basis file and a delta')
+    patch.add_argument('basis')
+    patch.add_argument('delta')
+    patch.add_argument('output')
+    patch.add_argument('--sha256', help='Refuse the result unless it has this SHA-256')
+
+    args = parser.parse_args()
+    try:
+        if args.command == 'signature':
+            result = write_signature(args.basis, args.signature, args.block_size)
+        elif args.command == 'delta':
+            result = make_delta(args.signature, args.target, args.delta)
+        else:
+            result = apply_delta(args.basis, args.delta, args.output, args.sha256)
+    except (OSError, ValueError, DeltaError) as e:
+        print("block_delta {}: {}".format(args.command, e), file=sys.stderr)
+        return 1
+    print(json.dumps(result))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
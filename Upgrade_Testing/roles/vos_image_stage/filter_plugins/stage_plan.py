@@ -0,0 +1,52 @@
+# Decide where each DUT gets its image from during vos_image_stage
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+
+def vos_stage_plan(hosts, hostvars, peer_sourcing=False):
+    """Return {host: {'action': 'skip'|'controller'|'peer', 'peer': name}}.
+
+    Hosts whose image already matches the source checksum are skipped. With
+    peer_sourcing, the rest are spread across hosts on the same segment that
+    already hold the same image; a segment without one gets its image from
+    the controller once, and that host then serves the others.
+    """
+    plan = {}
+    peers = {}
+    pending = []
+
+    for host in hosts:
+        host_vars = hostvars[host]
+        checksum = host_vars.get('stage_checksum')
+        if not checksum:
+            continue
+        remote = (host_vars.get('stage_remote') or {}).get('stat') or {}
+        key = (host_vars.get('stage_segment'), checksum)
+        if remote.get('exists') and remote.get('checksum') == checksum:
+            plan[host] = {'action': 'skip', 'peer': None}
+            peers.setdefault(key, []).append(host)
+        else:
+            pending.append((host, key))
+
+    seeded = {}
+    assigned = {}
+    for host, key in pending:
+        sources = peers.get(key) or seeded.get(key)
+        if peer_sourcing and sources:
+            count = assigned.get(key, 0)
+            plan[host] = {'action': 'peer', 'peer': sources[count % len(sources)]}
+            assigned[key] = count + 1
+        else:
+            plan[host] = {'action': 'controller', 'peer': None}
+            seeded.setdefault(key, []).append(host)
+
+    return plan
+
+
+class FilterModule(object):
+
+    def filters(self):
+        return {
+            'vos_stage_plan': vos_stage_plan,
+        }
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+Split ansible-playbook output into per-host logs and summaries in one pass
+
+foldering.sh pipes the playbook output through this script instead of tee:
+every line is echoed to stdout and written to upgrade_run.log, and routed to
+<host>/<host>_upgrade.log as it arrives, so batch runs with many hosts in one
+log are never re-read. Result lines are counted per host (fatal and
+unreachable included) and the PLAY RECAP, when the run gets that far,
+supplies the final ok/changed/failed/rescued/unreachable counts. Per-task
+durations are the time from the TASK banner to the host's result line.
+
+When the output ends, <host>_summary.json, <host>_summary.txt and
+run_summary.json are written and the logs are gzip-compressed.
+
+An existing log can be split again with --input (no durations, no echo).
+"""
+
+import os
+import re
+import sys
+import gzip
+import json
+import shutil
+import argparse
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from ansible_output import classify_line, failure_message, TASK, RESCUE, RESULT, FAILED, RECAP_HEADER, RECAP
+
+# Banners that start a new section in every host's log
+_BANNER_RE = re.compile(r'^(PLAY \[|RUNNING HANDLER \[|PLAY RECAP)')
+_HANDLER_RE = re.compile(r'^RUNNING HANDLER \[([^\]]+)\]')
+_INCLUDED_RE = re.compile(r'^included: .* for (.+)$')
+_UNREACHABLE_RE = re.compile(r'^fatal: \[([^\]]+)\]: UNREACHABLE!')
+_IGNORING = '...ignoring'
+
+COUNT_KEYS = ('ok', 'changed', 'failed', 'rescued', 'unreachable', 'skipped', 'ignored')
+
+# A task's result for a host is the worst of its loop items
+STATUS_RANK = ('skipped', 'ok', 'changed', 'ignored', 'failed', 'unreachable')
+
+
+class HostLog(object):
+    """Per-host log file, task results and recap counts."""
+
+    def __init__(self, log_dir, hostname, ip=None, vendor=None, model=None):
+        self.hostname = hostname
+        self.ip = ip
+        self.vendor = vendor
+        self.model = model
+        self.dir = os.path.join(log_dir, hostname)
+        os.makedirs(self.dir, exist_ok=True)
+        self.path = os.path.join(self.dir, '{}_upgrade.log'.format(hostname))
+        self.file = open(self.path, 'w')
+        self.pending_banners = []
+        self.results = {}
+        self.recap = None
+
+    def queue_banner(self, line, task=False):
+        """Write line before the host's next output, dropping a task banner it had no output for."""
+        if self.pending_banners and self.pending_banners[-1][1]:
+            self.pending_banners.pop()
+        self.pending_banners.append((line, task))
+
+    def write(self, line):
+        for banner, _ in self.pending_banners:
+            if self.file.tell():
+                self.file.write('\n')
+            self.file.write(banner)
+        self.pending_banners = []
+        self.file.write(line)
+
+    def result(self, seq, task, status, duration=None, message=None):
+        """Record a result line; loop items of one task fold into one result."""
+        entry = self.results.get(seq)
+        if entry is None:
+            entry = self.results[seq] = {'task': task, 'status': status}
+        elif STATUS_RANK.index(status) > STATUS_RANK.index(entry['status']):
+            entry['status'] = status
+        if duration is not None:
+            entry['duration'] = duration
+        if message is not None:
+            entry['message'] = message
+
+    def ignore_last(self):
+        if self.results:
+            self.results[max(self.results)]['status'] = 'ignored'
+
+    def close(self):
+        self.file.close()
+
+    def summary(self):
+        tasks = [self.results[seq] for seq in sorted(self.results)]
+        counts = dict((key, 0) for key in COUNT_KEYS)
+        for entry in tasks:
+            counts[entry['status']] += 1
+        return {
+            'hostname': self.hostname,
+            'ip': self.ip,
+            'vendor': self.vendor,
+            'model': self.model,
+            'counts': self.recap if self.recap is not None else counts,
+            'counts_source': 'recap' if self.recap is not None else 'lines',
+            'tasks_executed': len(tasks),
+            'tasks': tasks,
+            'failed_tasks': [entry for entry in tasks if entry['status'] in ('failed', 'unreachable')],
+        }
+
+
+class RunLogSplitter(object):
+    """Route output lines to HostLogs while keeping the current task."""
+
+    def __init__(self, log_dir, hosts, timed=True):
+        self.log_dir = log_dir
+        self.hosts = dict((host.hostname, host) for host in hosts)
+        self.timed = timed
+        self.task = None
+        self.task_seq = 0
+        self.task_started = None
+        self.owner = None
+        self.unclaimed = []
+        self.banners = []
+        self.lines = 0
+        self.started = datetime.now()
+
+    def host(self, name):
+        name = name.split('->')[0].strip()
+        host = self.hosts.get(name)
+        if host is None:
+            # Hosts that were not passed in still get their own log
+            host = self.hosts[name] = HostLog(self.log_dir, name)
+            for line, task in self.banners:
+                host.queue_banner(line, task)
+        return host
+
+    def claim(self, hosts):
+        """Hand warnings and errors printed since the last result to hosts."""
+        for line in self.unclaimed:
+            for host in hosts:
+                host.write(line)
+        self.unclaimed = []
+
+    def banner(self, line, task=None):
+        self.owner = None
+        self.claim(self.hosts.values())
+        if task is not None:
+            self.task = task
+            self.task_seq += 1
+            self.task_started = time.time()
+        if line.startswith('PLAY ['):
+            self.banners = []
+        self.banners = [banner for banner in self.banners if not banner[1]] + [(line, task is not None)]
+        for host in self.hosts.values():
+            host.queue_banner(line, task is not None)
+
+    def result(self, host, status, message=None):
+        if self.task is None:
+            return
+        duration = None
+        if self.timed and self.task_started is not None:
+            duration = round(time.time() - self.task_started, 2)
+        host.result(self.task_seq, self.task, status, duration, message)
+
+    def feed(self, line):
+        self.lines += 1
+        stripped = line.strip()
+        if not stripped:
+            # Host logs get their own blank line before each banner
+            if self.unclaimed:
+                self.unclaimed.append(line)
+            return
+
+        if _BANNER_RE.match(stripped):
+            handler = _HANDLER_RE.match(stripped)
+            self.banner(line, handler.group(1) if handler else None)
+            return
+
+        unreachable = _UNREACHABLE_RE.match(stripped)
+        if unreachable:
+            self.owner = self.host(unreachable.group(1))
+            self.claim([self.owner])
+            self.result(self.owner, 'unreachable', failure_message(stripped.split('=>', 1)[-1].strip()))
+            self.owner.write(line)
+            return
+
+        event = classify_line(stripped)
+        if event is not None and event.kind in (TASK, RESCUE):
+            self.banner(line, event.task)
+            return
+        if event is not None and event.kind == RECAP_HEADER:
+            self.banner(line)
+            self.task = None
+            return
+        if event is not None and event.kind == RECAP:
+            host = self.host(event.host)
+            host.recap = dict((key, event.counts.get(key, 0)) for key in COUNT_KEYS)
+            host.write(line)
+            self.owner = None
+            return
+        if event is not None and event.kind in (RESULT, FAILED):
+            self.owner = self.host(event.host)
+            self.claim([self.owner])
+            if event.kind == FAILED:
+                self.result(self.owner, 'failed', event.details)
+            elif event.status == 'failed':
+                self.result(self.owner, 'failed', failure_message(event.details))
+            elif event.status in STATUS_RANK:
+                self.result(self.owner, event.status)
+            self.owner.write(line)
+            return
+
+        included = _INCLUDED_RE.match(stripped)
+        if included:
+            for name in included.group(1).split(','):
+                self.host(name).write(line)
+            self.owner = None
+            return
+
+        if self.owner is not None and not self.unclaimed and (line[0].isspace() or stripped in ('}', ']')):
+            # Continuation of a multi-line result (debug msg, register dump)
+            self.owner.write(line)
+        elif self.owner is not None and stripped == _IGNORING:
+            # The failure before it did not stop the host
+            self.owner.ignore_last()
+            self.owner.write(line)
+        elif self.task is not None:
+            # Warnings and errors (ansible-core prints the error before the
+            # fatal line) go to the host of the next result
+            self.owner = None
+            self.unclaimed.append(line)
+
+    def close(self):
+        self.claim(self.hosts.values())
+        for host in self.hosts.values():
+            host.close()
+
+
+def write_summaries(splitter, version):
+    finished = datetime.now()
+    run = {
+        'version': version,
+        'started': splitter.started.isoformat(),
+        'finished': finished.isoformat(),
+        'lines': splitter.lines,
+        'hosts': {},
+    }
+    for name, host in sorted(splitter.hosts.items()):
+        summary = host.summary()
+        summary['version'] = version
+        run['hosts'][name] = summary
+        with open(os.path.join(host.dir, '{}_summary.json'.format(name)), 'w') as f:
+            json.dump(summary, f, indent=2)
+
+        counts = summary['counts']
+        lines = [
+            '=== Upgrade Summary for {} ==='.format(name),
+            'Timestamp: {}'.format(finished.strftime('%a %b %d %H:%M:%S %Y')),
+            'Version: {}'.format(version),
+            'DUT IP: {}'.format(host.ip),
+            'Vendor: {}'.format(host.vendor),
+            'Model: {}'.format(host.model),
+            '',
+            'Tasks executed: {}'.format(summary['tasks_executed']),
+            'Successful tasks: {}'.format(counts['ok']),
+            'Changed tasks: {}'.format(counts['changed']),
+            'Failed tasks: {}'.format(counts['failed']),
+            'Rescued tasks: {}'.format(counts['rescued']),
+            'Unreachable: {}'.format(counts['unreachable']),
+            'Skipped tasks: {}'.format(counts['skipped']),
+            'Ignored failures: {}'.format(counts['ignored']),
+        ]
+        for failed in summary['failed_tasks']:
+            lines.append('FAILED: {} - {}'.format(failed['task'], failed['message']))
+        with open(os.path.join(host.dir, '{}_summary.txt'.format(name)), 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+    with open(os.path.join(splitter.log_dir, 'run_summary.json'), 'w') as f:
+        json.dump(run, f, indent=2)
+    return run
+
+
+def gzip_file(path):
+    """Compress path to path.gz and remove the original."""
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as src, gzip.open(path + '.gz', 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(path)
+    return path + '.gz'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Split ansible-playbook output into per-host logs and summaries')
+    parser.add_argument('--log-dir', required=True, help='Run directory (<LOG_BASE>/<date>/<time>)')
+    parser.add_argument('--log-file', default='upgrade_run.log', help='Main log file name inside --log-dir')
+    parser.add_argument('--input', help='Split an existing log instead of reading stdin')
+    parser.add_argument('--version', default='', help='Build version, recorded in the summaries')
+    parser.add_argument('--host', nargs=4, action='append', default=[],
+                        metavar=('HOSTNAME', 'IP', 'VENDOR', 'MODEL'), help='Inventory host (repeat per device)')
+    parser.add_argument('--no-compress', action='store_true', help='Leave the logs uncompressed')
+    args = parser.parse_args()
+
+    hosts = [HostLog(args.log_dir, *host) for host in args.host]
+    main_log = os.path.join(args.log_dir, args.log_file)
+
+    if args.input:
+        splitter = RunLogSplitter(args.log_dir, hosts, timed=False)
+        opener = gzip.open if args.input.endswith('.gz') else open
+        with opener(args.input, 'rt', errors='replace') as f:
+            for line in f:
+                splitter.feed(line)
+    else:
+        splitter = RunLogSplitter(args.log_dir, hosts)
+        stdin = open(sys.stdin.fileno(), 'r', errors='replace', closefd=False)
+        with open(main_log, 'w') as out:
+            for line in stdin:
+                sys.stdout.write(line)
+                sys.stdout.flush()
+                out.write(line)
+                splitter.feed(line)
+    splitter.close()
+
+    run = write_summaries(splitter, args.version)
+    for name, summary in sorted(run['hosts'].items()):
+        counts = summary['counts']
+        print("Created log and summary for {}: ok={} changed={} failed={} rescued={} unreachable={}".format(
+            name, counts['ok'], counts['changed'], counts['failed'], counts['rescued'], counts['unreachable']))
+
+    if not args.no_compress:
+        if not args.input:
+            gzip_file(main_log)
+        for host in splitter.hosts.values():
+            gzip_file(host.path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Classify lines of default-callback ansible-playbook output.
+
+classify_line() runs one compiled regex per line and turns TASK, result,
+FAILED!, rescue and PLAY RECAP lines into LineEvent tuples, so callers can
+do the string work before taking any shared lock.
+"""
+
+import json
+import re
+from collections import namedtuple
+
+# Event kinds
+TASK = 'task'
+RESCUE = 'rescue'
+RESULT = 'result'
+FAILED = 'failed'
+RECAP_HEADER = 'recap_header'
+RECAP = 'recap'
+
+LineEvent = namedtuple('LineEvent', ['kind', 'task', 'host', 'status', 'details', 'counts'])
+
+_LINE_RE = re.compile(
+    r"TASK \[(?P<task>[^\]]+)\]"
+    r"|(?P<status>ok|changed|failed|unreachable|skipped|skipping|fatal): \[(?P<host>[^\]]+)\]"
+    r"(?P<failed>: FAILED!)?(?:\s*=>\s*(?P<details>.*))?"
+    r"|(?P<recap_header>PLAY RECAP)"
+    r"|(?P<recap_host>[a-zA-Z0-9.-]+)\s*:\s*(?P<counts>ok=\d+.*)"
+)
+_FAILED_RE = re.compile(r"\[([^\]]+)\].*FAILED!.*?=>\s*(.*)")
+_COUNT_RE = re.compile(r"(\w+)=(\d+)")
+
+# Ansible prints "skipping:" and "fatal:"; the report only knows these statuses.
+_STATUS_ALIASES = {'skipping': 'skipped', 'fatal': 'failed'}
+
+
+def _strip_delegation(host):
+    """Turn 'csg2500 -> localhost' into 'csg2500'."""
+    if '->' in host:
+        return host.split('->')[0].strip()
+    return host
+
+
+def failure_message(payload):
+    """Extract msg/stderr from the JSON part of a FAILED! line."""
+    try:
+        error_data = json.loads(payload)
+        return str(error_data.get('msg', error_data.get('stderr', 'Task failed')))
+    except (ValueError, TypeError, AttributeError):
+        return 'Task failed - see logs for details'
+
+
+def classify_line(line):
+    """Return a LineEvent for an interesting output line, or None."""
+    match = _LINE_RE.match(line)
+    if match is None:
+        # FAILED! results that do not start with a status keyword
+        if "FAILED!" in line and "=>" in line:
+            failed_match = _FAILED_RE.search(line)
+            if failed_match:
+                return LineEvent(FAILED, None, _strip_delegation(failed_match.group(1)),
+                                 'failed', failure_message(failed_match.group(2)), None)
+        return None
+
+    task = match.group('task')
+    if task is not None:
+        # Tasks like "Set upgrade completion status after failure" only run
+        # from a rescue block.
+        if task.startswith("Set") and "failure" in task.lower():
+            return LineEvent(RESCUE, task, None, None, None, None)
+        return LineEvent(TASK, task, None, None, None, None)
+
+    status = match.group('status')
+    if status is not None:
+        host = _strip_delegation(match.group('host'))
+        details = match.group('details') or ""
+        if match.group('failed'):
+            return LineEvent(FAILED, None, host, 'failed', failure_message(details), None)
+        return LineEvent(RESULT, None, host, _STATUS_ALIASES.get(status, status), details, None)
+
+    if match.group('recap_header'):
+        return LineEvent(RECAP_HEADER, None, None, None, None, None)
+
+    counts = dict((key, int(value)) for key, value in _COUNT_RE.findall(match.group('counts')))
+    return LineEvent(RECAP, None, match.group('recap_host'), None, None, counts)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Test harness for block-delta image staging, with two local directories
+standing in for the controller and the DUT.
+
+The DUT directory holds the previous image (the basis); the controller
+directory holds the new one. The harness runs the same steps as
+vos_image_stage: pick the newest image on the "DUT" as the basis, sign it,
+compute the delta on the "controller", rebuild the new image on the "DUT"
+and check its SHA-256, then reports the bytes saved against a full copy.
+
+Without --basis/--target it generates a synthetic pair: a random image and a
+copy with some blocks rewritten and a few bytes inserted (which shifts
+everything after them, so only the rolling checksum can find those blocks).
+
+Usage:
+  python3 benchmarks/block_delta.py                            # synthetic 128 MB pair
+  python3 benchmarks/block_delta.py --size-mb 512 --changed-pct 5 --inserts 20
+  python3 benchmarks/block_delta.py --basis old.bin --target new.bin
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                                'Upgrade_Testing', 'roles', 'vos_image_stage', 'files'))
+
+import block_delta
+
+BASIS_NAME = "versa-flexvnf-20240101-000000-0000000-23.1.1-J.bin"
+TARGET_NAME = "versa-flexvnf-20240201-000000-0000000-23.1.1-J.bin"
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(block_delta.READ_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_synthetic_pair(basis_path, target_path, size_mb, changed_pct, inserts, seed):
+    """Write a random basis image and a target that differs from it in place and by insertions."""
+    rng = random.Random(seed)
+    data = bytearray(os.urandom(size_mb * 1024 * 1024))
+    with open(basis_path, 'wb') as f:
+        f.write(data)
+
+    # Rewrite scattered 32 KB runs until changed_pct of the image is new
+    run = 32 * 1024
+    for _ in range(int(len(data) * changed_pct / 100 / run)):
+        offset = rng.randrange(0, len(data) - run)
+        data[offset:offset + run] = os.urandom(run)
+    for _ in range(inserts):
+        offset = rng.randrange(0, len(data))
+        data[offset:offset] = os.urandom(rng.randint(1, 512))
+    with open(target_path, 'wb') as f:
+        f.write(data)
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, round(time.perf_counter() - start, 3)
+
+
+def run(controller_dir, dut_dir, target_name, block_size, pattern):
+    """Stage controller_dir/target_name into dut_dir as vos_image_stage would."""
+    target_path = os.path.join(controller_dir, target_name)
+    output_path = os.path.join(dut_dir, target_name)
+
+    # Same basis choice as the role: the image itself if present, else the newest image
+    candidates = sorted(glob.glob(os.path.join(dut_dir, pattern)), key=os.path.getmtime, reverse=True)
+    if not candidates:
+        raise SystemExit(f"No basis image matching {pattern} on the DUT; the role would send a full copy")
+    basis_path = output_path if output_path in candidates else candidates[0]
+
+    sig_path = os.path.join(dut_dir, 'vos_stage.sig')
+    signature, sign_seconds = timed(block_delta.write_signature, basis_path, sig_path, block_size)
+    shutil.move(sig_path, os.path.join(controller_dir, 'vos_stage.sig'))
+
+    delta_path = os.path.join(controller_dir, 'vos_stage.delta')
+    delta, delta_seconds = timed(block_delta.make_delta, os.path.join(controller_dir, 'vos_stage.sig'),
+                                 target_path, delta_path)
+    shutil.move(delta_path, os.path.join(dut_dir, 'vos_stage.delta'))
+
+    expected = sha256_file(target_path)
+    patch, patch_seconds = timed(block_delta.apply_delta, basis_path, os.path.join(dut_dir, 'vos_stage.delta'),
+                                 output_path, expected)
+
+    sent = delta['delta_size'] + signature['signature_size']
+    return {
+        'basis': os.path.basename(basis_path),
+        'target': target_name,
+        'block_size': block_size,
+        'target_size': delta['target_size'],
+        'signature_size': signature['signature_size'],
+        'delta_size': delta['delta_size'],
+        'literal_bytes': delta['literal_bytes'],
+        'copied_bytes': delta['copied_bytes'],
+        'bytes_transferred': sent,
+        'bytes_saved': delta['target_size'] - sent,
+        'saved_pct': round(100.0 * (delta['target_size'] - sent) / max(delta['target_size'], 1), 2),
+        'sha256_verified': patch['sha256'] == expected,
+        'seconds': {'signature': sign_seconds, 'delta': delta_seconds, 'patch': patch_seconds}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Block-delta staging harness with local controller/DUT directories')
+    parser.add_argument('--basis', help='Previous image already on the DUT (default: synthetic)')
+    parser.add_argument('--target', help='New image on the controller (default: synthetic)')
+    parser.add_argument('--size-mb', type=int, default=128, help='Size of the synthetic image')
+    parser.add_argument('--changed-pct', type=float, default=2, help='Percent of the synthetic image rewritten')
+    parser.add_argument('--inserts', type=int, default=10, help='Insertions that shift the synthetic image')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--block-size', type=int, default=block_delta.DEFAULT_BLOCK_SIZE)
+    parser.add_argument('--pattern', default='versa-flexvnf-*.bin', help='Basis images on the DUT (stage_basis_pattern)')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+    if bool(args.basis) != bool(args.target):
+        parser.error('--basis and --target go together')
+
+    workdir = tempfile.mkdtemp(prefix='vos_block_delta_')
+    try:
+        controller_dir = os.path.join(workdir, 'controller')
+        dut_dir = os.path.join(workdir, 'dut')
+        os.makedirs(controller_dir)
+        os.makedirs(dut_dir)
+
+        if args.basis:
+            target_name = os.path.basename(args.target)
+            shutil.copyfile(args.basis, os.path.join(dut_dir, os.path.basename(args.basis)))
+            shutil.copyfile(args.target, os.path.join(controller_dir, target_name))
+        else:
+            target_name = TARGET_NAME
+            make_synthetic_pair(os.path.join(dut_dir, BASIS_NAME), os.path.join(controller_dir, target_name),
+                                args.size_mb, args.changed_pct, args.inserts, args.seed)
+
+        result = run(controller_dir, dut_dir, target_name, args.block_size, args.pattern)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+
+    mb = 1024.0 * 1024
+    print(f"Basis {result['basis']} -> {result['target']} ({result['block_size'] // 1024} KB blocks)")
+    print(f"  full copy        {result['target_size'] / mb:10.2f} MB")
+    print(f"  signature (up)   {result['signature_size'] / mb:10.2f} MB")
+    print(f"  delta (down)     {result['delta_size'] / mb:10.2f} MB  "
+          f"({result['literal_bytes'] / mb:.2f} MB literal, {result['copied_bytes'] / mb:.2f} MB from basis)")
+    print(f"  bytes saved      {result['bytes_saved'] / mb:10.2f} MB  ({result['saved_pct']}%)")
+    print(f"  sha256           {'ok' if result['sha256_verified'] else 'MISMATCH'}")
+    seconds = result['seconds']
+    print(f"  seconds          signature {seconds['signature']}, delta {seconds['delta']}, patch {seconds['patch']}")
+
+
+if __name__ == '__main__':
+    main()
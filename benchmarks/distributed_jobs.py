@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Run a coordinator and several worker processes on this machine.
+
+Starts run_ansible.py with the SQLite job queue (VOS_JOB_BACKEND=sqlite)
+and --workers worker.py processes that run a stand-in for foldering.sh,
+which prints ansible-playbook style output for its device. It submits
+--devices device jobs through /submit and waits for all of them to finish,
+then reports the wall time, how the jobs were spread over the workers and
+whether every host's tasks and recap reached the coordinator's report.
+
+With --kill-worker the first worker is killed with SIGKILL while it runs
+jobs; they go back to the queue when their lease expires and other workers
+finish them. With --partition-worker the first worker keeps running but its
+connection to the coordinator is cut; it has to stop its jobs before their
+lease expires, so no device is ever upgraded by two workers at once. Every
+fake playbook run logs its start and end, and overlapping runs of one device
+are counted; leave free slots (fewer devices than workers x slots) so the
+requeued jobs are claimed while the cut-off worker could still be running them.
+
+Usage:
+  python3 benchmarks/distributed_jobs.py                   # 3 workers, 12 devices
+  python3 benchmarks/distributed_jobs.py --workers 4 --slots 2 --devices 40 --task-seconds 0.2
+  python3 benchmarks/distributed_jobs.py --kill-worker --lease 3
+  python3 benchmarks/distributed_jobs.py --partition-worker --lease 6 --devices 4 --tasks 30 --task-seconds 0.5
+"""
+
+import argparse
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+import uuid
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# Stand-in for foldering.sh: the device job's hostname is its 8th argument
+FAKE_PLAYBOOK = """#!/bin/bash
+HOST="$8"
+echo "start $HOST $$ $(date +%s.%N)" >> {runs_log}
+trap 'echo "end $HOST $$ $(date +%s.%N)" >> {runs_log}; exit 143' TERM
+echo "PLAY [Upgrade $HOST] ***"
+for i in $(seq 1 {tasks}); do
+    echo "TASK [Upgrade step $i] ***"
+    sleep {task_seconds}
+    echo "ok: [$HOST]"
+done
+echo "PLAY RECAP ***"
+echo "$HOST : ok={tasks} changed=0 unreachable=0 failed=0 skipped=0 rescued=0 ignored=0"
+echo "end $HOST $$ $(date +%s.%N)" >> {runs_log}
+"""
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class CuttableProxy(object):
+    """TCP relay to target_port whose connections can all be cut at once."""
+
+    def __init__(self, target_port):
+        self.target_port = target_port
+        self.port = free_port()
+        self.cut_off = False
+        self.sockets = []
+        self.lock = threading.Lock()
+        self.server = socket.socket()
+        self.server.bind(('127.0.0.1', self.port))
+        self.server.listen(64)
+        thread = threading.Thread(target=self._accept)
+        thread.daemon = True
+        thread.start()
+
+    def cut(self):
+        with self.lock:
+            self.cut_off = True
+            for sock in self.sockets:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                sock.close()
+
+    def _accept(self):
+        while True:
+            client, _ = self.server.accept()
+            with self.lock:
+                if self.cut_off:
+                    client.close()
+                    continue
+                upstream = socket.create_connection(('127.0.0.1', self.target_port))
+                self.sockets.extend([client, upstream])
+            for source, sink in ((client, upstream), (upstream, client)):
+                thread = threading.Thread(target=self._pipe, args=(source, sink))
+                thread.daemon = True
+                thread.start()
+
+    def _pipe(self, source, sink):
+        try:
+            while True:
+                data = source.recv(65536)
+                if not data:
+                    break
+                sink.sendall(data)
+        except OSError:
+            pass
+        finally:
+            try:
+                sink.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass
+
+
+def overlapping_runs(path):
+    """Pairs of fake playbook runs of the same device that ran at the same time.
+    A run without an end (killed with SIGKILL) counts as running until the end."""
+    runs = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                mark, host, pid, at = line.split()
+                run = runs.setdefault((host, pid), [None, float('inf')])
+                run[0 if mark == 'start' else 1] = float(at)
+    except OSError:
+        return 0
+    per_host = {}
+    for (host, pid), (start, end) in runs.items():
+        if start is not None:
+            per_host.setdefault(host, []).append((start, end))
+    overlaps = 0
+    for intervals in per_host.values():
+        intervals.sort()
+        for i, (start, end) in enumerate(intervals):
+            overlaps += sum(1 for other_start, _ in intervals[i + 1:] if other_start < end)
+    return overlaps
+
+
+def get_json(url):
+    with urllib.request.urlopen(url, timeout=10) as response:
+        return json.loads(response.read().decode('utf-8'))
+
+
+def wait_for_port(port, process, timeout=15):
+    end = time.time() + timeout
+    while time.time() < end and process.poll() is None:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def submit(url, count):
+    devices = [{'vendor': 'versa', 'model': 'csg-{}'.format(i), 'ip': '10.0.0.{}'.format(i + 1)} for i in range(count)]
+    data = urllib.parse.urlencode({
+        'deviceConfigData': json.dumps(devices),
+        'selectedAction': 'upgrade',
+        'upgradeToVersion': '22.1.4',
+    }).encode('utf-8')
+    request = urllib.request.Request(url + '/submit', data=data, headers={'Accept': 'application/json'})
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return [job['id'] for job in json.loads(response.read().decode('utf-8'))['jobs']]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Coordinator plus worker processes on one machine')
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--slots', type=int, default=2, help='Jobs per worker at once')
+    parser.add_argument('--devices', type=int, default=12, help='Device jobs to submit')
+    parser.add_argument('--tasks', type=int, default=10, help='Tasks in each fake playbook run')
+    parser.add_argument('--task-seconds', type=float, default=0.3)
+    parser.add_argument('--lease', type=int, default=5, help='VOS_JOB_LEASE_SECONDS for the coordinator')
+    parser.add_argument('--kill-worker', action='store_true', help='SIGKILL the first worker while it runs jobs')
+    parser.add_argument('--partition-worker', action='store_true',
+                        help='Cut the first worker off from the coordinator while it runs jobs')
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='distributed_jobs_')
+    playbook = os.path.join(work_dir, 'foldering.sh')
+    runs_log = os.path.join(work_dir, 'runs.log')
+    with open(playbook, 'w') as f:
+        f.write(FAKE_PLAYBOOK.format(tasks=args.tasks, task_seconds=args.task_seconds, runs_log=runs_log))
+    os.chmod(playbook, 0o755)
+
+    port = free_port()
+    url = 'http://127.0.0.1:{}'.format(port)
+    env = dict(os.environ,
+               VOS_JOB_BACKEND='sqlite',
+               VOS_WORKER_TOKEN=uuid.uuid4().hex,
+               VOS_JOB_DB=os.path.join(work_dir, 'jobs.db'),
+               VOS_JOB_LEASE_SECONDS=str(args.lease),
+               UPGRADE_MAX_JOBS=str(args.workers * args.slots),
+               RUN_HISTORY_DB=os.path.join(work_dir, 'run_history.db'),
+               VOS_TASK_SPILL_DIR=os.path.join(work_dir, 'spill'),
+               VOS_BIND='127.0.0.1',
+               VOS_PORT=str(port),
+               VOS_FOLDERING_SCRIPT=playbook,
+               VOS_WORKER_POLL_SECONDS='0.5')
+
+    processes = []
+    try:
+        coordinator_log = open(os.path.join(work_dir, 'coordinator.log'), 'w')
+        coordinator = subprocess.Popen([sys.executable, 'run_ansible.py'], cwd=ROOT, env=env,
+                                       stdout=coordinator_log, stderr=subprocess.STDOUT)
+        processes.append(coordinator)
+        if not wait_for_port(port, coordinator):
+            print("Coordinator did not start, see {}".format(coordinator_log.name))
+            sys.exit(1)
+
+        proxy = CuttableProxy(port) if args.partition_worker else None
+        workers = []
+        for i in range(args.workers):
+            log = open(os.path.join(work_dir, 'worker-{}.log'.format(i)), 'w')
+            worker_url = 'http://127.0.0.1:{}'.format(proxy.port) if proxy is not None and i == 0 else url
+            workers.append(subprocess.Popen(
+                [sys.executable, 'worker.py', '--coordinator', worker_url, '--name', 'worker-{}'.format(i),
+                 '--slots', str(args.slots)], cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT))
+        processes.extend(workers)
+
+        started = time.time()
+        job_ids = submit(url, args.devices)
+        killed = None
+        while time.time() - started < args.timeout:
+            jobs = [job for job in get_json(url + '/api/jobs')['jobs'] if job['id'] in job_ids]
+            if (args.kill_worker or args.partition_worker) and killed is None and any(
+                    job['worker'] == 'worker-0' and job['state'] == 'running' for job in jobs):
+                time.sleep(args.task_seconds * 2)
+                if proxy is not None:
+                    proxy.cut()
+                else:
+                    workers[0].send_signal(signal.SIGKILL)
+                killed = time.time() - started
+            if all(job['state'] in ('completed', 'failed', 'cancelled') for job in jobs):
+                break
+            time.sleep(0.5)
+        elapsed = time.time() - started
+        status = get_json(url + '/api/shell-status')
+        overlaps = overlapping_runs(runs_log)
+    finally:
+        # A cut-off worker would keep retrying its reports; nothing is left to drain
+        for process in processes:
+            if process.poll() is None:
+                process.kill()
+        for process in processes:
+            process.wait()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    per_worker = {}
+    for job in jobs:
+        per_worker[job['worker']] = per_worker.get(job['worker'], 0) + 1
+    states = {}
+    for job in jobs:
+        states[job['state']] = states.get(job['state'], 0) + 1
+    host_data = status.get('host_data', {})
+    result = {
+        'workers': args.workers,
+        'slots': args.slots,
+        'devices': args.devices,
+        'seconds': round(elapsed, 2),
+        'serial_seconds': round(args.devices * args.tasks * args.task_seconds, 2),
+        'states': states,
+        'jobs_per_worker': per_worker,
+        'retried_jobs': sum(1 for job in jobs if job['attempts'] > 1),
+        'worker_killed_at': round(killed, 2) if killed is not None else None,
+        'overlapping_runs': overlaps,
+        'hosts_with_recap': sum(1 for host in host_data.values() if host['recap']),
+        'hosts_with_all_tasks': sum(1 for host in host_data.values()
+                                    if sum(1 for task in host['tasks'] if task['status'] == 'ok') >= args.tasks),
+    }
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    print("{} device jobs on {} workers x {} slots: {} s (one at a time: {} s)".format(
+        args.devices, args.workers, args.slots, result['seconds'], result['serial_seconds']))
+    print("job states: {}".format(states))
+    print("jobs per worker: {}".format(per_worker))
+    if killed is not None:
+        print("worker-0 {} after {} s, {} job(s) retried, {} overlapping run(s) of one device".format(
+            'cut off' if args.partition_worker else 'killed', result['worker_killed_at'], result['retried_jobs'],
+            overlaps))
+    print("hosts with recap: {}/{}, with every task ok: {}/{}".format(
+        result['hosts_with_recap'], len(host_data), result['hosts_with_all_tasks'], len(host_data)))
+
+
+if __name__ == '__main__':
+    main()
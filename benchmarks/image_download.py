@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Benchmark image downloads against a local stand-in for builds.versa-networks.com.
+
+The stand-in is http.server with single-range support, optional per-connection
+throttling (to look like a WAN link) and optional dropped connections (to
+exercise resume). The benchmark generates synthetic SNB/WSM images, downloads
+them with ImageDownloader at different segment counts and checks the
+streamed SHA-256 against the source files.
+
+Usage:
+  python3 benchmarks/image_download.py                       # 64 MB images, 1 vs 4 segments
+  python3 benchmarks/image_download.py --size-mb 256 --segments 1 4 8 --rate-mbps 200
+  python3 benchmarks/image_download.py --drop-after-mb 10    # every connection drops after 10 MB
+  python3 benchmarks/image_download.py serve DIR --port 8000 # stand-in only
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Upgrade_Testing'))
+
+import download_latest_image
+
+BUILD_VERSION = "23.1.1"
+IMAGE_NAMES = {
+    'Sandybridge': "versa-flexvnf-20240101-000000-0000000-23.1.1-J.bin",
+    'Westmere': "versa-flexvnf-20240101-000000-0000000-23.1.1-J-wsm.bin",
+}
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """SimpleHTTPRequestHandler plus Range, ETag, throttling and dropped connections."""
+
+    rate_bytes_per_sec = 0
+    drop_after_bytes = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if os.path.isdir(path) or not os.path.isfile(path):
+            return super().send_head()
+
+        f = open(path, 'rb')
+        stat = os.fstat(f.fileno())
+        size = stat.st_size
+        start, end = 0, size - 1
+        match = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range', ''))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2)) if match.group(2) else size - 1, size - 1)
+            if start > end:
+                f.close()
+                self.send_error(416)
+                return None
+            self.send_response(206)
+            self.send_header('Content-Range', f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', f'"{stat.st_mtime_ns:x}-{size:x}"')
+        self.end_headers()
+        f.seek(start)
+        self._remaining = end - start + 1
+        return f
+
+    def copyfile(self, source, outputfile):
+        remaining = getattr(self, '_remaining', None)
+        sent = 0
+        started = time.perf_counter()
+        while remaining is None or remaining > 0:
+            chunk = source.read(64 * 1024 if remaining is None else min(64 * 1024, remaining))
+            if not chunk:
+                break
+            outputfile.write(chunk)
+            sent += len(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+            if self.drop_after_bytes and sent >= self.drop_after_bytes:
+                self.close_connection = True
+                return
+            if self.rate_bytes_per_sec:
+                ahead = sent / self.rate_bytes_per_sec - (time.perf_counter() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+
+
+def start_server(directory, port=0, rate_mbps=0, drop_after_mb=0):
+    """Serve directory on 127.0.0.1 in a background thread; return the server."""
+    handler = type('Handler', (RangeRequestHandler,), {
+        'rate_bytes_per_sec': int(rate_mbps * 1024 * 1024 / 8),
+        'drop_after_bytes': int(drop_after_mb * 1024 * 1024),
+    })
+    server = ThreadingHTTPServer(('127.0.0.1', port), partial(handler, directory=directory))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def make_build_tree(root, size_mb):
+    """Create versa-flexvnf/<ver>/latest/jammy/{Sandybridge,Westmere} with random images."""
+    checksums = {}
+    version_path = '.'.join(BUILD_VERSION.split('.')[:2])
+    for subdir, filename in IMAGE_NAMES.items():
+        directory = os.path.join(root, 'versa-flexvnf', version_path, 'latest', 'jammy', subdir)
+        os.makedirs(directory, exist_ok=True)
+        digest = hashlib.sha256()
+        with open(os.path.join(directory, filename), 'wb') as f:
+            for _ in range(size_mb):
+                block = os.urandom(1024 * 1024)
+                digest.update(block)
+                f.write(block)
+        checksums[filename] = digest.hexdigest()
+    return checksums
+
+
+def run_download(builds_url, workdir, segments):
+    """Download both images with a cold cache; return (seconds, result, cache index)."""
+    release_dir = os.path.join(workdir, 'vos_release_build')
+    shutil.rmtree(release_dir, ignore_errors=True)
+    download_latest_image.BASE_DIR = release_dir
+    cache = download_latest_image.ImageCache(os.path.join(release_dir, '.image_cache'))
+    progress = download_latest_image.DownloadProgress(os.path.join(workdir, 'progress.json'))
+    downloader = download_latest_image.ImageDownloader(
+        BUILD_VERSION, cache=cache, builds_url=builds_url, segments=segments, progress=progress)
+
+    # ImageDownloader logs to a system path; keep the benchmark self-contained
+    downloader.log_download = lambda *args, **kwargs: None
+
+    # Resume after dropped connections shows up as retries; allow plenty
+    start = time.perf_counter()
+    result = downloader.run()
+    for _ in range(20):
+        if result['status'] == 'success':
+            break
+        result = downloader.run()
+    elapsed = time.perf_counter() - start
+
+    with open(cache.index_path) as f:
+        index = json.load(f)
+    return elapsed, result, index
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'serve':
+        parser = argparse.ArgumentParser(description='Serve a directory as a range-capable build server stand-in')
+        parser.add_argument('command')
+        parser.add_argument('directory')
+        parser.add_argument('--port', type=int, default=8000)
+        parser.add_argument('--rate-mbps', type=float, default=0, help='Per-connection throttle in Mbit/s')
+        parser.add_argument('--drop-after-mb', type=float, default=0, help='Drop each connection after N MB')
+        args = parser.parse_args()
+        server = start_server(args.directory, args.port, args.rate_mbps, args.drop_after_mb)
+        print(f"Serving {args.directory} on http://127.0.0.1:{server.server_address[1]}/")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.shutdown()
+        return
+
+    parser = argparse.ArgumentParser(description='Benchmark segmented image downloads against a local stand-in')
+    parser.add_argument('--size-mb', type=int, default=64, help='Size of each synthetic image')
+    parser.add_argument('--segments', type=int, nargs='+', default=[1, 4], help='Segment counts to compare')
+    parser.add_argument('--rate-mbps', type=float, default=100, help='Per-connection throttle in Mbit/s (0 = none)')
+    parser.add_argument('--drop-after-mb', type=float, default=0, help='Drop each connection after N MB')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    download_latest_image.MIN_SEGMENT_SIZE = 1024 * 1024
+
+    workdir = tempfile.mkdtemp(prefix='vos_download_bench_')
+    try:
+        checksums = make_build_tree(os.path.join(workdir, 'server'), args.size_mb)
+        server = start_server(os.path.join(workdir, 'server'), rate_mbps=args.rate_mbps,
+                              drop_after_mb=args.drop_after_mb)
+        builds_url = f"http://127.0.0.1:{server.server_address[1]}/versa-flexvnf"
+
+        results = []
+        for segments in args.segments:
+            elapsed, result, index = run_download(builds_url, workdir, segments)
+            verified = sorted(checksums.values()) == sorted(index['entries'].keys())
+            results.append({
+                'segments': segments,
+                'status': result['status'],
+                'seconds': round(elapsed, 3),
+                'mb_per_sec': round(2 * args.size_mb / elapsed, 2),
+                'sha256_verified': verified,
+            })
+        server.shutdown()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    rate = f"{args.rate_mbps} Mbit/s per connection" if args.rate_mbps else "unthrottled"
+    print(f"Two {args.size_mb} MB images, {rate}")
+    print(f"{'segments':>8} {'status':>8} {'seconds':>9} {'MB/s':>8} {'sha256':>8}")
+    for row in results:
+        print(f"{row['segments']:>8} {row['status']:>8} {row['seconds']:>9} {row['mb_per_sec']:>8} "
+              f"{'ok' if row['sha256_verified'] else 'MISMATCH':>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+Replay recorded upgrade_run.log files through parse_ansible_output.
+
+Compares the single-pass classifier in run_ansible.py against the previous
+regex-chain parser (kept verbatim below) and reports lines/sec and how
+long each parser holds its lock (the legacy data_lock, or the host shards).
+
+Usage:
+  python3 benchmarks/parser_replay.py                      # all runs under /var/log/ansible
+  python3 benchmarks/parser_replay.py --limit 5 --repeat 3
+  python3 benchmarks/parser_replay.py path/to/upgrade_run.log
+"""
+
+import argparse
+import glob
+import gzip
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from datetime import datetime
+from threading import Lock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import run_ansible
+import run_state
+from ansible_output import classify_line, RESULT, FAILED, RECAP
+
+LOG_BASE = "/var/log/ansible"
+
+
+class TimedLock(object):
+    """Lock that records how long each holder kept it."""
+    
+    def __init__(self):
+        self._lock = Lock()
+        self._acquired_at = 0.0
+        self.holds = []
+    
+    def __enter__(self):
+        self._lock.acquire()
+        self._acquired_at = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.holds.append(time.perf_counter() - self._acquired_at)
+        self._lock.release()
+
+
+# State used by the legacy parser below
+current_tasks = []
+current_recap = {}
+host_specific_data = {}
+data_lock = TimedLock()
+
+
+# Previous parser from run_ansible.py, kept for comparison
+def legacy_parse_ansible_output(line, hostname=None):
+    global current_tasks, current_recap, host_specific_data
+    
+    print("Parsing line for {}: {}".format(hostname, line))
+    
+    with data_lock:
+        if line.startswith("TASK ["):
+            task_match = re.match(r"TASK \[([^\]]+)\]", line)
+            if task_match:
+                task_name = task_match.group(1)
+                current_task = {
+                    'timestamp': datetime.now().strftime('%H:%M:%S'),
+                    'name': task_name,
+                    'host': hostname if hostname else 'pending',
+                    'status': 'running',
+                    'details': 'In progress...'
+                }
+                current_tasks.append(current_task)
+                
+                if hostname and hostname in host_specific_data:
+                    host_specific_data[hostname]['tasks'].append(current_task.copy())
+                    host_specific_data[hostname]['status'] = 'running'
+        
+        elif any(line.startswith(prefix) for prefix in ["ok:", "changed:", "failed:", "unreachable:", "skipped:", "fatal:"]):
+            result_match = re.match(r"(ok|changed|failed|unreachable|skipped|fatal): \[([^\]]+)\](?:\s*=>\s*(.*))?", line)
+            if result_match:
+                status = result_match.group(1)
+                host = result_match.group(2)
+                details = result_match.group(3) or ""
+                
+                # Extract hostname if it contains arrow notation
+                if '->' in host:
+                    host = host.split('->')[0].strip()
+                
+                # Mark fatal as failed
+                if status == 'fatal':
+                    status = 'failed'
+                
+                if host in host_specific_data and host_specific_data[host]['tasks']:
+                    last_task = host_specific_data[host]['tasks'][-1]
+                    last_task['host'] = host
+                    last_task['status'] = status
+                    last_task['details'] = details[:200] + "..." if len(details) > 200 else details
+                    
+                    if status in ['failed', 'unreachable']:
+                        host_specific_data[host]['status'] = 'failed'
+                    elif status in ['ok', 'changed'] and host_specific_data[host]['status'] != 'failed':
+                        host_specific_data[host]['status'] = 'running'
+                
+                if current_tasks:
+                    current_tasks[-1]['host'] = host
+                    current_tasks[-1]['status'] = status
+                    current_tasks[-1]['details'] = details[:100] + "..." if len(details) > 100 else details
+        
+        # Detect rescue block failures
+        elif "FAILED!" in line and "=>" in line:
+            # This catches lines like: fatal: [csg2500]: FAILED! => {"changed": true, ...}
+            failed_match = re.search(r'\[([^\]]+)\].*FAILED!', line)
+            if failed_match:
+                host = failed_match.group(1)
+                if '->' in host:
+                    host = host.split('->')[0].strip()
+                
+                if host in host_specific_data and host_specific_data[host]['tasks']:
+                    last_task = host_specific_data[host]['tasks'][-1]
+                    last_task['status'] = 'failed'
+                    
+                    # Extract error message from JSON if available
+                    try:
+                        json_match = re.search(r'=>\s*({.*})', line)
+                        if json_match:
+                            error_data = json.loads(json_match.group(1))
+                            error_msg = error_data.get('msg', error_data.get('stderr', 'Task failed'))
+                            last_task['details'] = error_msg[:200]
+                    except:
+                        last_task['details'] = 'Task failed - see logs for details'
+                    
+                    host_specific_data[host]['status'] = 'failed'
+        
+        # Detect rescue blocks being triggered
+        elif line.strip().startswith("TASK [Set") and "failure" in line.lower():
+            # Tasks like "Set upgrade completion status after failure" indicate a rescue
+            if hostname and hostname in host_specific_data:
+                # Mark the previous task as failed if it's still running
+                if host_specific_data[hostname]['tasks']:
+                    for i in range(len(host_specific_data[hostname]['tasks']) - 1, -1, -1):
+                        task = host_specific_data[hostname]['tasks'][i]
+                        if task['status'] == 'running':
+                            task['status'] = 'failed'
+                            task['details'] = 'Task failed - triggered rescue block'
+                            break
+        
+        elif "PLAY RECAP" in line:
+            pass
+        elif re.match(r"^[a-zA-Z0-9.-]+\s*:\s*ok=\d+", line):
+            recap_match = re.match(r"^([a-zA-Z0-9.-]+)\s*:\s*ok=(\d+)\s+changed=(\d+)\s+unreachable=(\d+)\s+failed=(\d+)(?:\s+skipped=(\d+))?\s+(?:rescued=(\d+))?", line)
+            if recap_match:
+                hostname_recap = recap_match.group(1)
+                failed_count = int(recap_match.group(5))
+                rescued_count = int(recap_match.group(7)) if recap_match.group(7) else 0
+                
+                # If there are rescued tasks, count them as failures
+                total_failures = failed_count + rescued_count
+                
+                recap_data = {
+                    'host': hostname_recap,
+                    'ok': int(recap_match.group(2)),
+                    'changed': int(recap_match.group(3)),
+                    'unreachable': int(recap_match.group(4)),
+                    'failed': total_failures,
+                    'rescued': rescued_count
+                }
+                current_recap[hostname_recap] = recap_data
+                
+                if hostname_recap in host_specific_data:
+                    host_specific_data[hostname_recap]['recap'] = recap_data
+                    
+                    if total_failures > 0:
+                        host_specific_data[hostname_recap]['status'] = 'failed'
+                    elif recap_data['unreachable'] > 0:
+                        host_specific_data[hostname_recap]['status'] = 'unreachable'
+                    else:
+                        host_specific_data[hostname_recap]['status'] = 'completed'
+
+
+def find_logs(log_root, limit):
+    """Return recorded logs, newest first, from <root>/<date>/<time>/upgrade_run.log[.gz]."""
+    paths = glob.glob(os.path.join(log_root, '*', '*', 'upgrade_run.log'))
+    paths += glob.glob(os.path.join(log_root, '*', '*', 'upgrade_run.log.gz'))
+    paths.sort(reverse=True)
+    return paths[:limit] if limit else paths
+
+
+def hosts_in(lines):
+    """Inventory hostnames seen in result and recap lines, in order."""
+    hosts = []
+    for line in lines:
+        event = classify_line(line)
+        if event is not None and event.kind in (RESULT, FAILED, RECAP) and event.host not in hosts:
+            hosts.append(event.host)
+    return hosts
+
+
+def new_host_data(hosts):
+    return dict((host, {
+        'tasks': [],
+        'status': 'pending',
+        'recap': {},
+        'vendor': None,
+        'model': host,
+        'ip': None
+    }) for host in hosts)
+
+
+def run_legacy(lines, hosts):
+    global current_tasks, current_recap, host_specific_data, data_lock
+    current_tasks = []
+    current_recap = {}
+    host_specific_data = new_host_data(hosts)
+    data_lock = TimedLock()
+    
+    hostname = hosts[0] if hosts else None
+    start = time.perf_counter()
+    for line in lines:
+        legacy_parse_ansible_output(line, hostname)
+    return time.perf_counter() - start, data_lock.holds
+
+
+def run_current(lines, hosts):
+    run_ansible.host_shards = {}
+    run_ansible.events = run_state.EventLog()
+    lock = TimedLock()
+    spill_dir = tempfile.mkdtemp(prefix='parser_replay_')
+    with run_ansible.registry_lock:
+        for host in hosts:
+            shard = run_state.HostShard(host, model=host, spill_dir=spill_dir)
+            # One timed lock shared by every shard, to count all acquisitions
+            shard.lock = lock
+            run_ansible.host_shards[host] = shard
+    
+    hostname = hosts[0] if hosts else None
+    start = time.perf_counter()
+    for line in lines:
+        run_ansible.parse_ansible_output(line, hostname)
+    return time.perf_counter() - start, lock.holds
+
+
+def summarize(name, line_count, elapsed, holds):
+    total_hold = sum(holds)
+    return {
+        'parser': name,
+        'lines': line_count,
+        'seconds': round(elapsed, 4),
+        'lines_per_sec': int(line_count / elapsed) if elapsed else 0,
+        'lock_acquisitions': len(holds),
+        'lock_hold_total_ms': round(total_hold * 1000, 3),
+        'lock_hold_mean_us': round(total_hold / len(holds) * 1e6, 2) if holds else 0,
+        'lock_hold_max_us': round(max(holds) * 1e6, 2) if holds else 0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay upgrade_run.log files through the output parsers')
+    parser.add_argument('logs', nargs='*', help='Log files to replay (default: search --log-root)')
+    parser.add_argument('--log-root', default=LOG_BASE, help='Root of <date>/<time>/upgrade_run.log folders')
+    parser.add_argument('--limit', type=int, default=0, help='Only replay the N most recent runs')
+    parser.add_argument('--repeat', type=int, default=1, help='Replay each log N times')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+    
+    paths = args.logs or find_logs(args.log_root, args.limit)
+    if not paths:
+        print("No upgrade_run.log files found under {}".format(args.log_root))
+        sys.exit(1)
+    
+    lines = []
+    for path in paths:
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', errors='replace') as f:
+            lines.extend(line.strip() for line in f)
+    lines = lines * args.repeat
+    hosts = hosts_in(lines)
+    
+    results = []
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        for name, runner in (('legacy', run_legacy), ('classifier', run_current)):
+            elapsed, holds = runner(lines, hosts)
+            results.append(summarize(name, len(lines), elapsed, holds))
+    
+    if args.json:
+        print(json.dumps({'logs': paths, 'hosts': hosts, 'results': results}, indent=2))
+        return
+    
+    print("Replayed {} lines from {} log(s), {} host(s)".format(len(lines), len(paths), len(hosts)))
+    print("{:<12}{:>14}{:>12}{:>16}{:>14}{:>14}".format(
+        'parser', 'lines/sec', 'lock acq', 'lock total ms', 'mean us', 'max us'))
+    for result in results:
+        print("{:<12}{:>14}{:>12}{:>16}{:>14}{:>14}".format(
+            result['parser'], result['lines_per_sec'], result['lock_acquisitions'],
+            result['lock_hold_total_ms'], result['lock_hold_mean_us'], result['lock_hold_max_us']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Load test: hundreds of report viewers on one controller.
+
+Starts the app in a child process (serve.py's gevent server, or the Flask
+development server with --server dev), fakes a running job whose host emits
+a task line --rate times a second, and opens --viewers concurrent /submit
+event streams from one asyncio client. Reports how many viewers connected,
+time to the first event, how long task events took to reach the viewers,
+and the server's thread count and memory while all streams were open.
+
+Usage:
+  python3 benchmarks/sse_viewers.py                        # 500 viewers, gevent
+  python3 benchmarks/sse_viewers.py --viewers 300 --server dev
+  python3 benchmarks/sse_viewers.py --viewers 1000 --seconds 20 --json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+LOAD_HOST = 'load-test'
+
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def serve(server, port, rate):
+    """Child process: run the app with a fake job emitting rate task lines a second."""
+    raise_fd_limit()
+    if server == 'gevent':
+        import serve as production  # monkey-patches before run_ansible is imported
+    import run_ansible
+    from threading import Thread
+
+    with run_ansible.registry_lock:
+        run_ansible.register_host(LOAD_HOST, 'versa', LOAD_HOST, '127.0.0.1')
+        # A queued job keeps the event streams open
+        run_ansible.set_process(LOAD_HOST, None)
+
+    def emit():
+        while True:
+            # The task name carries its send time so viewers can measure lag
+            run_ansible.parse_ansible_output("TASK [tick {:.6f}] ***".format(time.time()), LOAD_HOST)
+            time.sleep(1.0 / rate)
+
+    Thread(target=emit, daemon=True).start()
+    if server == 'gevent':
+        production.main(['--bind', '127.0.0.1', '--port', str(port), '--no-access-log'])
+    else:
+        run_ansible.app.run(host='127.0.0.1', port=port, threaded=True, use_reloader=False)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def server_usage(pid):
+    """Threads and resident memory (KB) of the server process, from /proc."""
+    usage = {}
+    try:
+        with open('/proc/{}/status'.format(pid)) as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key == 'Threads':
+                    usage['threads'] = int(value)
+                elif key == 'VmRSS':
+                    usage['rss_kb'] = int(value.split()[0])
+    except OSError:
+        pass
+    return usage
+
+
+async def viewer(port, deadline, stats):
+    started = time.time()
+    try:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    except OSError:
+        stats['failed'] += 1
+        return
+    writer.write("GET /submit HTTP/1.1\r\nHost: 127.0.0.1\r\nAccept: text/event-stream\r\n\r\n".encode())
+    connected = False
+    try:
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                line = await asyncio.wait_for(reader.readline(), remaining)
+            except asyncio.TimeoutError:
+                break
+            if not line:
+                break
+            if not line.startswith(b'data: '):
+                continue
+            if not connected:
+                connected = True
+                stats['connected'] += 1
+                stats['first_event'].append(time.time() - started)
+            event = json.loads(line[6:])
+            if event.get('type') == 'task':
+                stats['events'] += 1
+                sent = float(event['task']['name'].split()[-1])
+                if sent >= started:
+                    # Backlog replayed on connect is not live delivery
+                    stats['lag'].append(time.time() - sent)
+    except (OSError, ValueError):
+        pass
+    finally:
+        if not connected:
+            stats['failed'] += 1
+        writer.close()
+
+
+async def load(port, viewers, seconds, pid):
+    stats = {'connected': 0, 'failed': 0, 'events': 0, 'first_event': [], 'lag': []}
+    deadline = time.time() + seconds
+    tasks = [asyncio.ensure_future(viewer(port, deadline, stats)) for _ in range(viewers)]
+    # Sample the server halfway through, with every stream open
+    await asyncio.sleep(seconds / 2)
+    stats['server'] = server_usage(pid)
+    await asyncio.gather(*tasks)
+    return stats
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def wait_for_port(port, process, timeout=15):
+    end = time.time() + timeout
+    while time.time() < end and process.poll() is None:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent report viewers against one controller')
+    parser.add_argument('--viewers', type=int, default=500)
+    parser.add_argument('--seconds', type=float, default=10, help='How long every viewer stays connected')
+    parser.add_argument('--rate', type=float, default=5, help='Task lines per second from the fake job')
+    parser.add_argument('--server', choices=('gevent', 'dev'), default='gevent')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    parser.add_argument('--serve', choices=('gevent', 'dev'), help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port, args.rate)
+        return
+
+    raise_fd_limit()
+    port = free_port()
+    work_dir = tempfile.mkdtemp(prefix='sse_viewers_')
+    env = dict(os.environ, RUN_HISTORY_DB=os.path.join(work_dir, 'run_history.db'),
+               VOS_TASK_SPILL_DIR=os.path.join(work_dir, 'spill'))
+    with open(os.devnull, 'w') as devnull:
+        server = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), '--serve', args.server, '--port', str(port),
+             '--rate', str(args.rate)],
+            cwd=ROOT, env=env, stdout=devnull, stderr=devnull)
+        try:
+            if not wait_for_port(port, server):
+                print("Server did not start")
+                sys.exit(1)
+            idle = server_usage(server.pid)
+            stats = asyncio.run(load(port, args.viewers, args.seconds, server.pid))
+        finally:
+            server.terminate()
+            server.wait()
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    result = {
+        'server': args.server,
+        'viewers': args.viewers,
+        'seconds': args.seconds,
+        'connected': stats['connected'],
+        'failed': stats['failed'],
+        'first_event_p50_ms': round(percentile(stats['first_event'], 0.5) * 1000, 1),
+        'first_event_p99_ms': round(percentile(stats['first_event'], 0.99) * 1000, 1),
+        'task_events_delivered': stats['events'],
+        'event_lag_p50_ms': round(percentile(stats['lag'], 0.5) * 1000, 1),
+        'event_lag_p99_ms': round(percentile(stats['lag'], 0.99) * 1000, 1),
+        'server_idle': idle,
+        'server_loaded': stats['server'],
+    }
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    print("{} viewers for {} s on the {} server".format(args.viewers, args.seconds, args.server))
+    print("connected: {}  failed: {}".format(result['connected'], result['failed']))
+    print("first event: p50 {} ms  p99 {} ms".format(result['first_event_p50_ms'], result['first_event_p99_ms']))
+    print("task events delivered: {}  lag p50 {} ms  p99 {} ms".format(
+        result['task_events_delivered'], result['event_lag_p50_ms'], result['event_lag_p99_ms']))
+    print("server threads: {} idle, {} loaded; RSS {} KB idle, {} KB loaded".format(
+        idle.get('threads'), stats['server'].get('threads'), idle.get('rss_kb'), stats['server'].get('rss_kb')))
+
+
+if __name__ == '__main__':
+    main()
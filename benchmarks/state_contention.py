@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Measure writer throughput and /api/shell-status latency under contention.
+
+N writer threads each feed a simulated ansible-playbook output stream for
+their own host through parse_ansible_output, while M reader threads poll
+/api/shell-status (alternating full snapshots and since-cursor deltas). With
+--global-lock every shard shares one lock and readers take it too, which is
+how the report behaved with a single data_lock.
+
+Usage:
+  python3 benchmarks/state_contention.py                   # 8 writers, 4 readers, 5 s
+  python3 benchmarks/state_contention.py --writers 32 --readers 16 --seconds 10
+  python3 benchmarks/state_contention.py --global-lock
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from threading import Event, Lock, Thread
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+WORK_DIR = tempfile.mkdtemp(prefix='state_contention_')
+os.environ.setdefault('RUN_HISTORY_DB', os.path.join(WORK_DIR, 'run_history.db'))
+os.environ.setdefault('VOS_TASK_SPILL_DIR', os.path.join(WORK_DIR, 'spill'))
+
+import run_ansible
+import run_state
+
+TASK_NAMES = [
+    "Gather facts now that host is confirmed reachable",
+    "Get current package info",
+    "Verify VNI interfaces are present as expected",
+    "Wait for versa services to become ready",
+]
+
+
+def output_stream(host):
+    """Endless TASK banner / result line pairs for host."""
+    i = 0
+    while True:
+        yield "TASK [{}] ***".format(TASK_NAMES[i % len(TASK_NAMES)])
+        if i % 50 == 49:
+            yield 'fatal: [{}]: FAILED! => {{"changed": false, "msg": "Timed out"}}'.format(host)
+        else:
+            yield 'changed: [{}] => {{"changed": true, "stdout": "done"}}'.format(host)
+        i += 1
+
+
+def writer(host, stop, counts, index):
+    lines = 0
+    for line in output_stream(host):
+        if stop.is_set():
+            break
+        run_ansible.parse_ansible_output(line, host)
+        lines += 1
+    counts[index] = lines
+
+
+def reader(client, stop, latencies, global_lock):
+    cursor = None
+    while not stop.is_set():
+        url = '/api/shell-status' if cursor is None else '/api/shell-status?since={}'.format(cursor)
+        start = time.perf_counter()
+        if global_lock is not None:
+            with global_lock:
+                response = client.get(url)
+        else:
+            response = client.get(url)
+        latencies.append(time.perf_counter() - start)
+        # Every other poll is a delta from the previous cursor
+        cursor = None if cursor is not None else json.loads(response.get_data())['cursor']
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run(writers, readers, seconds, global_lock):
+    run_ansible.host_shards = {}
+    run_ansible.events = run_state.EventLog()
+    run_ansible.status_snapshots = {}
+    hosts = ['csg-{}'.format(i) for i in range(writers)]
+    lock = Lock() if global_lock else None
+    with run_ansible.registry_lock:
+        for host in hosts:
+            run_ansible.register_host(host, 'versa', host, None)
+            if lock is not None:
+                run_ansible.host_shards[host].lock = lock
+
+    stop = Event()
+    counts = [0] * writers
+    latencies = []
+    threads = [Thread(target=writer, args=(host, stop, counts, i)) for i, host in enumerate(hosts)]
+    threads += [Thread(target=reader, args=(run_ansible.app.test_client(), stop, latencies, lock))
+                for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    return {
+        'mode': 'global lock' if global_lock else 'sharded',
+        'writers': writers,
+        'readers': readers,
+        'writer_lines_per_sec': int(sum(counts) / seconds),
+        'reads': len(latencies),
+        'read_p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+        'read_p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Writer throughput and shell-status latency under contention')
+    parser.add_argument('--writers', type=int, default=8, help='Simulated output streams, one host each')
+    parser.add_argument('--readers', type=int, default=4, help='Threads polling /api/shell-status')
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--global-lock', action='store_true', help='Share one lock between all writers and readers')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    try:
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            result = run(args.writers, args.readers, args.seconds, args.global_lock)
+    finally:
+        shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    print("{} writers, {} readers, {} s, {}".format(args.writers, args.readers, args.seconds, result['mode']))
+    print("writer lines/sec: {}".format(result['writer_lines_per_sec']))
+    print("reads: {}  p50 {} ms  p99 {} ms".format(result['reads'], result['read_p50_ms'], result['read_p99_ms']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Compare the memory the report's task state takes with the old dict layout
+and with task_store.
+
+The old layout kept every task as a dict in current_tasks plus a .copy() in
+host_specific_data[host]['tasks'], with no bound. task_store keeps one
+immutable record per task in the host's ring buffer and spills tasks beyond
+the retention to disk. The task_store row is measured as the app runs it:
+every task start and end is published in a HostShard snapshot and recorded
+in the delta event log, which holds the latest --event-retention events and
+shares the records with the ring buffer.
+
+Usage:
+  python3 benchmarks/task_memory.py                        # 20 hosts x 2000 tasks
+  python3 benchmarks/task_memory.py --hosts 100 --tasks 500 --retention 200
+  python3 benchmarks/task_memory.py --event-retention 100000
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import run_state
+import task_store
+
+TASK_NAMES = [
+    "Gather facts now that host is confirmed reachable",
+    "Get current package info",
+    "Verify Interface PCIe addresses are present on the host device",
+    "Verify VNI interfaces are present as expected",
+    "Wait for versa services to become ready",
+    "Log successful connection",
+]
+
+
+def task_name(i):
+    # Names come out of the output parser as fresh strings, as they do live
+    return ''.join(list(TASK_NAMES[i % len(TASK_NAMES)]))
+
+
+def fill_dicts(hosts, count):
+    current_tasks = []
+    host_data = dict((host, {'tasks': []}) for host in hosts)
+    for i in range(count):
+        for host in hosts:
+            task = {
+                'timestamp': datetime.now().strftime('%H:%M:%S'),
+                'name': task_name(i),
+                'host': host,
+                'status': 'running',
+                'details': 'In progress...'
+            }
+            current_tasks.append(task)
+            host_data[host]['tasks'].append(task.copy())
+            host_data[host]['tasks'][-1].update(status='ok', details='')
+            task.update(status='ok', details='')
+    return current_tasks, host_data
+
+
+def fill_store(hosts, count, retention, event_retention, spill_dir):
+    shards = dict((host, run_state.HostShard(host, retention=retention, spill_dir=spill_dir)) for host in hosts)
+    events = run_state.EventLog(event_retention)
+    for i in range(count):
+        for host in hosts:
+            shard = shards[host]
+            record = shard.start_task(task_name(i))
+            events.record('task', {'host': host, 'task': record})
+            record = shard.update_task(record, 'ok', '')
+            events.record('task', {'host': host, 'task': record})
+            shard.publish()
+    return shards, events
+
+
+def measure(fill, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    state = fill(*args)
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return state, {'seconds': round(elapsed, 3), 'retained_kb': current // 1024, 'peak_kb': peak // 1024}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Memory used by the task state of a run')
+    parser.add_argument('--hosts', type=int, default=20)
+    parser.add_argument('--tasks', type=int, default=2000, help='Tasks per host')
+    parser.add_argument('--retention', type=int, default=task_store.DEFAULT_RETENTION)
+    parser.add_argument('--event-retention', type=int, default=run_state.DEFAULT_EVENT_RETENTION)
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    hosts = ['host-{}'.format(i) for i in range(args.hosts)]
+    spill_dir = tempfile.mkdtemp(prefix='task_memory_')
+    try:
+        _, dicts = measure(fill_dicts, hosts, args.tasks)
+        (shards, events), records = measure(fill_store, hosts, args.tasks, args.retention, args.event_retention,
+                                            spill_dir)
+        spilled = sum(os.path.getsize(os.path.join(spill_dir, name)) for name in os.listdir(spill_dir))
+        results = {
+            'hosts': args.hosts,
+            'tasks_per_host': args.tasks,
+            'retention': args.retention,
+            'event_retention': args.event_retention,
+            'dicts': dicts,
+            'task_store': dict(records, spilled_kb=spilled // 1024,
+                               in_memory=sum(len(shard.tasks.records) for shard in shards.values()),
+                               events_in_memory=len(events.events)),
+        }
+    finally:
+        shutil.rmtree(spill_dir)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print("{} hosts x {} tasks, retention {}, event retention {}".format(
+        args.hosts, args.tasks, args.retention, args.event_retention))
+    print("{:<12} {:>10} {:>12} {:>10}".format('layout', 'seconds', 'retained KB', 'peak KB'))
+    for name in ('dicts', 'task_store'):
+        row = results[name]
+        print("{:<12} {:>10} {:>12} {:>10}".format(name, row['seconds'], row['retained_kb'], row['peak_kb']))
+    print("task_store spilled {} KB to disk, {} records and {} events in memory".format(
+        results['task_store']['spilled_kb'], results['task_store']['in_memory'],
+        results['task_store']['events_in_memory']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+"""
+Upgrade job queue with admission control.
+
+Jobs are admitted in FIFO order as long as the global cap and the per-vendor
+and per-model caps allow it; a job that does not fit is skipped over so
+other vendors/models can still start. Running jobs can be cancelled, which
+kills their whole process group, and finished jobs can be requeued.
+"""
+
+import os
+import signal
+import time
+import uuid
+from datetime import datetime
+from threading import Thread, Lock, Timer
+
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+FINISHED_STATES = (COMPLETED, FAILED, CANCELLED)
+
+# Seconds between SIGTERM and SIGKILL when cancelling a running job
+CANCEL_GRACE_SECONDS = 10
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+class Job(object):
+    """One ansible-playbook run: a single device, or several in batch mode."""
+
+    def __init__(self, kind, build_version, devices, hostnames, download_latest="false", options=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.build_version = build_version
+        self.devices = devices
+        self.hostnames = hostnames
+        self.download_latest = download_latest
+        self.options = options or {}
+        self.state = QUEUED
+        self.return_code = None
+        self.error = None
+        self.requeued_from = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.process = None
+        self.cancel_requested = False
+        # Runs so far; with the durable queue, the worker holding the lease
+        self.attempts = 0
+        self.worker = None
+        self.lease_expires = None
+
+    @property
+    def vendors(self):
+        return set(device.get('vendor') for device in self.devices)
+
+    @property
+    def models(self):
+        return set((device.get('vendor'), device.get('model')) for device in self.devices)
+
+    def attach_process(self, process):
+        """Remember the job's process; kill it right away if cancel came first."""
+        self.process = process
+        if self.cancel_requested:
+            self.kill()
+
+    def kill(self, sig=signal.SIGTERM):
+        """Signal the job's whole process group (foldering.sh, ansible-playbook, ssh)."""
+        process = self.process
+        if process is None or process.poll() is not None:
+            return False
+        try:
+            os.killpg(os.getpgid(process.pid), sig)
+        except (OSError, ProcessLookupError):
+            return False
+        return True
+
+    def to_dict(self):
+        def stamp(value):
+            return datetime.fromtimestamp(value).isoformat() if value else None
+
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'state': self.state,
+            'build_version': self.build_version,
+            'download_latest': self.download_latest,
+            'hosts': self.hostnames,
+            'devices': [dict((k, v) for k, v in device.items() if k != 'password') for device in self.devices],
+            'options': self.options,
+            'return_code': self.return_code,
+            'error': self.error,
+            'requeued_from': self.requeued_from,
+            'created_at': stamp(self.created_at),
+            'started_at': stamp(self.started_at),
+            'finished_at': stamp(self.finished_at),
+            'pid': self.process.pid if self.process is not None else None,
+            'worker': self.worker,
+            'attempts': self.attempts
+        }
+
+
+class JobQueue(object):
+    """FIFO job queue with a global concurrency cap and per-vendor/model caps.
+
+    runner(job) is called on its own thread and must block until the job's
+    process exits, returning its exit code. on_finish(job) is called after a
+    job leaves the running state, including queued jobs that are cancelled.
+    """
+
+    def __init__(self, runner, on_finish=None, max_running=None, max_per_vendor=None, max_per_model=None):
+        self.runner = runner
+        self.on_finish = on_finish
+        self.max_running = max_running if max_running is not None else _env_int('UPGRADE_MAX_JOBS', 8)
+        # 0 means no per-vendor / per-model limit
+        self.max_per_vendor = max_per_vendor if max_per_vendor is not None else _env_int('UPGRADE_MAX_JOBS_PER_VENDOR', 0)
+        self.max_per_model = max_per_model if max_per_model is not None else _env_int('UPGRADE_MAX_JOBS_PER_MODEL', 0)
+        self.jobs = {}
+        self._order = []
+        self._lock = Lock()
+
+    def submit(self, job):
+        with self._lock:
+            self.jobs[job.id] = job
+            self._order.append(job.id)
+        print("Job {} queued ({} device(s))".format(job.id, len(job.devices)))
+        self._schedule()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def list(self, state=None):
+        with self._lock:
+            jobs = [self.jobs[job_id] for job_id in self._order]
+        if state:
+            jobs = [job for job in jobs if job.state == state]
+        return jobs
+
+    def active_count(self):
+        """Jobs that are queued or running."""
+        with self._lock:
+            return sum(1 for job in self.jobs.values() if job.state not in FINISHED_STATES)
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job. Returns the job, or None if unknown."""
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.state in FINISHED_STATES:
+                return job
+            job.cancel_requested = True
+            was_queued = job.state == QUEUED
+            if was_queued:
+                job.state = CANCELLED
+                job.finished_at = time.time()
+
+        if was_queued:
+            print("Job {} cancelled before it started".format(job.id))
+            self._finished(job)
+        else:
+            print("Cancelling running job {}".format(job.id))
+            if job.kill():
+                timer = Timer(CANCEL_GRACE_SECONDS, job.kill, args=(signal.SIGKILL,))
+                timer.daemon = True
+                timer.start()
+        return job
+
+    def requeue(self, job_id, prepare=None):
+        """Queue a copy of a finished job. prepare(new_job) runs before it is submitted."""
+        with self._lock:
+            old = self.jobs.get(job_id)
+            if old is None or old.state not in FINISHED_STATES:
+                return None
+        job = Job(old.kind, old.build_version, old.devices, old.hostnames, old.download_latest, old.options)
+        job.requeued_from = old.id
+        if prepare is not None:
+            prepare(job)
+        return self.submit(job)
+
+    def _admissible(self, job, running):
+        if len(running) >= self.max_running:
+            return False
+        if self.max_per_vendor:
+            for vendor in job.vendors:
+                if sum(1 for other in running if vendor in other.vendors) >= self.max_per_vendor:
+                    return False
+        if self.max_per_model:
+            for model in job.models:
+                if sum(1 for other in running if model in other.models) >= self.max_per_model:
+                    return False
+        return True
+
+    def _schedule(self):
+        """Start every queued job that fits within the caps, oldest first."""
+        to_start = []
+        with self._lock:
+            running = [job for job in self.jobs.values() if job.state == RUNNING]
+            for job_id in self._order:
+                job = self.jobs[job_id]
+                if job.state != QUEUED:
+                    continue
+                if self._admissible(job, running):
+                    job.state = RUNNING
+                    job.started_at = time.time()
+                    job.attempts += 1
+                    running.append(job)
+                    to_start.append(job)
+
+        for job in to_start:
+            thread = Thread(target=self._run, args=(job,))
+            thread.daemon = True
+            thread.start()
+
+    def _run(self, job):
+        print("Job {} started".format(job.id))
+        try:
+            job.return_code = self.runner(job)
+        except Exception as e:
+            print("Job {} failed to run: {}".format(job.id, str(e)))
+            job.error = str(e)
+
+        with self._lock:
+            self._settle(job)
+        print("Job {} {} (return code {})".format(job.id, job.state, job.return_code))
+
+        self._finished(job)
+        self._schedule()
+
+    def _settle(self, job):
+        """Move a job whose run has ended to its final state. Caller holds _lock."""
+        if job.cancel_requested:
+            job.state = CANCELLED
+        elif job.error is None and job.return_code == 0:
+            job.state = COMPLETED
+        else:
+            job.state = FAILED
+        job.finished_at = time.time()
+
+    def _finished(self, job):
+        if self.on_finish is not None:
+            try:
+                self.on_finish(job)
+            except Exception as e:
+                print("Error finishing job {}: {}".format(job.id, str(e)))
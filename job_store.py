@@ -0,0 +1,250 @@
+"""
+Durable job queue in SQLite, for running jobs on worker controllers.
+
+With VOS_JOB_BACKEND=sqlite, run_ansible.py queues jobs in a DurableJobQueue
+instead of running them itself. worker.py processes, on this controller or
+on other lab controllers, claim jobs over HTTP, run foldering.sh and relay
+the output back. A claim comes with a lease that every heartbeat and event
+batch renews; a job whose lease runs out (worker killed, controller down)
+goes back to the queue, and is failed once it has been claimed
+VOS_JOB_MAX_ATTEMPTS times. The JobQueue admission caps apply across all
+workers.
+
+Every change is written through to SQLite before it is acknowledged, so
+queued and running jobs survive a restart of the coordinator. Another
+backend only has to provide the same methods (submit, get, list,
+active_count, cancel, requeue, claim, renew, finish).
+"""
+
+import json
+import os
+import sqlite3
+import time
+from threading import Thread
+
+from job_queue import Job, JobQueue, QUEUED, RUNNING, CANCELLED, FAILED, FINISHED_STATES
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+DEFAULT_DB_PATH = os.environ.get('VOS_JOB_DB', '/var/log/ansible/jobs.db')
+
+# Seconds a claim stays valid without a heartbeat
+LEASE_SECONDS = _env_int('VOS_JOB_LEASE_SECONDS', 30)
+MAX_ATTEMPTS = _env_int('VOS_JOB_MAX_ATTEMPTS', 2)
+
+# Finished jobs loaded back on startup, for /api/jobs
+FINISHED_JOBS_LOADED_SECONDS = 24 * 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT,
+    build_version TEXT,
+    devices TEXT,
+    hostnames TEXT,
+    download_latest TEXT,
+    options TEXT,
+    state TEXT,
+    return_code INTEGER,
+    error TEXT,
+    requeued_from TEXT,
+    created_at REAL,
+    started_at REAL,
+    finished_at REAL,
+    cancel_requested INTEGER,
+    attempts INTEGER,
+    worker TEXT,
+    lease_expires REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs (state, created_at);
+"""
+
+RECORD_FIELDS = ('id', 'kind', 'build_version', 'devices', 'hostnames', 'download_latest', 'options', 'state',
+                 'return_code', 'error', 'requeued_from', 'created_at', 'started_at', 'finished_at',
+                 'cancel_requested', 'attempts', 'worker', 'lease_expires')
+JSON_FIELDS = ('devices', 'hostnames', 'options')
+
+
+def job_record(job):
+    """Every field of a job as plain values, device passwords included.
+    This is what is stored, and what a worker gets when it claims the job."""
+    return dict((field, getattr(job, field)) for field in RECORD_FIELDS)
+
+
+def job_from_record(record):
+    job = Job(record['kind'], record['build_version'], record['devices'], record['hostnames'],
+              record['download_latest'], record['options'])
+    for field in RECORD_FIELDS:
+        setattr(job, field, record[field])
+    job.cancel_requested = bool(job.cancel_requested)
+    return job
+
+
+class DurableJobQueue(JobQueue):
+    """JobQueue whose jobs are persisted in SQLite and run by remote workers.
+
+    Jobs are never started here: workers claim() them, renew() the lease
+    while they run and finish() them with the exit code. on_requeue(job) is
+    called when a job goes back to the queue because its lease expired.
+    """
+
+    def __init__(self, path=DEFAULT_DB_PATH, on_finish=None, on_requeue=None, lease_seconds=LEASE_SECONDS,
+                 max_attempts=MAX_ATTEMPTS, **caps):
+        JobQueue.__init__(self, None, on_finish, **caps)
+        self.path = path
+        self.on_requeue = on_requeue
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        # Device credentials are stored with the jobs
+        os.chmod(path, 0o600)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+        self._load()
+
+        self.thread = Thread(target=self._reaper)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _load(self):
+        rows = self._conn.execute(
+            "SELECT * FROM jobs WHERE state IN (?, ?) OR finished_at >= ? ORDER BY created_at",
+            (QUEUED, RUNNING, time.time() - FINISHED_JOBS_LOADED_SECONDS)).fetchall()
+        for row in rows:
+            record = dict(row)
+            for field in JSON_FIELDS:
+                record[field] = json.loads(record[field])
+            job = job_from_record(record)
+            self.jobs[job.id] = job
+            self._order.append(job.id)
+        if rows:
+            print("Loaded {} job(s) from {}".format(len(rows), self.path))
+
+    def _save(self, job):
+        """Write job through to SQLite. Caller holds _lock."""
+        record = job_record(job)
+        for field in JSON_FIELDS:
+            record[field] = json.dumps(record[field])
+        record['cancel_requested'] = int(job.cancel_requested)
+        self._conn.execute(
+            "INSERT OR REPLACE INTO jobs ({}) VALUES ({})".format(', '.join(RECORD_FIELDS), ', '.join('?' * len(RECORD_FIELDS))),
+            [record[field] for field in RECORD_FIELDS])
+        self._conn.commit()
+
+    def submit(self, job):
+        with self._lock:
+            self._save(job)
+        return JobQueue.submit(self, job)
+
+    def cancel(self, job_id):
+        """Cancel a queued job, or ask the worker running it to stop at its next heartbeat."""
+        job = JobQueue.cancel(self, job_id)
+        if job is not None:
+            with self._lock:
+                self._save(job)
+        return job
+
+    def _schedule(self):
+        # Workers pull jobs with claim()
+        pass
+
+    def claim(self, worker):
+        """Lease the oldest queued job that fits within the caps to worker, or return None."""
+        with self._lock:
+            running = [job for job in self.jobs.values() if job.state == RUNNING]
+            for job_id in self._order:
+                job = self.jobs[job_id]
+                if job.state != QUEUED or not self._admissible(job, running):
+                    continue
+                job.state = RUNNING
+                job.started_at = time.time()
+                job.attempts += 1
+                job.worker = worker
+                job.lease_expires = job.started_at + self.lease_seconds
+                self._save(job)
+                return job
+        return None
+
+    def renew(self, job_id, worker):
+        """Extend worker's lease on a running job. Returns the job, or None if worker no longer holds it."""
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.state != RUNNING or job.worker != worker:
+                return None
+            job.lease_expires = time.time() + self.lease_seconds
+            self._save(job)
+            return job
+
+    def finish(self, job_id, worker, return_code, error=None):
+        """Record the end of worker's run of a job. Returns the job, or None if worker no longer holds it."""
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.state != RUNNING or job.worker != worker:
+                return None
+            job.return_code = return_code
+            job.error = error
+            job.lease_expires = None
+            self._settle(job)
+            self._save(job)
+        print("Job {} {} on worker {} (return code {})".format(job.id, job.state, worker, job.return_code))
+        self._finished(job)
+        return job
+
+    def expire_leases(self):
+        """Requeue or fail the running jobs whose lease has run out."""
+        now = time.time()
+        requeued = []
+        finished = []
+        with self._lock:
+            for job in self.jobs.values():
+                if job.state != RUNNING or job.lease_expires is None or job.lease_expires > now:
+                    continue
+                print("Lease of job {} on worker {} expired".format(job.id, job.worker))
+                job.worker = None
+                job.lease_expires = None
+                if job.cancel_requested:
+                    job.state = CANCELLED
+                    job.finished_at = now
+                    finished.append(job)
+                elif job.attempts >= self.max_attempts:
+                    job.state = FAILED
+                    job.error = "Worker lease expired after {} attempt(s)".format(job.attempts)
+                    job.finished_at = now
+                    finished.append(job)
+                else:
+                    job.state = QUEUED
+                    requeued.append(job)
+                self._save(job)
+
+        for job in finished:
+            self._finished(job)
+        for job in requeued:
+            if self.on_requeue is not None:
+                try:
+                    self.on_requeue(job)
+                except Exception as e:
+                    print("Error requeueing job {}: {}".format(job.id, str(e)))
+        return requeued + finished
+
+    def _reaper(self):
+        while True:
+            time.sleep(max(1, self.lease_seconds / 3.0))
+            try:
+                self.expire_leases()
+            except sqlite3.Error as e:
+                print("Error expiring job leases: {}".format(str(e)))
+
+    def active(self):
+        """Queued and running jobs, oldest first."""
+        return [job for job in self.list() if job.state not in FINISHED_STATES]
@@ -0,0 +1,170 @@
+"""
+Running foldering.sh for a job.
+
+Shared by run_ansible.py, which runs jobs on the controller itself, and
+worker.py, which runs jobs claimed from a coordinator. Both get every stdout
+line and, when the vos_events callback plugin connects, every structured
+callback event through the functions they pass in.
+"""
+
+import json
+import os
+import socket
+import subprocess
+import tempfile
+import uuid
+from threading import Thread
+
+# Structured events from the vos_events callback plugin
+CALLBACK_PLUGIN_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "Upgrade_Testing", "callback_plugins"))
+
+# Started with the repository root as working directory
+FOLDERING_SCRIPT = os.environ.get('VOS_FOLDERING_SCRIPT', './Upgrade_Testing/foldering.sh')
+
+
+class CallbackEventListener(object):
+    """Receives vos_events callback events for one ansible run over a Unix socket.
+
+    Once the callback plugin connects, task state comes from its JSON events
+    and stdout is only echoed; if it never connects the stdout text parser
+    stays in charge.
+    """
+
+    def __init__(self, hostname, on_event):
+        self.hostname = hostname
+        self.on_event = on_event
+        self.connected = False
+        self.path = os.path.join(tempfile.gettempdir(), "vos_events_{}_{}.sock".format(hostname, uuid.uuid4().hex[:8]))
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.path)
+        self.server.listen(1)
+        self.server.settimeout(1)
+        self.thread = None
+
+    def env(self):
+        """Environment that makes ansible-playbook load the callback and connect to us."""
+        env = dict(os.environ)
+        enabled = [name for name in env.get('ANSIBLE_CALLBACKS_ENABLED', '').split(',') if name]
+        enabled.append('vos_events')
+        plugin_paths = [path for path in env.get('ANSIBLE_CALLBACK_PLUGINS', '').split(':') if path]
+        plugin_paths.append(CALLBACK_PLUGIN_DIR)
+        env['ANSIBLE_CALLBACKS_ENABLED'] = ','.join(enabled)
+        env['ANSIBLE_CALLBACK_WHITELIST'] = ','.join(enabled)
+        env['ANSIBLE_CALLBACK_PLUGINS'] = ':'.join(plugin_paths)
+        env['VOS_EVENTS_SOCKET'] = self.path
+        return env
+
+    def start(self, process):
+        self.thread = Thread(target=self._run, args=(process,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def join(self, timeout=None):
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def _run(self, process):
+        try:
+            conn = None
+            while conn is None and process.poll() is None:
+                try:
+                    conn, _ = self.server.accept()
+                except socket.timeout:
+                    continue
+            if conn is None:
+                return
+
+            self.connected = True
+            print("Structured callback events connected for {}".format(self.hostname))
+            with conn, conn.makefile('r', encoding='utf-8') as stream:
+                for line in stream:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.on_event(event)
+        except Exception as e:
+            print("Error reading callback events for {}: {}".format(self.hostname, str(e)))
+        finally:
+            self.server.close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+def write_batch_devices_file(job):
+    """Write the batch devices file; foldering.sh deletes it once read."""
+    fd, devices_file = tempfile.mkstemp(prefix="vos_batch_", suffix=".tsv")
+    with os.fdopen(fd, 'w') as f:
+        for hostname, device in zip(job.hostnames, job.devices):
+            f.write("\t".join([
+                hostname,
+                device.get('ip'),
+                device.get('vendor'),
+                device.get('model'),
+                device.get('username', 'admin'),
+                device.get('password', 'versa123')
+            ]) + "\n")
+    return devices_file
+
+
+def job_command(job):
+    """foldering.sh arguments for a device or batch job."""
+    if job.kind == 'batch':
+        devices_file = write_batch_devices_file(job)
+        return [FOLDERING_SCRIPT, "--batch", devices_file, job.build_version, job.download_latest,
+                str(job.options.get('forks', 10)), job.options.get('serial', '100%')]
+
+    device = job.devices[0]
+    return [FOLDERING_SCRIPT, job.build_version, device.get('ip'), device.get('vendor'),
+            device.get('model'), job.download_latest, device.get('username', 'admin'),
+            device.get('password', 'versa123'), job.hostnames[0]]
+
+
+def run_playbook(process_key, cmd_args, parse_line, on_event, on_start=None):
+    """Run foldering.sh and hand its progress to parse_line / on_event.
+
+    Task state comes from the vos_events callback when it connects; otherwise
+    every stdout line goes through parse_line. The process gets its own
+    session so cancelling can signal the whole group. Returns the exit code.
+    """
+    print("Starting process for {} with command: {}".format(process_key, ' '.join(cmd_args)))
+
+    try:
+        listener = CallbackEventListener(process_key, on_event)
+        env = listener.env()
+    except (OSError, AttributeError) as e:
+        print("Structured callback events unavailable for {}: {}".format(process_key, str(e)))
+        listener = None
+        env = None
+
+    process = subprocess.Popen(
+        cmd_args,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        bufsize=1,
+        universal_newlines=True,
+        cwd=".",
+        env=env,
+        start_new_session=True
+    )
+
+    print("Process started for {} with PID: {}".format(process_key, process.pid))
+
+    if on_start is not None:
+        on_start(process)
+    if listener is not None:
+        listener.start(process)
+
+    for line in iter(process.stdout.readline, ''):
+        if line:
+            if listener is not None and listener.connected:
+                print("Output for {}: {}".format(process_key, line.rstrip()))
+            else:
+                parse_line(line.strip())
+
+    return_code = process.wait()
+    print("Process for {} completed with return code: {}".format(process_key, return_code))
+
+    if listener is not None:
+        listener.join(timeout=10)
+    return return_code
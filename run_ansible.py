@@ -2,20 +2,125 @@ from flask import Flask, request, render_template, Response, jsonify, redirect,
 import subprocess
 import sys
 import json
-import time
-import re
+import collections
+import gzip
+import hmac
 import os
+import queue
 from datetime import datetime
-from threading import Thread, Lock
+from threading import Lock
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+import ansible_output
+import job_queue
+import job_store
+import playbook_runner
+import run_history
+import run_state
+from ansible_output import classify_line
+from job_queue import Job, JobQueue
 
 app = Flask(__name__)
 
-# Global variables with thread safety
-processes = {}  # {hostname: process}
-current_tasks = []
-current_recap = {}
-host_specific_data = {}
-data_lock = Lock()
+# Where `python3 run_ansible.py` (development server) and serve.py listen
+BIND_ADDRESS = os.environ.get('VOS_BIND', '0.0.0.0')
+PORT = int(os.environ.get('VOS_PORT', 5000))
+
+# Report state, sharded per host (see run_state.py). host_shards, processes
+# and host_runs are copy-on-write: writers build a new dict under
+# registry_lock and rebind the name, readers use whatever table they find
+# without locking. registry_version is bumped whenever one is replaced.
+registry_lock = Lock()
+host_shards = {}  # {hostname: HostShard}, unregistered hosts included
+processes = {}  # {job_id: process}, None while the job is queued
+host_runs = {}  # {hostname: job_id}
+registry_version = 0
+
+# Delta log consumed by the SSE stream and the shell-status cursor. Event
+# ids keep increasing across submissions so a reconnecting EventSource can
+# resume from Last-Event-ID. Only the latest VOS_EVENT_RETENTION are kept.
+EVENT_RETENTION = int(os.environ.get('VOS_EVENT_RETENTION', run_state.DEFAULT_EVENT_RETENTION))
+events = run_state.EventLog(EVENT_RETENTION)
+
+# Tasks in the shell-status timeline, merged from the hosts' own buffers
+TIMELINE_RETENTION = int(os.environ.get('VOS_TASK_TIMELINE_RETENTION', 1000))
+
+# Serialized /api/shell-status bodies by (ETag, since, hosts); the dict is
+# replaced rather than trimmed so readers never need a lock for it
+status_snapshots = {}
+STATUS_SNAPSHOT_CACHE_SIZE = 16
+
+# JSON responses at least this large are sent compressed when the client accepts it
+COMPRESS_MIN_BYTES = 1024
+
+# Every delta event is also persisted to the run history store, keyed by
+# the job each host belongs to.
+history = run_history.open_history()
+
+# Connected SSE clients are in events.subscribers. Events are pushed to them
+# as soon as they are recorded, so nothing polls the shared state.
+SUBSCRIBER_QUEUE_SIZE = 256
+SSE_KEEPALIVE_SECONDS = 15
+
+# Serialized SSE messages by event id, shared by every viewer
+sse_messages = {}
+SSE_MESSAGE_CACHE_SIZE = 4096
+
+# Jobs run on this controller (local), or are queued in SQLite and run by
+# worker.py processes that claim them over /api/workers (sqlite, see
+# job_store.py). Claims hand out device credentials, so the sqlite backend
+# requires VOS_WORKER_TOKEN and workers must send it with every call.
+JOB_BACKEND = os.environ.get('VOS_JOB_BACKEND', 'local')
+WORKER_TOKEN = os.environ.get('VOS_WORKER_TOKEN')
+if JOB_BACKEND == 'sqlite' and not WORKER_TOKEN:
+    sys.exit("VOS_JOB_BACKEND=sqlite needs VOS_WORKER_TOKEN, the shared secret workers authenticate with")
+
+# Output parser and last applied event batch of each job running on a worker
+remote_runs = {}
+
+# Details kept from structured vos_events callback events
+STRUCTURED_DETAILS_LIMIT = 4096
+
+# Status given to a host the playbook left pending or running, by its job's final state
+FINISHED_HOST_STATUS = {
+    job_queue.COMPLETED: 'completed',
+    job_queue.FAILED: 'failed',
+    job_queue.CANCELLED: 'cancelled',
+}
+
+# Build listing and per-segment progress come from download_latest_image.py
+DOWNLOAD_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Upgrade_Testing", "download_latest_image.py")
+DOWNLOAD_PROGRESS_FILE = os.environ.get('VOS_DOWNLOAD_PROGRESS', '/var/log/ansible/image_download_progress.json')
+
+# Status records appended by the vos_upgrade_log callback plugin, rotated to .1 .. .N
+UPGRADE_EVENTS_FILE = os.environ.get('VOS_UPGRADE_EVENTS', '/var/log/ansible/upgrade_events.jsonl')
+UPGRADE_EVENTS_BACKUPS = int(os.environ.get('VOS_UPGRADE_EVENTS_BACKUPS', 5))
+
+class Subscriber(object):
+    """One SSE client with a bounded queue of pending events."""
+    
+    def __init__(self, cursor, maxsize=SUBSCRIBER_QUEUE_SIZE):
+        self.cursor = cursor
+        self.queue = queue.Queue(maxsize)
+        self.lagged = False
+    
+    def offer(self, event):
+        """Queue an event without blocking. Called with the event log's lock held.
+        
+        When the queue is full the subscriber is marked as lagged and stops
+        receiving events; it catches up later from the event log with the
+        repeated updates coalesced, so a slow client never stalls the parser.
+        """
+        if self.lagged:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.lagged = True
 
 @app.route("/")
 def index():
@@ -40,6 +145,14 @@ def handle_submit():
         action_selected = request.form.get("selectedAction")
         upgrade_to_version = request.form.get("upgradeToVersion")
         download_latest = request.form.get("downloadLatest", "false")
+        batch_mode = request.form.get("batchMode", "false") == "true"
+        serial = request.form.get("serial") or "100%"
+        try:
+            forks = max(1, int(request.form.get("forks") or 10))
+        except ValueError:
+            return jsonify({"error": "Forks must be a number"}), 400
+        if not serial.rstrip('%').isdigit():
+            return jsonify({"error": "Serial must be a host count or a percentage"}), 400
         
         print("=" * 50)
         print("FORM SUBMISSION DATA:")
@@ -47,6 +160,7 @@ def handle_submit():
         print("Action: {}".format(action_selected))
         print("Upgrade To Version: {}".format(upgrade_to_version))
         print("Download Latest: {}".format(download_latest))
+        print("Batch Mode: {} (forks={}, serial={})".format(batch_mode, forks, serial))
         print("Device Config JSON: {}".format(device_config_json))
         print("=" * 50)
 
@@ -74,26 +188,34 @@ def handle_submit():
         if action_selected and action_selected.lower() == "upgrade":
             print("Upgrade action selected - launching script for {} devices".format(len(device_configs)))
             
-            # Clear previous data
-            global processes, current_tasks, current_recap, host_specific_data
-            with data_lock:
-                processes = {}
-                current_tasks = []
-                current_recap = {}
-                host_specific_data = {}
+            # Start a fresh report only when nothing is queued or running, so a
+            # submission never wipes the state of jobs that are still in flight
+            with registry_lock:
+                reset_run_state()
             
-            # Process each device in parallel
-            for device in device_configs:
-                vendor = device.get('vendor')
-                model = device.get('model')
-                dut_ip = device.get('ip')
-                username = device.get('username', 'admin')
-                password = device.get('password', 'versa123')
-                
-                print("Processing device: {} {} at {}".format(vendor, model, dut_ip))
-                start_upgrade_process(build_version, dut_ip, vendor, model, download_latest, username, password)
+            if batch_mode:
+                print("Batch mode - one playbook run for {} devices".format(len(device_configs)))
+                jobs = [start_batch_upgrade_process(build_version, device_configs, download_latest, forks, serial)]
+            else:
+                # One job per device; the job queue decides how many run at once
+                jobs = []
+                for device in device_configs:
+                    vendor = device.get('vendor')
+                    model = device.get('model')
+                    dut_ip = device.get('ip')
+                    username = device.get('username', 'admin')
+                    password = device.get('password', 'versa123')
+                    
+                    print("Queueing device: {} {} at {}".format(vendor, model, dut_ip))
+                    jobs.append(start_upgrade_process(build_version, dut_ip, vendor, model, download_latest, username, password))
+            
+            job_ids = [job.id for job in jobs]
+            if request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json':
+                return jsonify({"jobs": [job.to_dict() for job in jobs]}), 202
             
-            return redirect(url_for("validation_report"))
+            response = redirect(url_for("validation_report"))
+            response.headers['X-Job-Ids'] = ','.join(job_ids)
+            return response
         else:
             # For other actions, process devices sequentially
             for device in device_configs:
@@ -112,193 +234,408 @@ def handle_submit():
     elif request.method == "GET":
         return handle_sse_stream()
 
+def make_hostname(model, taken=()):
+    """Inventory hostname for a device: the model slug, suffixed if already taken."""
+    base = model.lower().replace(' ', '-')
+    hostname = base
+    suffix = 2
+    while hostname in taken:
+        hostname = "{}-{}".format(base, suffix)
+        suffix += 1
+    return hostname
+
+def register_host(hostname, vendor, model, dut_ip):
+    """Create the report entry for a device. Caller must hold registry_lock."""
+    global host_shards, registry_version
+    
+    shard = run_state.HostShard(hostname, vendor, model, dut_ip)
+    shards = dict(host_shards)
+    shards[hostname] = shard
+    host_shards = shards
+    registry_version += 1
+    record_host_event(shard.snapshot)
+
+def registered_hosts():
+    """Hostnames of the devices in the report."""
+    return [hostname for hostname, shard in host_shards.items() if shard.registered]
+
+def shard_for(hostname):
+    """The shard of hostname, created unregistered for hosts the report does not list."""
+    global host_shards, registry_version
+    
+    shard = host_shards.get(hostname)
+    if shard is None:
+        with registry_lock:
+            shard = host_shards.get(hostname)
+            if shard is None:
+                shard = run_state.HostShard(hostname, registered=False)
+                shards = dict(host_shards)
+                shards[hostname] = shard
+                host_shards = shards
+                registry_version += 1
+    return shard
+
+def set_process(process_key, process):
+    """Add or replace a job in processes. Caller must hold registry_lock."""
+    global processes, registry_version
+    
+    table = dict(processes)
+    table[process_key] = process
+    processes = table
+    registry_version += 1
+
+def set_host_runs(hostnames, job_id):
+    """Point hostnames at job_id for the run history. Caller must hold registry_lock."""
+    global host_runs
+    
+    table = dict(host_runs)
+    for hostname in hostnames:
+        table[hostname] = job_id
+    host_runs = table
+
+def reset_run_state():
+    """Clear the report for a new run if no job is queued or running.
+    Caller must hold registry_lock."""
+    global host_shards, host_runs, registry_version
+    
+    if processes:
+        return False
+    for shard in host_shards.values():
+        # A parser thread of the last run may still be applying its final lines
+        with shard.lock:
+            shard.tasks.clear()
+    host_shards = {}
+    host_runs = {}
+    registry_version += 1
+    events.clear()
+    return True
+
 def start_upgrade_process(build_version, dut_ip, vendor, model, download_latest="false", username="admin", password="versa123"):
-    def run_upgrade():
-        global processes, current_tasks, current_recap, host_specific_data
-        
-        try:
-            # Create hostname from model
-            hostname = model.lower().replace(' ', '-')
-            
-            with data_lock:
-                host_specific_data[hostname] = {
-                    'tasks': [],
-                    'status': 'pending',
-                    'recap': {},
-                    'vendor': vendor,
-                    'model': model,
-                    'ip': dut_ip
-                }
-            
-            cmd_args = ["./Upgrade_Testing/foldering.sh", build_version, dut_ip, vendor, model, download_latest, username, password]
-            
-            print("Starting process for {} with command: {}".format(hostname, ' '.join(cmd_args)))
-            
-            process = subprocess.Popen(
-                cmd_args,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                bufsize=1,
-                universal_newlines=True,
-                cwd="."
-            )
-            
-            with data_lock:
-                processes[hostname] = process
-            
-            print("Process started for {} with PID: {}".format(hostname, process.pid))
-            
-            for line in iter(process.stdout.readline, ''):
-                if line:
-                    parse_ansible_output(line.strip(), hostname)
-                    
-            return_code = process.wait()
-            print("Process for {} completed with return code: {}".format(hostname, return_code))
-            
-            with data_lock:
-                if hostname in processes:
-                    del processes[hostname]
-            
-        except Exception as e:
-            print("Error starting process for {}: {}".format(hostname, str(e)))
-            with data_lock:
-                current_tasks.append({
-                    'timestamp': datetime.now().strftime('%H:%M:%S'),
-                    'name': 'Process Error',
-                    'host': hostname,
-                    'status': 'failed',
-                    'details': str(e)
-                })
-                if hostname in host_specific_data:
-                    host_specific_data[hostname]['status'] = 'failed'
-    
-    thread = Thread(target=run_upgrade)
-    thread.daemon = True
-    thread.start()
+    """Queue an upgrade job for one device and return it."""
+    device = {
+        'ip': dut_ip,
+        'vendor': vendor,
+        'model': model,
+        'username': username,
+        'password': password
+    }
+    
+    with registry_lock:
+        hostname = make_hostname(model, registered_hosts())
+        register_host(hostname, vendor, model, dut_ip)
+    
+    return submit_job(Job('device', build_version, [device], [hostname], download_latest))
 
-def parse_ansible_output(line, hostname=None):
-    global current_tasks, current_recap, host_specific_data
+def start_batch_upgrade_process(build_version, devices, download_latest="false", forks=10, serial="100%"):
+    """Queue one job that runs every device through a single ansible-playbook with --forks/serial."""
+    with registry_lock:
+        hostnames = []
+        for device in devices:
+            hostname = make_hostname(device.get('model'), registered_hosts())
+            register_host(hostname, device.get('vendor'), device.get('model'), device.get('ip'))
+            hostnames.append(hostname)
+    
+    job = Job('batch', build_version, devices, hostnames, download_latest, {'forks': forks, 'serial': serial})
+    return submit_job(job)
+
+def submit_job(job):
+    """Count a job as active and hand it to the queue."""
+    with registry_lock:
+        # Counted as running from now on, so the SSE stream waits for it
+        set_process(job.id, None)
+        set_host_runs(job.hostnames, job.id)
+    record_job_event(job)
+    return upgrade_jobs.submit(job)
+
+def run_job(job):
+    """JobQueue runner: run the job's playbook and return its exit code."""
+    if job.cancel_requested:
+        return None
+    
+    record_job_event(job)
+    
+    def on_start(process):
+        with registry_lock:
+            set_process(job.id, process)
+        job.attach_process(process)
+    
+    try:
+        cmd_args = playbook_runner.job_command(job)
+        return playbook_runner.run_playbook(job.id, cmd_args, line_parser(job), apply_callback_event, on_start)
+    
+    except Exception as e:
+        print("Error starting process for job {}: {}".format(job.id, str(e)))
+        record_process_error(job, str(e))
+        raise
+
+def record_process_error(job, message):
+    """Add a failed 'Process Error' task to every host of a job whose playbook could not run."""
+    for hostname in job.hostnames:
+        shard = shard_for(hostname)
+        with shard.lock:
+            record = shard.update_task(shard.start_task('Process Error'), 'failed', message)
+            if shard.registered:
+                shard.status = 'failed'
+            snapshot = shard.publish()
+            if shard.registered:
+                record_task_event(shard, record)
+                record_host_event(snapshot)
+
+def line_parser(job):
+    """Function that applies one stdout line of job's playbook to the report."""
+    if job.kind == 'batch':
+        batch = {'seq': 0, 'task': None, 'applied': {}}
+        return lambda line: parse_batch_output(line, batch)
+    hostname = job.hostnames[0]
+    return lambda line: parse_ansible_output(line, hostname)
+
+def finish_job(job):
+    """JobQueue callback once a job is completed, failed or cancelled."""
+    status = FINISHED_HOST_STATUS[job.state]
+    for hostname in job.hostnames:
+        shard = host_shards.get(hostname)
+        if shard is None:
+            continue
+        with shard.lock:
+            # Hosts with a recap already have their final status
+            if shard.status in ('pending', 'running'):
+                shard.status = status
+                record_host_event(shard.publish())
+    remote_runs.pop(job.id, None)
+    record_job_event(job)
+    with registry_lock:
+        finish_process(job.id)
+
+def requeue_lapsed_job(job):
+    """DurableJobQueue callback once a job whose worker stopped renewing its lease is queued again."""
+    remote_runs.pop(job.id, None)
+    record_job_event(job)
+
+def restore_jobs():
+    """Put the queued and running jobs of the durable queue back in the report after a restart."""
+    with registry_lock:
+        for job in upgrade_jobs.active():
+            for hostname, device in zip(job.hostnames, job.devices):
+                if hostname not in host_shards:
+                    register_host(hostname, device.get('vendor'), device.get('model'), device.get('ip'))
+            set_host_runs(job.hostnames, job.id)
+            set_process(job.id, None)
+
+def requeue_job(job_id):
+    """Queue a finished job again under a new id, with its hosts reset."""
+    def prepare(job):
+        with registry_lock:
+            reset_run_state()
+            for hostname, device in zip(job.hostnames, job.devices):
+                register_host(hostname, device.get('vendor'), device.get('model'), device.get('ip'))
+            set_host_runs(job.hostnames, job.id)
+            set_process(job.id, None)
+        record_job_event(job)
+    
+    return upgrade_jobs.requeue(job_id, prepare)
+
+if JOB_BACKEND == 'sqlite':
+    upgrade_jobs = job_store.DurableJobQueue(on_finish=finish_job, on_requeue=requeue_lapsed_job)
+else:
+    upgrade_jobs = JobQueue(run_job, on_finish=finish_job)
+
+def record_event(event_type, payload):
+    """Append a delta event to the event log. Events of one host are recorded
+    while holding its shard lock, so they are numbered in the order they happened."""
+    event = events.record(event_type, payload)
+    if history is not None:
+        run_id = event['job']['id'] if event_type == 'job' else host_runs.get(event.get('host'))
+        history.submit(event, run_id)
+    return event
+
+def finish_process(process_key):
+    """Drop a finished job's process and signal completion once none are left.
+    Caller must hold registry_lock."""
+    global processes, registry_version
     
+    if process_key in processes:
+        table = dict(processes)
+        del table[process_key]
+        processes = table
+        registry_version += 1
+        if not processes:
+            record_event('complete', {'return_code': 0})
+
+def record_task_event(shard, task):
+    """Record the published TaskRecord of a task; its index counts the host's tasks from 0."""
+    return record_event('task', {'host': shard.hostname, 'task': task})
+
+def record_job_event(job):
+    """Record the current state of a queued, running or finished job."""
+    return record_event('job', {'job': job.to_dict()})
+
+def record_host_event(snapshot):
+    """Record the host-level fields (status, vendor, model, ip) of a host snapshot."""
+    return record_event('host', {
+        'host': snapshot.hostname,
+        'status': snapshot.status,
+        'vendor': snapshot.vendor,
+        'model': snapshot.model,
+        'ip': snapshot.ip
+    })
+
+def coalesce_events(events):
+    """Keep only the latest event for each task, host and recap."""
+    latest = {}
+    for event in events:
+        if event['type'] == 'task':
+            key = ('task', event['host'], event['task'].index)
+        elif event['type'] in ('host', 'recap'):
+            key = (event['type'], event['host'])
+        elif event['type'] == 'job':
+            key = ('job', event['job']['id'])
+        else:
+            key = ('event', event['id'])
+        latest.pop(key, None)
+        latest[key] = event
+    return list(latest.values())
+
+def parse_ansible_output(line, hostname=None):
     print("Parsing line for {}: {}".format(hostname, line))
     
-    with data_lock:
-        if line.startswith("TASK ["):
-            task_match = re.match(r"TASK \[([^\]]+)\]", line)
-            if task_match:
-                task_name = task_match.group(1)
-                current_task = {
-                    'timestamp': datetime.now().strftime('%H:%M:%S'),
-                    'name': task_name,
-                    'host': hostname if hostname else 'pending',
-                    'status': 'running',
-                    'details': 'In progress...'
-                }
-                current_tasks.append(current_task)
-                
-                if hostname and hostname in host_specific_data:
-                    host_specific_data[hostname]['tasks'].append(current_task.copy())
-                    host_specific_data[hostname]['status'] = 'running'
+    # Classification is pure string work, so it runs before taking any lock.
+    event = classify_line(line)
+    if event is None or event.kind == ansible_output.RECAP_HEADER:
+        return
+    
+    apply_line_event(event, hostname)
+
+def apply_line_event(event, hostname=None):
+    """Apply a classified output line to the shard of the host it belongs to."""
+    if event.kind in (ansible_output.TASK, ansible_output.RESCUE):
+        shard = shard_for(hostname if hostname else 'pending')
+        with shard.lock:
+            rescued = None
+            if event.kind == ansible_output.RESCUE and shard.registered:
+                # The rescue block was triggered; mark the task still running before it as failed
+                for record in reversed(shard.tasks.records):
+                    if record.status == 'running':
+                        rescued = shard.update_task(record, 'failed', 'Task failed - triggered rescue block')
+                        break
+            
+            record = shard.start_task(event.task)
+            
+            previous_status = shard.status
+            if shard.registered:
+                shard.status = 'running'
+            snapshot = shard.publish()
+            if shard.registered:
+                if rescued is not None:
+                    record_task_event(shard, rescued)
+                record_task_event(shard, record)
+                if previous_status != 'running':
+                    record_host_event(snapshot)
+    
+    elif event.kind in (ansible_output.RESULT, ansible_output.FAILED):
+        update_task_result(event.host, event.status, event.details)
+    
+    elif event.kind == ansible_output.RECAP:
+        counts = event.counts
+        failed_count = counts.get('failed', 0)
+        rescued_count = counts.get('rescued', 0)
         
-        elif any(line.startswith(prefix) for prefix in ["ok:", "changed:", "failed:", "unreachable:", "skipped:", "fatal:"]):
-            result_match = re.match(r"(ok|changed|failed|unreachable|skipped|fatal): \[([^\]]+)\](?:\s*=>\s*(.*))?", line)
-            if result_match:
-                status = result_match.group(1)
-                host = result_match.group(2)
-                details = result_match.group(3) or ""
-                
-                # Extract hostname if it contains arrow notation
-                if '->' in host:
-                    host = host.split('->')[0].strip()
-                
-                # Mark fatal as failed
-                if status == 'fatal':
-                    status = 'failed'
-                
-                if host in host_specific_data and host_specific_data[host]['tasks']:
-                    last_task = host_specific_data[host]['tasks'][-1]
-                    last_task['host'] = host
-                    last_task['status'] = status
-                    last_task['details'] = details[:200] + "..." if len(details) > 200 else details
-                    
-                    if status in ['failed', 'unreachable']:
-                        host_specific_data[host]['status'] = 'failed'
-                    elif status in ['ok', 'changed'] and host_specific_data[host]['status'] != 'failed':
-                        host_specific_data[host]['status'] = 'running'
-                
-                if current_tasks:
-                    current_tasks[-1]['host'] = host
-                    current_tasks[-1]['status'] = status
-                    current_tasks[-1]['details'] = details[:100] + "..." if len(details) > 100 else details
+        # If there are rescued tasks, count them as failures
+        total_failures = failed_count + rescued_count
         
-        # Detect rescue block failures
-        elif "FAILED!" in line and "=>" in line:
-            # This catches lines like: fatal: [csg2500]: FAILED! => {"changed": true, ...}
-            failed_match = re.search(r'\[([^\]]+)\].*FAILED!', line)
-            if failed_match:
-                host = failed_match.group(1)
-                if '->' in host:
-                    host = host.split('->')[0].strip()
-                
-                if host in host_specific_data and host_specific_data[host]['tasks']:
-                    last_task = host_specific_data[host]['tasks'][-1]
-                    last_task['status'] = 'failed'
-                    
-                    # Extract error message from JSON if available
-                    try:
-                        json_match = re.search(r'=>\s*({.*})', line)
-                        if json_match:
-                            error_data = json.loads(json_match.group(1))
-                            error_msg = error_data.get('msg', error_data.get('stderr', 'Task failed'))
-                            last_task['details'] = error_msg[:200]
-                    except:
-                        last_task['details'] = 'Task failed - see logs for details'
-                    
-                    host_specific_data[host]['status'] = 'failed'
+        recap_data = {
+            'host': event.host,
+            'ok': counts.get('ok', 0),
+            'changed': counts.get('changed', 0),
+            'unreachable': counts.get('unreachable', 0),
+            'failed': total_failures,
+            'rescued': rescued_count
+        }
         
-        # Detect rescue blocks being triggered
-        elif line.strip().startswith("TASK [Set") and "failure" in line.lower():
-            # Tasks like "Set upgrade completion status after failure" indicate a rescue
-            if hostname and hostname in host_specific_data:
-                # Mark the previous task as failed if it's still running
-                if host_specific_data[hostname]['tasks']:
-                    for i in range(len(host_specific_data[hostname]['tasks']) - 1, -1, -1):
-                        task = host_specific_data[hostname]['tasks'][i]
-                        if task['status'] == 'running':
-                            task['status'] = 'failed'
-                            task['details'] = 'Task failed - triggered rescue block'
-                            break
+        shard = shard_for(event.host)
+        with shard.lock:
+            shard.recap = recap_data
+            if shard.registered:
+                if total_failures > 0:
+                    shard.status = 'failed'
+                elif recap_data['unreachable'] > 0:
+                    shard.status = 'unreachable'
+                else:
+                    shard.status = 'completed'
+            snapshot = shard.publish()
+            if shard.registered:
+                record_event('recap', {'host': event.host, 'recap': recap_data})
+                record_host_event(snapshot)
+
+def parse_batch_output(line, batch):
+    """Text fallback for batch runs.
+    
+    TASK banners do not name a host when several hosts run together, so the
+    task is attached to each host when that host's first result line arrives.
+    """
+    print("Parsing batch line: {}".format(line))
+    
+    event = classify_line(line)
+    if event is None or event.kind == ansible_output.RECAP_HEADER:
+        return
+    
+    if event.kind in (ansible_output.TASK, ansible_output.RESCUE):
+        batch['seq'] += 1
+        batch['task'] = event
+        return
+    
+    # batch is only used by this job's reader thread
+    if event.kind != ansible_output.RECAP and batch['task'] is not None and \
+            batch['applied'].get(event.host) != batch['seq']:
+        batch['applied'][event.host] = batch['seq']
+        apply_line_event(batch['task'], event.host)
+    apply_line_event(event)
+
+def update_task_result(host, status, details, details_limit=200, duration=None):
+    """Set the outcome of the host's most recent task."""
+    shard = host_shards.get(host)
+    if shard is None:
+        return
+    
+    with shard.lock:
+        record = shard.tasks.last()
+        if record is None:
+            return
+        if len(details) > details_limit:
+            details = details[:details_limit] + "..."
+        record = shard.update_task(record, status, details, duration)
         
-        elif "PLAY RECAP" in line:
-            pass
-        elif re.match(r"^[a-zA-Z0-9.-]+\s*:\s*ok=\d+", line):
-            recap_match = re.match(r"^([a-zA-Z0-9.-]+)\s*:\s*ok=(\d+)\s+changed=(\d+)\s+unreachable=(\d+)\s+failed=(\d+)(?:\s+skipped=(\d+))?\s+(?:rescued=(\d+))?", line)
-            if recap_match:
-                hostname_recap = recap_match.group(1)
-                failed_count = int(recap_match.group(5))
-                rescued_count = int(recap_match.group(7)) if recap_match.group(7) else 0
-                
-                # If there are rescued tasks, count them as failures
-                total_failures = failed_count + rescued_count
-                
-                recap_data = {
-                    'host': hostname_recap,
-                    'ok': int(recap_match.group(2)),
-                    'changed': int(recap_match.group(3)),
-                    'unreachable': int(recap_match.group(4)),
-                    'failed': total_failures,
-                    'rescued': rescued_count
-                }
-                current_recap[hostname_recap] = recap_data
-                
-                if hostname_recap in host_specific_data:
-                    host_specific_data[hostname_recap]['recap'] = recap_data
-                    
-                    if total_failures > 0:
-                        host_specific_data[hostname_recap]['status'] = 'failed'
-                    elif recap_data['unreachable'] > 0:
-                        host_specific_data[hostname_recap]['status'] = 'unreachable'
-                    else:
-                        host_specific_data[hostname_recap]['status'] = 'completed'
+        previous_status = shard.status
+        if shard.registered:
+            if status in ['failed', 'unreachable']:
+                shard.status = 'failed'
+            elif status in ['ok', 'changed', 'ignored'] and shard.status != 'failed':
+                shard.status = 'running'
+        snapshot = shard.publish()
+        if shard.registered:
+            record_task_event(shard, record)
+            if shard.status != previous_status:
+                record_host_event(snapshot)
+
+def apply_callback_event(event):
+    """Apply one event from the vos_events callback plugin."""
+    kind = event.get('event')
+    host = event.get('host')
+    
+    if kind == 'task_start':
+        apply_line_event(ansible_output.LineEvent(ansible_output.TASK, event.get('task'), None, None, None, None), host)
+    elif kind == 'task_end':
+        details = event.get('details') or ''
+        if not isinstance(details, str):
+            details = json.dumps(details)
+        status = event.get('status')
+        if status == 'failed' and event.get('ignore_errors'):
+            # ignore_errors: the play goes on, so the host has not failed
+            status = 'ignored'
+        update_task_result(host, status, details, STRUCTURED_DETAILS_LIMIT, event.get('duration'))
+    elif kind == 'stats':
+        for recap_host, counts in event.get('hosts', {}).items():
+            counts = dict(counts, failed=counts.get('failures', 0))
+            apply_line_event(ansible_output.LineEvent(ansible_output.RECAP, None, recap_host, None, None, counts))
 
 def handle_shell_execution(build_version, dut_ip, vendor, model, action_selected, download_latest="false", username="admin", password="versa123"):
     print("Running shell script with build version: {}".format(build_version))
@@ -358,20 +695,51 @@ def handle_shell_execution(build_version, dut_ip, vendor, model, action_selected
         }
     )
 
+def format_sse_event(event):
+    """Serialize a delta event as an SSE message carrying its event id.
+    
+    Every connected viewer sends the same events, so each one is serialized
+    once and reused; the cache is replaced rather than trimmed when full.
+    """
+    global sse_messages
+    
+    message = sse_messages.get(event['id'])
+    if message is None:
+        message = "id: {}\ndata: {}\n\n".format(event['id'], json.dumps(run_state.event_view(event)))
+        if len(sse_messages) >= SSE_MESSAGE_CACHE_SIZE:
+            sse_messages = {}
+        sse_messages[event['id']] = message
+    return message
+
 def handle_sse_stream():
     print("SSE stream requested")
+    
+    # EventSource sends Last-Event-ID on reconnect; resume from there instead
+    # of replaying the whole run.
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID') or request.args.get('lastEventId') or 0)
+    except ValueError:
+        last_event_id = 0
+    
+    if last_event_id:
+        print("SSE client resuming after event {}".format(last_event_id))
 
     def generate():
+        subscriber = Subscriber(last_event_id)
         try:
-            global processes, current_tasks, current_recap, host_specific_data
-            
             yield "data: {}\n\n".format(json.dumps({
                 'type': 'log', 
                 'message': 'Connected to upgrade process stream...'
             }))
             
-            with data_lock:
-                if len(processes) == 0:
+            # The backlog is taken under the event log's lock as the
+            # subscriber registers, so no event falls between the replay and
+            # the live queue.
+            backlog = events.subscribe(subscriber)
+            if len(processes) == 0 and not backlog:
+                if events.events:
+                    backlog = [{'type': 'complete', 'return_code': 0}]
+                else:
                     print("No processes running, sending error")
                     yield "data: {}\n\n".format(json.dumps({
                         'type': 'error', 
@@ -381,74 +749,31 @@ def handle_sse_stream():
 
             print("Processes found, streaming output...")
             
-            last_task_count = 0
-            last_recap_update = {}
-            last_host_data_update = {}
-            
+            pending_events = coalesce_events(backlog)
             while True:
-                try:
-                    with data_lock:
-                        active_processes = len(processes)
-                    
-                    if active_processes == 0:
-                        # All processes completed
+                for event in pending_events:
+                    if 'id' in event:
+                        if event['id'] <= subscriber.cursor:
+                            continue
+                        subscriber.cursor = event['id']
+                        yield format_sse_event(event)
+                    else:
+                        yield "data: {}\n\n".format(json.dumps(event))
+                    if event['type'] == 'complete':
                         print("All processes completed")
-                        
-                        with data_lock:
-                            final_tasks = []
-                            for hostname, data in host_specific_data.items():
-                                final_tasks.extend(data['tasks'])
-                            
-                            yield "data: {}\n\n".format(json.dumps({
-                                'type': 'tasks',
-                                'data': {
-                                    'tasks': final_tasks,
-                                    'recap': current_recap,
-                                    'host_data': host_specific_data
-                                }
-                            }))
-                            
-                            yield "data: {}\n\n".format(json.dumps({
-                                'type': 'complete', 
-                                'return_code': 0
-                            }))
-                        break
-                    
-                    with data_lock:
-                        data_changed = (
-                            len(current_tasks) != last_task_count or 
-                            current_recap != last_recap_update or
-                            host_specific_data != last_host_data_update
-                        )
-                    
-                    if data_changed:
-                        with data_lock:
-                            all_tasks = []
-                            for hostname, data in host_specific_data.items():
-                                all_tasks.extend(data['tasks'])
-                            
-                            yield "data: {}\n\n".format(json.dumps({
-                                'type': 'tasks',
-                                'data': {
-                                    'tasks': all_tasks,
-                                    'recap': current_recap,
-                                    'host_data': host_specific_data
-                                }
-                            }))
-                            
-                            last_task_count = len(current_tasks)
-                            last_recap_update = current_recap.copy() if current_recap else {}
-                            last_host_data_update = {k: v.copy() for k, v in host_specific_data.items()}
-                    
-                    time.sleep(1)
-                    
-                except Exception as e:
-                    print("Error in SSE loop: {}".format(str(e)))
-                    yield "data: {}\n\n".format(json.dumps({
-                        'type': 'error', 
-                        'message': 'Error reading process output: {}'.format(str(e))
-                    }))
-                    break
+                        return
+                
+                if subscriber.lagged:
+                    with events.lock:
+                        pending_events = coalesce_events(events.since(subscriber.cursor))
+                        subscriber.lagged = False
+                    continue
+                
+                try:
+                    pending_events = [subscriber.queue.get(timeout=SSE_KEEPALIVE_SECONDS)]
+                except queue.Empty:
+                    pending_events = []
+                    yield ": keepalive\n\n"
 
         except GeneratorExit:
             print("SSE client disconnected")
@@ -458,6 +783,8 @@ def handle_sse_stream():
                 'type': 'error', 
                 'message': str(e)
             }))
+        finally:
+            events.unsubscribe(subscriber)
 
     return Response(generate(), mimetype='text/event-stream', headers={
         "Cache-Control": "no-cache",
@@ -465,28 +792,363 @@ def handle_sse_stream():
         "X-Accel-Buffering": "no"
     })
 
-@app.route("/api/shell-status")
-def shell_status():
-    global processes, host_specific_data
+def shell_status_body(snapshots, active_count, cursor, since=None, hosts=None):
+    """Serialize the /api/shell-status payload from published host snapshots.
     
-    with data_lock:
-        active_count = len(processes)
-        if active_count == 0:
-            status = "no_process"
-            message = "No upgrade process running"
-        else:
-            status = "running"
-            message = "{} upgrade process(es) running".format(active_count)
+    With since (an event id from a previous response's cursor) only the
+    coalesced events after it are included; if they are no longer all in
+    the event log, or the cursor is from an earlier server, the full snapshot
+    is sent with reset set. hosts limits tasks, host data, recap and events
+    to those hosts.
+    """
+    if active_count == 0:
+        status = "no_process"
+        message = "No upgrade process running"
+    else:
+        status = "running"
+        message = "{} upgrade process(es) running".format(active_count)
     
-    return jsonify({
+    if hosts is not None:
+        snapshots = [snapshot for snapshot in snapshots if snapshot.hostname in hosts]
+    payload = {
         "status": status,
         "message": message,
         "timestamp": datetime.now().isoformat(),
         "active_processes": active_count,
-        "tasks": current_tasks,
-        "recap": current_recap,
-        "host_data": host_specific_data
+        "cursor": cursor,
+        "recap": dict((snapshot.hostname, snapshot.recap) for snapshot in snapshots if snapshot.recap)
+    }
+    
+    retained = events.events
+    first_id = retained[0]['id'] if retained else cursor + 1
+    if since is not None and first_id - 1 <= since <= cursor:
+        delta = [event for event in events.since(since) if event['id'] <= cursor]
+        delta = coalesce_events(delta)
+        if hosts is not None:
+            # Job and completion events carry no host and are always included
+            delta = [event for event in delta if event.get('host', next(iter(hosts))) in hosts]
+        payload["since"] = since
+        payload["events"] = [run_state.event_view(event) for event in delta]
+        return json.dumps(payload)
+    
+    if since is not None:
+        payload["reset"] = True
+    payload["tasks"] = run_state.timeline_view(snapshots, TIMELINE_RETENTION)
+    payload["host_data"] = dict(
+        (snapshot.hostname, run_state.host_view(snapshot)) for snapshot in snapshots if snapshot.registered)
+    return json.dumps(payload)
+
+@app.route("/api/shell-status")
+def shell_status():
+    global status_snapshots
+    
+    args = request.args
+    try:
+        since = int(args["since"]) if args.get("since") else None
+    except ValueError:
+        return jsonify({"error": "Invalid query parameter: since must be an event id"}), 400
+    hosts = frozenset(host.strip() for value in args.getlist("host") for host in value.split(",") if host.strip()) or None
+    
+    # No lock: the tables and snapshots read here are never modified once
+    # published, and every change bumps one of the numbers in the ETag
+    cursor = events.seq
+    version = registry_version
+    active_count = len(processes)
+    snapshots = [shard.snapshot for shard in host_shards.values()]
+    etag = "{}-{}-{}-{}".format(version, cursor, sum(snapshot.version for snapshot in snapshots), active_count)
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag, weak=True)
+        return response
+    
+    key = (etag, since, hosts)
+    cache = status_snapshots
+    body = cache.get(key)
+    if body is None:
+        body = shell_status_body(snapshots, active_count, cursor, since, hosts)
+        if len(cache) >= STATUS_SNAPSHOT_CACHE_SIZE:
+            cache = status_snapshots = {}
+        cache[key] = body
+    
+    response = Response(body, mimetype="application/json")
+    response.set_etag(etag, weak=True)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+def accepted_encodings():
+    """Content codings the client accepts (q > 0), lowercased."""
+    encodings = set()
+    for part in request.headers.get("Accept-Encoding", "").split(","):
+        coding, _, params = part.strip().partition(";")
+        params = params.replace(" ", "")
+        if coding and params not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            encodings.add(coding.strip().lower())
+    return encodings
+
+@app.after_request
+def compress_response(response):
+    """Brotli or gzip encode JSON responses for clients that accept it."""
+    if response.status_code != 200 or response.mimetype != "application/json" or \
+            response.direct_passthrough or "Content-Encoding" in response.headers:
+        return response
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_BYTES:
+        return response
+    
+    encodings = accepted_encodings()
+    if brotli is not None and "br" in encodings:
+        response.set_data(brotli.compress(body, quality=5))
+        response.headers["Content-Encoding"] = "br"
+    elif "gzip" in encodings:
+        response.set_data(gzip.compress(body, compresslevel=5))
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        return response
+    response.vary.add("Accept-Encoding")
+    return response
+
+@app.route("/api/download-progress")
+def download_progress():
+    try:
+        with open(DOWNLOAD_PROGRESS_FILE) as f:
+            progress = json.load(f)
+    except (OSError, ValueError):
+        return jsonify({"status": "no_download", "images": {}})
+    
+    progress["status"] = "downloading" if any(
+        image.get("state") == "downloading" for image in progress.get("images", {}).values()) else "idle"
+    return jsonify(progress)
+
+def read_upgrade_events(host=None, level=None, since=None, limit=200):
+    """Return the newest `limit` upgrade log records, oldest first, matching the filters."""
+    paths = ["{}.{}".format(UPGRADE_EVENTS_FILE, index) for index in range(UPGRADE_EVENTS_BACKUPS, 0, -1)]
+    paths.append(UPGRADE_EVENTS_FILE)
+    records = collections.deque(maxlen=limit)
+    for path in paths:
+        try:
+            f = open(path)
+        except OSError:
+            continue
+        with f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if host and record.get("host") != host:
+                    continue
+                if level and record.get("level") != level:
+                    continue
+                if since is not None and (run_history.parse_time(record.get("time")) or 0) < since:
+                    continue
+                records.append(record)
+    return list(records)
+
+@app.route("/api/upgrade-log")
+def upgrade_log():
+    args = request.args
+    try:
+        since = run_history.parse_time(args.get("since"))
+        limit = max(1, min(int(args.get("limit", 200)), 5000))
+    except ValueError as e:
+        return jsonify({"error": "Invalid query parameter: {}".format(str(e))}), 400
+    
+    level = args.get("level")
+    records = read_upgrade_events(host=args.get("host"), level=level.upper() if level else None,
+                                  since=since, limit=limit)
+    return jsonify({"records": records, "count": len(records), "path": UPGRADE_EVENTS_FILE})
+
+@app.route("/api/builds/<version>")
+def list_builds(version):
+    # Served from the downloader's cached listings, so this rarely reaches the build server
+    cmd = [sys.executable, DOWNLOAD_SCRIPT, version, "--list"]
+    if request.args.get("refresh") == "true":
+        cmd.append("--refresh")
+    try:
+        result = subprocess.run(cmd, capture_output=True, universal_newlines=True, timeout=60)
+    except subprocess.TimeoutExpired:
+        return jsonify({"error": "Timed out listing builds for {}".format(version)}), 504
+    
+    if result.returncode != 0:
+        return jsonify({"error": "Could not list builds for {}".format(version), "details": result.stderr[-1000:]}), 502
+    return Response(result.stdout, mimetype="application/json")
+
+@app.route("/api/runs")
+def list_runs():
+    if history is None:
+        return jsonify({"error": "Run history is not available"}), 503
+    
+    args = request.args
+    try:
+        page = int(args.get("page", 1))
+        per_page = int(args.get("per_page", 50))
+        since = run_history.parse_time(args.get("since"))
+        until = run_history.parse_time(args.get("until"))
+    except ValueError as e:
+        return jsonify({"error": "Invalid query parameter: {}".format(str(e))}), 400
+    
+    runs, total = history.query_runs(
+        build=args.get("build"),
+        vendor=args.get("vendor"),
+        model=args.get("model"),
+        host=args.get("host"),
+        state=args.get("state"),
+        status=args.get("status"),
+        task=args.get("task"),
+        task_status=args.get("task_status"),
+        since=since,
+        until=until,
+        page=page,
+        per_page=per_page
+    )
+    return jsonify({
+        "runs": runs,
+        "page": page,
+        "per_page": per_page,
+        "total": total
+    })
+
+@app.route("/api/runs/<run_id>")
+def get_run(run_id):
+    if history is None:
+        return jsonify({"error": "Run history is not available"}), 503
+    
+    run = history.get_run(run_id)
+    if run is None:
+        return jsonify({"error": "Unknown run {}".format(run_id)}), 404
+    return jsonify(run)
+
+@app.route("/api/jobs")
+def list_jobs():
+    state = request.args.get("state")
+    jobs = upgrade_jobs.list(state)
+    return jsonify({
+        "jobs": [job.to_dict() for job in jobs],
+        "limits": {
+            "max_running": upgrade_jobs.max_running,
+            "max_per_vendor": upgrade_jobs.max_per_vendor,
+            "max_per_model": upgrade_jobs.max_per_model
+        }
     })
 
+@app.route("/api/jobs/<job_id>")
+def get_job(job_id):
+    job = upgrade_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job {}".format(job_id)}), 404
+    return jsonify(job.to_dict())
+
+@app.route("/api/jobs/<job_id>/cancel", methods=["POST"])
+def cancel_job(job_id):
+    job = upgrade_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job {}".format(job_id)}), 404
+    if job.state in job_queue.FINISHED_STATES:
+        return jsonify({"error": "Job {} is already {}".format(job_id, job.state)}), 409
+
+    print("Cancel requested for job {}".format(job_id))
+    upgrade_jobs.cancel(job_id)
+    return jsonify(job.to_dict())
+
+@app.route("/api/jobs/<job_id>/requeue", methods=["POST"])
+def requeue_job_route(job_id):
+    job = upgrade_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job {}".format(job_id)}), 404
+    if job.state not in job_queue.FINISHED_STATES:
+        return jsonify({"error": "Job {} is still {}".format(job_id, job.state)}), 409
+
+    print("Requeue requested for job {}".format(job_id))
+    new_job = requeue_job(job_id)
+    return jsonify(new_job.to_dict()), 202
+
+def worker_request():
+    """Return (JSON body, None) for a valid worker API call, or (None, error response)."""
+    if not isinstance(upgrade_jobs, job_store.DurableJobQueue):
+        return None, (jsonify({"error": "Jobs run on the controller itself; start it with VOS_JOB_BACKEND=sqlite to use workers"}), 409)
+    authorization = request.headers.get("Authorization", "")
+    if not WORKER_TOKEN or not hmac.compare_digest(authorization.encode("utf-8"),
+                                                   "Bearer {}".format(WORKER_TOKEN).encode("utf-8")):
+        return None, (jsonify({"error": "Invalid worker token"}), 401)
+    data = request.get_json(silent=True) or {}
+    if not data.get("worker"):
+        return None, (jsonify({"error": "Missing worker name"}), 400)
+    return data, None
+
+def lease_lost(job_id, worker):
+    return jsonify({"error": "Worker {} does not hold job {}".format(worker, job_id)}), 409
+
+@app.route("/api/workers/claim", methods=["POST"])
+def claim_job():
+    data, error = worker_request()
+    if error:
+        return error
+    
+    job = upgrade_jobs.claim(data["worker"])
+    if job is None:
+        return Response(status=204)
+    
+    print("Job {} claimed by worker {} (attempt {})".format(job.id, job.worker, job.attempts))
+    remote_runs[job.id] = {'parse_line': line_parser(job), 'batch': 0}
+    record_job_event(job)
+    return jsonify({"job": job_store.job_record(job), "lease_seconds": upgrade_jobs.lease_seconds})
+
+@app.route("/api/workers/jobs/<job_id>/heartbeat", methods=["POST"])
+def job_heartbeat(job_id):
+    data, error = worker_request()
+    if error:
+        return error
+    
+    job = upgrade_jobs.renew(job_id, data["worker"])
+    if job is None:
+        return lease_lost(job_id, data["worker"])
+    return jsonify({"cancel": job.cancel_requested})
+
+@app.route("/api/workers/jobs/<job_id>/events", methods=["POST"])
+def job_events(job_id):
+    data, error = worker_request()
+    if error:
+        return error
+    
+    job = upgrade_jobs.renew(job_id, data["worker"])
+    if job is None:
+        return lease_lost(job_id, data["worker"])
+    
+    # A batch the worker resends after a timeout has already been applied
+    run = remote_runs.setdefault(job.id, {'parse_line': line_parser(job), 'batch': 0})
+    batch = data.get("batch", 0)
+    if batch <= run['batch']:
+        return jsonify({"cancel": job.cancel_requested, "duplicate": True})
+    run['batch'] = batch
+    
+    for item in data.get("events", []):
+        if 'callback' in item:
+            apply_callback_event(item['callback'])
+        elif 'line' in item:
+            run['parse_line'](item['line'])
+    return jsonify({"cancel": job.cancel_requested})
+
+@app.route("/api/workers/jobs/<job_id>/finish", methods=["POST"])
+def job_finished(job_id):
+    data, error = worker_request()
+    if error:
+        return error
+    
+    worker = data["worker"]
+    if upgrade_jobs.renew(job_id, worker) is None:
+        return lease_lost(job_id, worker)
+    if data.get("error") and data.get("return_code") is None:
+        record_process_error(upgrade_jobs.get(job_id), data["error"])
+    job = upgrade_jobs.finish(job_id, worker, data.get("return_code"), data.get("error"))
+    if job is None:
+        return lease_lost(job_id, worker)
+    return jsonify(job.to_dict())
+
+# Jobs the previous coordinator left queued or running are back in the report
+if JOB_BACKEND == 'sqlite':
+    restore_jobs()
+
 if __name__ == "__main__":
-    app.run(host="10.70.188.51", port=5000, debug=True, threaded=True)
\ No newline at end of file
+    # Development server: a thread per connection and, with VOS_DEBUG=1, the
+    # debugger. Use serve.py in production.
+    app.run(host=BIND_ADDRESS, port=PORT, debug=os.environ.get('VOS_DEBUG') == '1', threaded=True, use_reloader=False)
\ No newline at end of file
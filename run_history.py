@@ -0,0 +1,316 @@
+"""
+Persistent run history in SQLite.
+
+run_ansible.py hands every delta event (job, host, task, recap) to
+RunHistory.submit(), which only queues it; a writer thread stores the events
+in batches so the output parser never waits on disk. The tables are indexed
+for the report queries (build, vendor/model, host, status, task, time) and
+read through short-lived connections, which WAL mode lets run alongside the
+writer.
+"""
+
+import os
+import queue
+import sqlite3
+import time
+from datetime import datetime
+from threading import Thread
+
+DEFAULT_DB_PATH = os.environ.get('RUN_HISTORY_DB', '/var/log/ansible/run_history.db')
+
+# Events written per transaction at most
+WRITE_BATCH_SIZE = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id TEXT PRIMARY KEY,
+    kind TEXT,
+    build_version TEXT,
+    state TEXT,
+    return_code INTEGER,
+    requeued_from TEXT,
+    created_at REAL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE TABLE IF NOT EXISTS hosts (
+    run_id TEXT NOT NULL,
+    hostname TEXT NOT NULL,
+    vendor TEXT,
+    model TEXT,
+    ip TEXT,
+    status TEXT,
+    updated_at REAL,
+    PRIMARY KEY (run_id, hostname)
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    run_id TEXT NOT NULL,
+    hostname TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    name TEXT,
+    status TEXT,
+    details TEXT,
+    duration REAL,
+    started_at REAL,
+    updated_at REAL,
+    PRIMARY KEY (run_id, hostname, idx)
+);
+CREATE TABLE IF NOT EXISTS recaps (
+    run_id TEXT NOT NULL,
+    hostname TEXT NOT NULL,
+    ok INTEGER,
+    changed INTEGER,
+    unreachable INTEGER,
+    failed INTEGER,
+    rescued INTEGER,
+    PRIMARY KEY (run_id, hostname)
+);
+CREATE INDEX IF NOT EXISTS idx_runs_build ON runs (build_version, created_at);
+CREATE INDEX IF NOT EXISTS idx_runs_state ON runs (state, created_at);
+CREATE INDEX IF NOT EXISTS idx_runs_created ON runs (created_at);
+CREATE INDEX IF NOT EXISTS idx_hosts_model ON hosts (vendor, model);
+CREATE INDEX IF NOT EXISTS idx_hosts_model_only ON hosts (model);
+CREATE INDEX IF NOT EXISTS idx_hosts_hostname ON hosts (hostname);
+CREATE INDEX IF NOT EXISTS idx_hosts_status ON hosts (status);
+CREATE INDEX IF NOT EXISTS idx_tasks_name ON tasks (name, status);
+CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status);
+"""
+
+
+def _isoformat(value):
+    return datetime.fromtimestamp(value).isoformat() if value else None
+
+
+def parse_time(value):
+    """Accept an ISO date/datetime or epoch seconds; return epoch seconds or None."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+class RunHistory(object):
+    """SQLite store for upgrade runs, their hosts, tasks and recaps."""
+
+    def __init__(self, path=DEFAULT_DB_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            conn.commit()
+        finally:
+            conn.close()
+        self.pending = queue.Queue()
+        self.thread = Thread(target=self._writer)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def submit(self, event, run_id):
+        """Queue one delta event belonging to run_id. Never blocks."""
+        if run_id is not None:
+            self.pending.put((event, run_id, time.time()))
+
+    def flush(self, timeout=None):
+        """Wait until every queued event has been written."""
+        deadline = time.time() + timeout if timeout else None
+        while self.pending.unfinished_tasks:
+            if deadline and time.time() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def _writer(self):
+        conn = self._connect()
+        conn.execute("PRAGMA synchronous=NORMAL")
+        while True:
+            batch = [self.pending.get()]
+            while len(batch) < WRITE_BATCH_SIZE:
+                try:
+                    batch.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with conn:
+                    for event, run_id, received_at in batch:
+                        self._store(conn, event, run_id, received_at)
+            except sqlite3.Error as e:
+                print("Error writing run history: {}".format(str(e)))
+            finally:
+                for _ in batch:
+                    self.pending.task_done()
+
+    def _store(self, conn, event, run_id, received_at):
+        event_type = event.get('type')
+        if event_type == 'job':
+            job = event['job']
+            conn.execute(
+                "INSERT INTO runs (id, kind, build_version, state, return_code, requeued_from, created_at, started_at, finished_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET state = excluded.state, return_code = excluded.return_code, "
+                "started_at = excluded.started_at, finished_at = excluded.finished_at",
+                (job['id'], job['kind'], job['build_version'], job['state'], job['return_code'], job['requeued_from'],
+                 parse_time(job['created_at']), parse_time(job['started_at']), parse_time(job['finished_at'])))
+            for hostname, device in zip(job['hosts'], job['devices']):
+                conn.execute(
+                    "INSERT OR IGNORE INTO hosts (run_id, hostname, vendor, model, ip, status, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, 'pending', ?)",
+                    (run_id, hostname, device.get('vendor'), device.get('model'), device.get('ip'), received_at))
+        elif event_type == 'host':
+            conn.execute(
+                "INSERT INTO hosts (run_id, hostname, vendor, model, ip, status, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (run_id, hostname) DO UPDATE SET status = excluded.status, updated_at = excluded.updated_at",
+                (run_id, event['host'], event.get('vendor'), event.get('model'), event.get('ip'), event.get('status'), received_at))
+        elif event_type == 'task':
+            task = event['task']  # a task_store.TaskRecord
+            conn.execute(
+                "INSERT INTO tasks (run_id, hostname, idx, name, status, details, duration, started_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (run_id, hostname, idx) DO UPDATE SET status = excluded.status, details = excluded.details, "
+                "duration = excluded.duration, updated_at = excluded.updated_at",
+                (run_id, event['host'], task.index, task.name, task.status, task.details,
+                 task.duration, received_at, received_at))
+        elif event_type == 'recap':
+            recap = event['recap']
+            conn.execute(
+                "INSERT OR REPLACE INTO recaps (run_id, hostname, ok, changed, unreachable, failed, rescued) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (run_id, event['host'], recap.get('ok'), recap.get('changed'), recap.get('unreachable'),
+                 recap.get('failed'), recap.get('rescued')))
+
+    def query_runs(self, build=None, vendor=None, model=None, host=None, state=None, status=None,
+                   task=None, task_status=None, since=None, until=None, page=1, per_page=50):
+        """Return (runs, total) for one page of runs matching the filters, newest first.
+
+        vendor/model/host/status filter on the run's hosts and task/task_status
+        on their tasks; a run matches when one host satisfies all of them.
+        task is a task name or a role name.
+        """
+        where = []
+        params = []
+        if build:
+            where.append("r.build_version = ?")
+            params.append(build)
+        if state:
+            where.append("r.state = ?")
+            params.append(state)
+        if since is not None:
+            where.append("r.created_at >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("r.created_at < ?")
+            params.append(until)
+
+        host_where = []
+        if vendor:
+            host_where.append("h.vendor = ?")
+            params.append(vendor)
+        if model:
+            host_where.append("h.model = ?")
+            params.append(model)
+        if host:
+            host_where.append("h.hostname = ?")
+            params.append(host)
+        if status:
+            host_where.append("h.status = ?")
+            params.append(status)
+        if task or task_status:
+            task_where = ["t.run_id = h.run_id", "t.hostname = h.hostname"]
+            if task:
+                # A role name matches every "role : task" in it
+                task_where.append("(t.name = ? OR t.name LIKE ?)")
+                params.extend([task, task + " : %"])
+            if task_status:
+                task_where.append("t.status = ?")
+                params.append(task_status)
+            host_where.append("EXISTS (SELECT 1 FROM tasks t WHERE {})".format(" AND ".join(task_where)))
+        if host_where:
+            where.append("EXISTS (SELECT 1 FROM hosts h WHERE h.run_id = r.id AND {})".format(" AND ".join(host_where)))
+
+        clause = "WHERE " + " AND ".join(where) if where else ""
+        page = max(1, page)
+        per_page = max(1, min(per_page, 500))
+
+        conn = self._connect()
+        try:
+            total = conn.execute("SELECT COUNT(*) FROM runs r {}".format(clause), params).fetchone()[0]
+            rows = conn.execute(
+                "SELECT r.* FROM runs r {} ORDER BY r.created_at DESC LIMIT ? OFFSET ?".format(clause),
+                params + [per_page, (page - 1) * per_page]).fetchall()
+            runs = [self._run_dict(row) for row in rows]
+            for run in runs:
+                run['hosts'] = [dict(row) for row in conn.execute(
+                    "SELECT hostname, vendor, model, ip, status FROM hosts WHERE run_id = ? ORDER BY hostname",
+                    (run['id'],))]
+        finally:
+            conn.close()
+        return runs, total
+
+    def get_run(self, run_id):
+        """Return one run with its hosts, recaps and tasks, or None."""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT * FROM runs WHERE id = ?", (run_id,)).fetchone()
+            if row is None:
+                return None
+            run = self._run_dict(row)
+            hosts = {}
+            for host in conn.execute("SELECT * FROM hosts WHERE run_id = ? ORDER BY hostname", (run_id,)):
+                hosts[host['hostname']] = {
+                    'vendor': host['vendor'],
+                    'model': host['model'],
+                    'ip': host['ip'],
+                    'status': host['status'],
+                    'recap': {},
+                    'tasks': []
+                }
+            for recap in conn.execute("SELECT * FROM recaps WHERE run_id = ?", (run_id,)):
+                if recap['hostname'] in hosts:
+                    hosts[recap['hostname']]['recap'] = dict((key, recap[key]) for key in
+                                                             ('ok', 'changed', 'unreachable', 'failed', 'rescued'))
+            for task in conn.execute("SELECT * FROM tasks WHERE run_id = ? ORDER BY hostname, idx", (run_id,)):
+                if task['hostname'] in hosts:
+                    hosts[task['hostname']]['tasks'].append({
+                        'index': task['idx'],
+                        'name': task['name'],
+                        'status': task['status'],
+                        'details': task['details'],
+                        'duration': task['duration'],
+                        'started_at': _isoformat(task['started_at'])
+                    })
+            run['hosts'] = hosts
+            return run
+        finally:
+            conn.close()
+
+    def _run_dict(self, row):
+        return {
+            'id': row['id'],
+            'kind': row['kind'],
+            'build_version': row['build_version'],
+            'state': row['state'],
+            'return_code': row['return_code'],
+            'requeued_from': row['requeued_from'],
+            'created_at': _isoformat(row['created_at']),
+            'started_at': _isoformat(row['started_at']),
+            'finished_at': _isoformat(row['finished_at'])
+        }
+
+
+def open_history(path=DEFAULT_DB_PATH):
+    """Open the history store, or return None (history disabled) if the path is unusable."""
+    try:
+        return RunHistory(path)
+    except (OSError, sqlite3.Error) as e:
+        print("Run history disabled, cannot open {}: {}".format(path, str(e)))
+        return None
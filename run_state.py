@@ -0,0 +1,180 @@
+"""
+Sharded report state for run_ansible.py.
+
+Every host has a HostShard with its own lock. Output parser and callback
+threads lock only the shard of the host a line belongs to, and publish an
+immutable HostSnapshot when they are done; /api/shell-status and the SSE
+stream read the published snapshots and never take a writer lock. The delta
+event log has its own lock, held only to number, append and fan out one
+event. The host and job tables in run_ansible.py are copy-on-write dicts, so
+readers only ever see a complete table.
+"""
+
+import heapq
+from collections import namedtuple
+from itertools import chain, islice
+from operator import attrgetter
+from threading import Lock
+
+import task_store
+
+# tasks is a tuple of tuples of the host's task_store.TaskRecords, oldest
+# first, and may start with records older than first_index; use
+# snapshot_tasks(). Records are never modified, so a snapshot shares them
+# with the ring buffer and the event log, and dicts are only built when it is
+# serialized.
+HostSnapshot = namedtuple('HostSnapshot', [
+    'version', 'hostname', 'registered', 'status', 'recap', 'vendor', 'model', 'ip', 'tasks', 'total', 'first_index'])
+
+# Tasks a snapshot copies before the older ones are frozen into one shared tuple
+FROZEN_CHUNK = 64
+
+# The timeline view shortens details further, as the report always has
+TIMELINE_DETAILS_LIMIT = 100
+
+
+class HostShard(object):
+    """State of one host: writers hold lock, readers use snapshot."""
+
+    def __init__(self, hostname, vendor=None, model=None, ip=None, registered=True,
+                 retention=task_store.DEFAULT_RETENTION, spill_dir=task_store.DEFAULT_SPILL_DIR):
+        self.lock = Lock()
+        self.hostname = hostname
+        self.registered = registered
+        self.status = 'pending'
+        self.recap = {}
+        self.vendor = vendor
+        self.model = model
+        self.ip = ip
+        self.tasks = task_store.HostTasks(hostname, retention, spill_dir)
+        self.version = 0
+        # Records with an index below _frozen_end, shared by every snapshot
+        # until the tail grows past FROZEN_CHUNK or one of them changes
+        self._frozen = ()
+        self._frozen_end = 0
+        self.snapshot = None
+        self.publish()
+
+    def start_task(self, name):
+        """Add a running task and return its record. Caller holds lock."""
+        return self.tasks.start(name)
+
+    def update_task(self, record, status=None, details=None, duration=None):
+        """Replace a task's record with an updated one and return it. Caller holds lock."""
+        if record.index < self._frozen_end:
+            self._frozen = ()
+            self._frozen_end = 0
+        return self.tasks.update(record, status, details, duration)
+
+    def publish(self):
+        """Make the current state visible to readers. Caller holds lock (or owns the shard)."""
+        records = self.tasks.records
+        first_index = self.tasks.first_index
+        if self._frozen_end < first_index or self.tasks.total - self._frozen_end > FROZEN_CHUNK:
+            # Freeze all but the last task, which is usually the next one updated
+            self._frozen = tuple(islice(records, len(records) - 1))
+            self._frozen_end = self.tasks.total - 1 if records else 0
+        tail = tuple(islice(reversed(records), self.tasks.total - self._frozen_end))[::-1]
+        self.version += 1
+        self.snapshot = HostSnapshot(
+            self.version, self.hostname, self.registered, self.status, self.recap, self.vendor, self.model,
+            self.ip, (self._frozen, tail), self.tasks.total, first_index)
+        return self.snapshot
+
+
+def snapshot_tasks(snapshot):
+    """The task records of a snapshot, oldest first."""
+    frozen, tail = snapshot.tasks
+    skip = snapshot.first_index - (snapshot.total - len(tail) - len(frozen))
+    return chain(islice(frozen, skip, None), tail) if skip > 0 else chain(frozen, tail)
+
+
+def _newest_tasks(snapshot):
+    frozen, tail = snapshot.tasks
+    return islice(chain(reversed(tail), reversed(frozen)), snapshot.total - snapshot.first_index)
+
+
+def host_view(snapshot):
+    """host_data entry of /api/shell-status for one snapshot."""
+    return {
+        'status': snapshot.status,
+        'recap': snapshot.recap,
+        'vendor': snapshot.vendor,
+        'model': snapshot.model,
+        'ip': snapshot.ip,
+        'tasks': [record.to_dict() for record in snapshot_tasks(snapshot)],
+        'task_count': {'total': snapshot.total, 'first_index': snapshot.first_index}
+    }
+
+
+def timeline_view(snapshots, limit):
+    """The latest `limit` tasks of all snapshots in the order they started."""
+    newest = heapq.merge(*[_newest_tasks(snapshot) for snapshot in snapshots], key=attrgetter('seq'), reverse=True)
+    records = list(islice(newest, limit))
+    records.reverse()
+    return [record.to_dict(TIMELINE_DETAILS_LIMIT) for record in records]
+
+
+def event_view(event):
+    """A delta event as viewers get it: a task event's record becomes its dict."""
+    if event['type'] != 'task':
+        return event
+    return dict(event, task=event['task'].to_dict())
+
+
+# Delta events kept for replay; a cursor older than these gets a full resync
+DEFAULT_EVENT_RETENTION = 20000
+
+
+class EventLog(object):
+    """Numbered delta events for the SSE stream and the cursor API.
+
+    record() holds the lock only to number, append and offer one event, so
+    events keep the order of their ids; since() reads without it. Only the
+    latest `retention` events are kept.
+    """
+
+    def __init__(self, retention=DEFAULT_EVENT_RETENTION):
+        self.lock = Lock()
+        self.seq = 0
+        self.events = []
+        self.retention = retention
+        self.subscribers = set()
+
+    def record(self, event_type, payload):
+        with self.lock:
+            self.seq += 1
+            event = {'id': self.seq, 'type': event_type}
+            event.update(payload)
+            self.events.append(event)
+            # Trimmed a quarter at a time, into a new list so a since() that
+            # is slicing the old one is not disturbed
+            if len(self.events) > self.retention + self.retention // 4:
+                self.events = self.events[-self.retention:]
+            for subscriber in self.subscribers:
+                subscriber.offer(event)
+        return event
+
+    def since(self, last_event_id):
+        """Return the events newer than last_event_id."""
+        events = self.events
+        if not events:
+            return []
+        # Ids are contiguous within events, so the offset is direct.
+        start = max(0, last_event_id - events[0]['id'] + 1)
+        return events[start:]
+
+    def subscribe(self, subscriber):
+        """Register subscriber and return its backlog, with no event falling in between."""
+        with self.lock:
+            self.subscribers.add(subscriber)
+            return self.since(subscriber.cursor)
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def clear(self):
+        """Drop the retained events; ids keep increasing."""
+        with self.lock:
+            self.events = []
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Production server for the upgrade report.
+
+`python3 run_ansible.py` starts Flask's development server, which gives every
+connection its own OS thread, so each open report page (the /submit GET event
+stream) holds a thread for as long as it is open. serve.py runs the same app
+under gevent's WSGI server instead. The standard library is monkey-patched
+before run_ansible is imported, so requests, event streams, playbook output
+readers and job queue workers all become greenlets, and an idle report
+viewer is a greenlet waiting on its subscriber queue.
+
+Needs gevent (pip install gevent). The bind address, port and connection
+limit come from the command line or VOS_BIND, VOS_PORT and
+VOS_MAX_CONNECTIONS.
+
+Usage:
+  python3 serve.py                                  # 0.0.0.0:5000
+  python3 serve.py --bind 10.70.188.51 --port 8080
+"""
+
+import argparse
+import os
+import signal
+import sys
+
+try:
+    from gevent import monkey
+except ImportError:
+    sys.exit("serve.py needs gevent (pip install gevent); use python3 run_ansible.py for the development server")
+
+# Must run before anything imports threading, socket, subprocess or queue
+monkey.patch_all()
+
+import gevent
+from gevent.pool import Pool
+from gevent.pywsgi import WSGIServer
+
+import run_ansible
+
+
+def make_server(bind, port, max_connections, access_log=True):
+    """WSGIServer for run_ansible.app, handling at most max_connections at once."""
+    return WSGIServer((bind, port), run_ansible.app, spawn=Pool(max_connections),
+                      log='default' if access_log else None)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve the upgrade report with gevent')
+    parser.add_argument('--bind', default=run_ansible.BIND_ADDRESS, help='Address to listen on')
+    parser.add_argument('--port', type=int, default=run_ansible.PORT)
+    parser.add_argument('--max-connections', type=int, default=int(os.environ.get('VOS_MAX_CONNECTIONS', 1000)),
+                        help='Concurrent connections, event streams included')
+    parser.add_argument('--no-access-log', action='store_true', help='Do not log every request')
+    args = parser.parse_args(argv)
+
+    server = make_server(args.bind, args.port, args.max_connections, not args.no_access_log)
+    gevent.signal_handler(signal.SIGTERM, server.stop)
+    print("Serving upgrade report on {}:{} (max {} connections)".format(args.bind, args.port, args.max_connections))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+"""
+Bounded in-memory task records, one ring buffer per host.
+
+Each task is one immutable TaskRecord tuple (interned name, host and status
+kept as small integer codes, start time formatted once and shared by the
+tasks of the same second). A change replaces the record, so the same tuple
+is the stored task, the published snapshot entry and the delta event; dicts
+are only built when a task is serialized. A host keeps its most recent
+`retention` tasks; older ones are appended to <spill_dir>/<host>.jsonl and
+can still be read back with spilled(). HostTasks is not locked itself;
+run_state.HostShard only touches it while holding the shard's lock.
+"""
+
+import itertools
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import deque, namedtuple
+from datetime import datetime
+from threading import Lock
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+# Tasks kept in memory per host
+DEFAULT_RETENTION = _env_int('VOS_TASK_RETENTION', 500)
+DEFAULT_SPILL_DIR = os.environ.get('VOS_TASK_SPILL_DIR') or \
+    os.path.join(tempfile.gettempdir(), 'vos_task_spill_{}'.format(os.getpid()))
+
+
+class Codes(object):
+    """Two-way mapping between names and small integer codes; unknown names are added."""
+
+    def __init__(self, names=()):
+        self.names = []
+        self.codes = {}
+        self._lock = Lock()
+        for name in names:
+            self.code(name)
+
+    def code(self, name):
+        code = self.codes.get(name)
+        if code is None:
+            # Shards of different hosts may add a name at the same time
+            with self._lock:
+                code = self.codes.get(name)
+                if code is None:
+                    self.names.append(sys.intern(name) if isinstance(name, str) else name)
+                    code = self.codes[name] = len(self.names) - 1
+        return code
+
+    def name(self, code):
+        return self.names[code]
+
+
+STATUSES = Codes(('running', 'ok', 'changed', 'failed', 'skipped', 'unreachable', 'ignored'))
+HOSTS = Codes(('pending',))
+
+# Orders tasks across hosts for the run timeline; next() on a count is atomic
+_task_seq = itertools.count(1)
+
+# (second, 'HH:MM:SS') of the last start time formatted; replaced as a whole
+_last_timestamp = (None, None)
+
+
+def _timestamp(started):
+    global _last_timestamp
+    second = int(started)
+    last = _last_timestamp
+    if last[0] != second:
+        last = _last_timestamp = (second, datetime.fromtimestamp(second).strftime('%H:%M:%S'))
+    return last[1]
+
+
+class TaskRecord(namedtuple('TaskRecord', ['seq', 'index', 'host_code', 'name', 'timestamp', 'status_code',
+                                           'details', 'duration'])):
+    """One task of one host, never modified: updated() returns a new record.
+    status and host are exposed by name."""
+
+    __slots__ = ()
+
+    @classmethod
+    def start(cls, host, index, name, started=None):
+        return cls(next(_task_seq), index, HOSTS.code(host), sys.intern(name),
+                   _timestamp(time.time() if started is None else started), 0, 'In progress...', None)
+
+    @property
+    def host(self):
+        return HOSTS.name(self.host_code)
+
+    @property
+    def status(self):
+        return STATUSES.name(self.status_code)
+
+    def updated(self, status=None, details=None, duration=None):
+        """A copy of the record with the given fields changed."""
+        return self._replace(
+            status_code=self.status_code if status is None else STATUSES.code(status),
+            details=self.details if details is None else details,
+            duration=self.duration if duration is None else duration)
+
+    def to_dict(self, details_limit=None):
+        details = self.details
+        if details_limit is not None and len(details) > details_limit:
+            details = details[:details_limit] + "..."
+        task = {
+            'timestamp': self.timestamp,
+            'name': self.name,
+            'host': HOSTS.names[self.host_code],
+            'status': STATUSES.names[self.status_code],
+            'details': details,
+            'index': self.index
+        }
+        if self.duration is not None:
+            task['duration'] = self.duration
+        return task
+
+
+class HostTasks(object):
+    """Ring buffer of one host's most recent tasks, spilling evicted ones to disk."""
+
+    def __init__(self, host, retention=DEFAULT_RETENTION, spill_dir=DEFAULT_SPILL_DIR):
+        self.host = host
+        self.records = deque(maxlen=max(1, retention))
+        self.total = 0
+        self.spill_path = os.path.join(spill_dir, '{}.jsonl'.format(host.replace(os.sep, '_')))
+        self._spill_file = None
+
+    @property
+    def first_index(self):
+        """Index of the oldest task still in memory."""
+        return self.total - len(self.records)
+
+    def start(self, name, started=None):
+        """Add a running task and return its record."""
+        if len(self.records) == self.records.maxlen:
+            self._spill(self.records[0])
+        record = TaskRecord.start(self.host, self.total, name, started)
+        self.records.append(record)
+        self.total += 1
+        return record
+
+    def update(self, record, status=None, details=None, duration=None):
+        """Replace record with a copy that has the given fields changed, and return the copy.
+        A record already evicted is not changed in the spill file."""
+        updated = record.updated(status, details, duration)
+        position = record.index - self.first_index
+        if 0 <= position < len(self.records):
+            self.records[position] = updated
+        return updated
+
+    def last(self):
+        return self.records[-1] if self.records else None
+
+    def spilled(self):
+        """Tasks evicted from memory, read back from the spill file."""
+        if self._spill_file:
+            self._spill_file.flush()
+        try:
+            f = open(self.spill_path)
+        except OSError:
+            return []
+        with f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def clear(self):
+        """Forget every task and remove the spill file."""
+        if self._spill_file:
+            self._spill_file.close()
+        self._spill_file = None
+        try:
+            os.remove(self.spill_path)
+        except OSError:
+            pass
+        self.records.clear()
+        self.total = 0
+
+    def _spill(self, record):
+        if self._spill_file is None:
+            try:
+                os.makedirs(os.path.dirname(self.spill_path), exist_ok=True)
+                self._spill_file = open(self.spill_path, 'a')
+            except OSError as e:
+                print("Could not open task spill file for {}: {}".format(self.host, str(e)))
+                self._spill_file = False
+        if self._spill_file:
+            self._spill_file.write(json.dumps(record.to_dict()) + "\n")
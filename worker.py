@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Upgrade worker for distributed runs.
+
+Claims device and batch jobs from a coordinator (run_ansible.py or serve.py
+started with VOS_JOB_BACKEND=sqlite), runs foldering.sh for them on this
+controller exactly as the coordinator would, and relays the playbook output
+and vos_events callback events back in numbered batches. A heartbeat renews
+each job's lease; when the coordinator asks for a cancel, or another worker
+has taken the job over, the job's process group is killed. A worker that
+cannot reach the coordinator kills its jobs once two thirds of the lease
+have passed without a renewal, before the coordinator can hand them to
+another worker, so two controllers never upgrade the same DUT at once.
+
+Run it from the repository root, like the coordinator, with VOS_WORKER_TOKEN
+set to the coordinator's token. Several workers can run on one machine as
+long as each has its own --name.
+
+Usage:
+  VOS_WORKER_TOKEN=... python3 worker.py --coordinator http://10.70.188.51:5000
+  python3 worker.py --coordinator http://127.0.0.1:5000 --name lab2-a --slots 4
+"""
+
+import argparse
+import json
+import os
+import signal
+import socket
+import time
+import urllib.error
+import urllib.request
+from threading import Thread, Lock, Event, Timer
+
+import job_store
+import playbook_runner
+
+# Seconds between claim attempts while idle, and between event batches
+POLL_SECONDS = float(os.environ.get('VOS_WORKER_POLL_SECONDS', 2))
+RELAY_SECONDS = 0.5
+RELAY_BATCH_SIZE = 500
+
+# Attempts at delivering the last events and the exit code before giving up
+FINAL_ATTEMPTS = 10
+
+# Share of the lease after which a job that could not be renewed is killed;
+# the rest is left for SIGTERM, then SIGKILL, to take effect
+FENCE_FRACTION = 2 / 3.0
+
+
+class LeaseLost(Exception):
+    pass
+
+
+class Coordinator(object):
+    """JSON calls to the coordinator's /api/workers endpoints."""
+
+    def __init__(self, url, worker, token=None, timeout=30):
+        self.url = url.rstrip('/')
+        self.worker = worker
+        self.token = token
+        self.timeout = timeout
+
+    def post(self, path, payload=None, timeout=None):
+        """POST payload and return the decoded response, or None for 204.
+        Raises LeaseLost on 409 and OSError when the coordinator cannot be reached."""
+        body = dict(payload or {}, worker=self.worker)
+        request = urllib.request.Request(self.url + path, data=json.dumps(body).encode('utf-8'),
+                                         headers={'Content-Type': 'application/json'})
+        if self.token:
+            request.add_header('Authorization', 'Bearer {}'.format(self.token))
+        try:
+            with urllib.request.urlopen(request, timeout=timeout or self.timeout) as response:
+                if response.status == 204:
+                    return None
+                return json.loads(response.read().decode('utf-8'))
+        except urllib.error.HTTPError as e:
+            if e.code == 409:
+                raise LeaseLost(e.read().decode('utf-8', 'replace'))
+            raise OSError("{} returned {}: {}".format(path, e.code, e.read().decode('utf-8', 'replace')))
+
+
+class RemoteJob(object):
+    """One claimed job: runs its playbook and relays its progress."""
+
+    def __init__(self, coordinator, record, lease_seconds, claimed_at):
+        self.coordinator = coordinator
+        self.job = job_store.job_from_record(record)
+        self.path = '/api/workers/jobs/{}'.format(self.job.id)
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = max(1, lease_seconds / 3.0)
+        # When the last call that renewed the lease was sent; the coordinator
+        # renewed it later than that, so fencing from here is conservative
+        self.renewed_at = claimed_at
+        self.pending = []
+        self.pending_lock = Lock()
+        self.unsent = None  # (batch, events) not yet acknowledged
+        self.batch = 0
+        self.lost = False
+        self.done = Event()
+
+    def add(self, item):
+        with self.pending_lock:
+            self.pending.append(item)
+
+    def run(self):
+        job = self.job
+        print("Running job {} ({} device(s), attempt {})".format(job.id, len(job.devices), job.attempts))
+        relay = Thread(target=self._relay)
+        relay.daemon = True
+        relay.start()
+        heartbeat = Thread(target=self._heartbeat)
+        heartbeat.daemon = True
+        heartbeat.start()
+
+        return_code = None
+        error = None
+        try:
+            cmd_args = playbook_runner.job_command(job)
+            return_code = playbook_runner.run_playbook(
+                job.id, cmd_args, lambda line: self.add({'line': line}), lambda event: self.add({'callback': event}),
+                on_start=job.attach_process)
+        except Exception as e:
+            print("Error starting process for job {}: {}".format(job.id, str(e)))
+            error = str(e)
+        finally:
+            self.done.set()
+            relay.join()
+
+        if self.lost:
+            print("Job {} was stopped without its lease, not reporting its result".format(job.id))
+            return
+        for attempt in range(FINAL_ATTEMPTS):
+            try:
+                self._send()
+                self.coordinator.post(self.path + '/finish', {'return_code': return_code, 'error': error})
+                print("Job {} finished with return code {}".format(job.id, return_code))
+                return
+            except LeaseLost:
+                print("Job {} was taken over by another worker, not reporting its result".format(job.id))
+                return
+            except OSError as e:
+                print("Could not report job {} (attempt {}): {}".format(job.id, attempt + 1, str(e)))
+                time.sleep(min(30, 2 ** attempt))
+
+    def _send(self):
+        """Send the unacknowledged batch, then whatever is pending, in order."""
+        while True:
+            if self.unsent is None:
+                with self.pending_lock:
+                    items = self.pending[:RELAY_BATCH_SIZE]
+                    del self.pending[:RELAY_BATCH_SIZE]
+                if not items:
+                    return
+                self.batch += 1
+                self.unsent = (self.batch, items)
+            batch, items = self.unsent
+            response = self._renewing_post(self.path + '/events', {'batch': batch, 'events': items})
+            self.unsent = None
+            if response and response.get('cancel'):
+                self._cancel()
+
+    def _relay(self):
+        while not self.done.wait(RELAY_SECONDS):
+            try:
+                self._send()
+            except LeaseLost:
+                self._lose()
+                return
+            except OSError as e:
+                # Kept and sent again next round; the batch number stops duplicates
+                print("Could not relay events for job {}: {}".format(self.job.id, str(e)))
+
+    def _renewing_post(self, path, payload=None, timeout=None):
+        """Post a call that renews the lease, and remember when it was sent."""
+        sent_at = time.time()
+        response = self.coordinator.post(path, payload, timeout)
+        self.renewed_at = max(self.renewed_at, sent_at)
+        return response
+
+    def _heartbeat(self):
+        while not self.done.wait(self.heartbeat_seconds):
+            try:
+                # Bounded, so a hung connection cannot delay the fence check
+                response = self._renewing_post(self.path + '/heartbeat', timeout=self.heartbeat_seconds)
+            except LeaseLost:
+                self._lose()
+                return
+            except OSError as e:
+                print("Heartbeat for job {} failed: {}".format(self.job.id, str(e)))
+                if time.time() - self.renewed_at >= self.lease_seconds * FENCE_FRACTION:
+                    print("Job {} not renewed for {:.0f} s, stopping it before the lease runs out".format(
+                        self.job.id, time.time() - self.renewed_at))
+                    self._stop()
+                    return
+                continue
+            if response and response.get('cancel'):
+                self._cancel()
+
+    def _cancel(self):
+        if not self.job.cancel_requested:
+            print("Coordinator cancelled job {}".format(self.job.id))
+            self.job.cancel_requested = True
+            self.job.kill()
+
+    def _lose(self):
+        if not self.lost:
+            print("Lost the lease on job {}, stopping it".format(self.job.id))
+            self._stop()
+
+    def _stop(self):
+        """Kill the job for good without reporting it; the coordinator requeues it."""
+        self.lost = True
+        # Also stops a process that has not been attached yet
+        self.job.cancel_requested = True
+        if self.job.kill():
+            timer = Timer(self.lease_seconds * (1 - FENCE_FRACTION) / 2, self.job.kill, args=(signal.SIGKILL,))
+            timer.daemon = True
+            timer.start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run upgrade jobs claimed from a coordinator')
+    parser.add_argument('--coordinator', default=os.environ.get('VOS_COORDINATOR', 'http://127.0.0.1:5000'),
+                        help='Base URL of run_ansible.py')
+    parser.add_argument('--name', default='{}-{}'.format(socket.gethostname(), os.getpid()),
+                        help='Worker name, unique per worker process')
+    parser.add_argument('--slots', type=int, default=int(os.environ.get('VOS_WORKER_SLOTS', 4)),
+                        help='Jobs this worker runs at once')
+    args = parser.parse_args()
+
+    token = os.environ.get('VOS_WORKER_TOKEN')
+    if not token:
+        parser.error("VOS_WORKER_TOKEN must be set to the coordinator's worker token")
+    coordinator = Coordinator(args.coordinator, args.name, token)
+    stopping = Event()
+    active = []
+
+    def stop(signum, frame):
+        # Running jobs are finished and reported; no new ones are claimed
+        print("Worker {} stopping after {} running job(s)".format(args.name, len(active)))
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    print("Worker {} claiming jobs from {} ({} slot(s))".format(args.name, args.coordinator, args.slots))
+    while True:
+        active = [thread for thread in active if thread.is_alive()]
+        if stopping.is_set():
+            if not active:
+                break
+            time.sleep(POLL_SECONDS)
+            continue
+
+        claimed = None
+        claimed_at = time.time()
+        if len(active) < args.slots:
+            try:
+                claimed = coordinator.post('/api/workers/claim')
+            except (OSError, LeaseLost) as e:
+                print("Could not claim a job from {}: {}".format(args.coordinator, str(e)))
+        if claimed is None:
+            stopping.wait(POLL_SECONDS)
+            continue
+
+        remote = RemoteJob(coordinator, claimed['job'], claimed['lease_seconds'], claimed_at)
+        thread = Thread(target=remote.run)
+        thread.start()
+        active.append(thread)
+
+
+if __name__ == '__main__':
+    main()